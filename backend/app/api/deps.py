@@ -1,12 +1,27 @@
-from typing import Generator, Optional, List
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable, Dict, Generator, Optional, List
 
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, File, HTTPException, Query, Request, UploadFile, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, ExpiredSignatureError, JWTError
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, make_transient_to_detached
 
 from app.core import security
-from app.core.config import SECRET_KEY, ALGORITHM
+from app.core.cache import cache, user_cache_key
+from app.core.admission import policies
+from app.core.profiling import phase
+from app.core.tracing import span
+from app.core.config import (
+    SECRET_KEY,
+    ALGORITHM,
+    USER_CACHE_TTL_SECONDS,
+    BATCH_MAX_IDS,
+    IMAGE_MAX_UPLOAD_BYTES,
+    ADMISSION_ENABLED,
+    ADMISSION_RETRY_AFTER_SECONDS,
+    ADMISSION_TRUSTED_PROXIES,
+)
+from app.core.images import UnsupportedImage, sniff_extension
 from app.db import get_db
 from app.model.model import User as UserModel
 from app.schema.token import TokenData
@@ -17,10 +32,41 @@ reusable_oauth2 = OAuth2PasswordBearer(
     tokenUrl="/api/v1/auth/token"  # Matches the token endpoint in auth router
 )
 
+# columns kept in the user cache, hashed_password stays out of it and lazy loads if ever needed
+CACHED_USER_COLUMNS = ("id", "student_id", "name", "email", "role", "wants_email_notif")
+CACHED_USER_TIMESTAMPS = ("created_at", "updated_at")
+
+
+def _user_to_cache(user: UserModel) -> Dict[str, Any]:
+    data: Dict[str, Any] = {key: getattr(user, key) for key in CACHED_USER_COLUMNS}
+    data["role"] = user.role.value if user.role is not None else None
+    for key in CACHED_USER_TIMESTAMPS:
+        value = getattr(user, key)
+        data[key] = value.isoformat() if value is not None else None
+    return data
+
+
+def _user_from_cache(db: Session, data: Dict[str, Any]) -> UserModel:
+    values = dict(data)
+    values["role"] = UserRoleType(values["role"]) if values["role"] else None
+    for key in CACHED_USER_TIMESTAMPS:
+        if values[key] is not None:
+            values[key] = datetime.fromisoformat(values[key])
+    user = UserModel(**values)
+    # detached + merge(load=False) attaches it as persistent without a SELECT,
+    # columns not in the cache are expired and load on first access
+    make_transient_to_detached(user)
+    return db.merge(user, load=False)
+
 
 def get_current_user(
     db: Session = Depends(get_db), token: str = Depends(reusable_oauth2)
 ) -> UserModel:
+    with phase("auth"), span("auth"):
+        return _authenticate(db, token)
+
+
+def _authenticate(db: Session, token: str) -> UserModel:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -33,7 +79,8 @@ def get_current_user(
     )
     try:
 
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        with span("jwt.decode"):
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
 
         username: str = payload["sub"]
         token_data = TokenData(username=username, roles=payload.get("roles"))
@@ -45,6 +92,11 @@ def get_current_user(
         print("Caught error type:", type(e).__name__)  # JWTError
         raise credentials_exception
 
+    cache_key = user_cache_key(token_data.username)  # type: ignore
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return _user_from_cache(db, cached)
+
     user = (
         db.query(UserModel).filter(UserModel.email == token_data.username).first()
     )  # Or student_id based on what's in 'sub'
@@ -57,4 +109,96 @@ def get_current_user(
         if user is None:
             raise credentials_exception
     # db.refresh(user)
+    cache.set(cache_key, _user_to_cache(user), ttl=USER_CACHE_TTL_SECONDS)
     return user
+
+
+# ?ids=1,2,3 or ?ids=1&ids=2, deduplicated in request order
+def batch_ids(ids: List[str] = Query(...)) -> List[int]:
+    try:
+        parsed = [int(part) for value in ids for part in value.split(",") if part.strip()]
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="ids must be integers"
+        )
+    parsed = list(dict.fromkeys(parsed))
+    if len(parsed) > BATCH_MAX_IDS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {BATCH_MAX_IDS} ids per request",
+        )
+    return parsed
+
+
+# multipart "file" field, size capped while reading and type checked by magic bytes
+def image_upload(file: UploadFile = File(...)) -> bytes:
+    data = file.file.read(IMAGE_MAX_UPLOAD_BYTES + 1)
+    if len(data) > IMAGE_MAX_UPLOAD_BYTES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Images are limited to {IMAGE_MAX_UPLOAD_BYTES} bytes",
+        )
+    try:
+        sniff_extension(data)
+    except UnsupportedImage as e:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail=str(e)
+        )
+    return data
+
+
+def client_ip(request: Request) -> Optional[str]:
+    if ADMISSION_TRUSTED_PROXIES:
+        forwarded = [a.strip() for a in request.headers.get("x-forwarded-for", "").split(",") if a.strip()]
+        if len(forwarded) >= ADMISSION_TRUSTED_PROXIES:
+            # the entry added by the outermost trusted proxy, anything left of it is client supplied
+            return forwarded[-ADMISSION_TRUSTED_PROXIES]
+    return request.client.host if request.client else None
+
+
+async def _client_user(request: Request, ip: Optional[str]) -> Optional[str]:
+    """Verified token subject, or the username a login form was posted with plus the client IP."""
+    authorization = request.headers.get("authorization", "")
+    if authorization[:7].lower() == "bearer ":
+        try:
+            return jwt.decode(authorization[7:], SECRET_KEY, algorithms=[ALGORITHM])["sub"]
+        except (JWTError, KeyError):
+            return None  # rejected by get_current_user right after
+    if request.headers.get("content-type", "").startswith("application/x-www-form-urlencoded"):
+        # already parsed by FastAPI for the endpoint, starlette hands back the cached form
+        username = (await request.form()).get("username")
+        # the posted username is unverified, keyed alone anyone could lock its owner out
+        return f"{str(username).strip().lower()}|{ip}" if username else None
+    return None
+
+
+# route dependency: per IP and per user token buckets (429), then a concurrency slot (503)
+def admission(name: str) -> Callable[[Request], AsyncIterator[None]]:
+    policy = policies[name]
+
+    # async so requests are turned away on the event loop, before they take a threadpool thread
+    async def admit(request: Request) -> AsyncIterator[None]:
+        if not ADMISSION_ENABLED:
+            yield
+            return
+        ip = client_ip(request)
+        user = await _client_user(request, ip) if policy.per_user is not None else None
+        retry_after = policy.check_rates(ip, user)
+        if retry_after is not None:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests, slow down",
+                headers={"Retry-After": str(retry_after)},
+            )
+        if not await policy.slots.acquire():
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server busy, try again shortly",
+                headers={"Retry-After": str(ADMISSION_RETRY_AFTER_SECONDS)},
+            )
+        try:
+            yield
+        finally:
+            policy.slots.release()
+
+    return admit
@@ -0,0 +1,58 @@
+from typing import Callable, List, Optional, Type
+
+from fastapi import HTTPException, Query, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from sqlalchemy.orm import Query as OrmQuery
+
+
+def sparse_fields(schema: Type[BaseModel]) -> Callable[..., Optional[List[str]]]:
+    """Dependency for ?fields=id,name,status, limited to the fields of schema.
+
+    Computed fields such as thumbnail_url can be asked for too. id is always
+    included so rows can still be told apart.
+    """
+    allowed = [*schema.model_fields, *schema.model_computed_fields]
+
+    def dependency(
+        fields: Optional[str] = Query(
+            None, description=f"comma separated subset of: {', '.join(allowed)}"
+        ),
+    ) -> Optional[List[str]]:
+        if fields is None:
+            return None
+        requested = list(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+        unknown = [f for f in requested if f not in allowed]
+        if unknown:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unknown fields: {', '.join(unknown)}",
+            )
+        if "id" in allowed and "id" not in requested:
+            requested.insert(0, "id")
+        return requested
+
+    return dependency
+
+
+def select_fields(query: OrmQuery, model, schema: Type[BaseModel], fields: List[str]) -> List[dict]:
+    """Run query for the given fields of schema, as plain dicts.
+
+    Plain fields select only their columns. A computed field can depend on any
+    column, so asking for one loads whole rows and dumps them through schema.
+    """
+    if any(name in schema.model_computed_fields for name in fields):
+        include = set(fields)
+        return [
+            schema.model_validate(row, from_attributes=True).model_dump(mode="json", include=include)
+            for row in query.all()
+        ]
+    rows = query.with_entities(*[getattr(model, name) for name in fields]).all()
+    return jsonable_encoder([dict(zip(fields, row)) for row in rows])
+
+
+def fields_response(query: OrmQuery, model, schema: Type[BaseModel], fields: List[str]) -> JSONResponse:
+    # bypasses response_model on purpose, it would fail the required fields that were left out;
+    # rows keep the schema's names and JSON encoding
+    return JSONResponse(select_fields(query, model, schema, fields))
@@ -0,0 +1,105 @@
+from typing import Any, Dict, List, Literal, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import FileResponse
+
+from app.api.deps import get_current_user
+from app.api.routing import InstrumentedRoute
+from app.core import profiling
+from sqlalchemy.orm import Session
+
+from app.db import get_db, slow_query_log
+from app.model.model import NotificationJob, User as UserModel
+from app.schema.enums import UserRoleType
+
+router = APIRouter(route_class=InstrumentedRoute)
+
+
+def require_sao_admin(current_user: UserModel = Depends(get_current_user)) -> UserModel:
+    if current_user.role != UserRoleType.SAO_ADMIN:  # type: ignore
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to access this resource",
+        )
+    return current_user
+
+
+# recent request profiles, newest first, role 1
+@router.get("/profiles", response_model=List[Dict[str, Any]])
+def list_profiles(current_user: UserModel = Depends(require_sao_admin)):
+    return [
+        {key: value for key, value in summary.items() if key != "sql"}
+        for summary in profiling.list_summaries()
+    ]
+
+
+# phase timings and the SQL of one profiled request, role 1
+@router.get("/profiles/{profile_id}", response_model=Dict[str, Any])
+def get_profile(profile_id: str, current_user: UserModel = Depends(require_sao_admin)):
+    summary = profiling.load_summary(profile_id)
+    if summary is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found"
+        )
+    return summary
+
+
+# sampled stacks in collapsed format, feed to flamegraph.pl or speedscope, role 1
+@router.get("/profiles/{profile_id}/collapsed")
+def download_profile_stacks(
+    profile_id: str, current_user: UserModel = Depends(require_sao_admin)
+):
+    path = profiling.collapsed_path(profile_id)
+    if path is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found"
+        )
+    return FileResponse(path, media_type="text/plain", filename=f"profile-{profile_id}.collapsed")
+
+
+# statements over SLOW_QUERY_MS with their route, bind shapes and EXPLAIN plan, newest first, role 1
+@router.get("/slow-queries", response_model=List[Dict[str, Any]])
+def list_slow_queries(
+    route: Optional[str] = Query(None, description="only statements run by this route, e.g. GET /api/v1/events/"),
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: UserModel = Depends(require_sao_admin),
+):
+    entries = slow_query_log.entries()
+    if route is not None:
+        entries = [entry for entry in entries if entry["route"] == route]
+    return entries[:limit]
+
+
+# empty the slow query log, e.g. after shipping a fix, role 1
+@router.delete("/slow-queries", status_code=status.HTTP_204_NO_CONTENT)
+def clear_slow_queries(current_user: UserModel = Depends(require_sao_admin)):
+    slow_query_log.clear()
+
+
+# email fan-out jobs with their progress, newest first, role 1
+@router.get("/notification-jobs", response_model=List[Dict[str, Any]])
+def list_notification_jobs(
+    job_status: Optional[Literal["pending", "running", "done", "failed"]] = Query(None, alias="status"),
+    limit: int = Query(50, ge=1, le=500),
+    db: Session = Depends(get_db),
+    current_user: UserModel = Depends(require_sao_admin),
+):
+    query = db.query(NotificationJob)
+    if job_status is not None:
+        query = query.filter(NotificationJob.status == job_status)
+    return [
+        {
+            "id": job.id,
+            "kind": job.kind,
+            "event_id": job.event_id,
+            "status": job.status,
+            "sent": job.sent,
+            "refused": job.refused,
+            "attempts": job.attempts,
+            "last_error": job.last_error,
+            "next_attempt_at": job.next_attempt_at,
+            "created_at": job.created_at,
+            "updated_at": job.updated_at,
+        }
+        for job in query.order_by(NotificationJob.id.desc()).limit(limit)
+    ]
@@ -6,14 +6,17 @@ from sqlalchemy.orm import Session
 
 from app.core import security
 from app.core.config import ACCESS_TOKEN_EXPIRE_MINUTES
+from app.api.deps import admission
+from app.api.routing import InstrumentedRoute
 from app.db import get_db
 from app.model.model import User as UserModel , Club as ClubModel # Assuming your User model
 from app.schema.token import Token
 from app.schema.user import UserInDb # For response model if needed
 
-router = APIRouter()
+router = APIRouter(route_class=InstrumentedRoute)
 
-@router.post("/token", response_model=Token)
+# bcrypt is slow on purpose, admission keeps a login storm from taking every thread
+@router.post("/token", response_model=Token, dependencies=[Depends(admission("login"))])
 def login_for_access_token(
     db: Session = Depends(get_db),
     form_data: OAuth2PasswordRequestForm = Depends()
@@ -1,17 +1,44 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
-from typing import List, Optional
-
-from app.db import get_db
-from app.model.model import Club as ClubModel, User as UserModel, club_memberships
-from app.schema.club import ClubCreate, ClubUpdate, ClubInDb
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from app.api.routing import InstrumentedRoute
+from app.db import delete_where, get_db, get_read_db, insert_ignore
+from app.model.model import Club as ClubModel, Event as EventModel, User as UserModel, club_memberships
+from app.schema.club import (
+    ClubCreate,
+    ClubUpdate,
+    ClubInDb,
+    MembershipBulkRequest,
+    MembershipReplaceRequest,
+    MembershipBulkResult,
+    MembershipOutcome,
+)
+from app.schema.image import ImageUploadResult
 from app.schema.user import UserInDb
 from app.schema.enums import UserRoleType
-from app.api.deps import get_current_user
+from app.api.deps import admission, batch_ids, get_current_user, image_upload
+from app.api.fieldsets import fields_response, select_fields, sparse_fields
 from app.model.model import event_attendance
-from sqlalchemy import func
-
-router = APIRouter()
+from app.core.attendance import discard_pending
+from app.core.attendance_archive import archive_reader
+from app.core.cache import (
+    cache,
+    invalidate_feed,
+    club_list_key_prefix,
+    club_stats_key,
+)
+from app.core.config import (
+    BULK_MEMBERSHIP_MAX,
+    CLUB_LIST_CACHE_TTL_SECONDS,
+    SOFT_DELETE,
+    STATS_CACHE_TTL_SECONDS,
+)
+from app.core.images import UnsupportedImage, accept_upload, upload_result
+from sqlalchemy import func, or_
+
+router = APIRouter(route_class=InstrumentedRoute)
 
 
 # getting all clubs with optional pagination, role: 1-2-3
@@ -22,24 +49,47 @@ def get_all_clubs(
     skip: Optional[int] = None,
     limit: Optional[int] = None,
     active_only: bool = True,
-    db: Session = Depends(get_db),
+    fields: Optional[List[str]] = Depends(sparse_fields(ClubInDb)),
+    db: Session = Depends(get_read_db),
 ):
+    cache_key = f"{club_list_key_prefix()}{active_only}:{skip}:{limit}:{','.join(fields or [])}"
+    clubs = cache.get(cache_key)
+    if clubs is not None:
+        return JSONResponse(clubs) if fields else clubs
+
     query = db.query(ClubModel)
 
     if active_only:
         query = query.filter(ClubModel.is_active == True)
     if skip is not None and limit is not None and limit > skip:
-        clubs = query.offset(skip).limit(limit).all()
+        query = query.offset(skip).limit(limit)
+    if fields:
+        clubs = select_fields(query, ClubModel, ClubInDb, fields)
     else:
-        clubs = query.all()
+        clubs = [
+            ClubInDb.model_validate(club, from_attributes=True).model_dump(mode="json")
+            for club in query.all()
+        ]
+    cache.set(cache_key, clubs, ttl=CLUB_LIST_CACHE_TTL_SECONDS)
+    if fields:
+        return JSONResponse(clubs)
     return clubs
 
 
+# several clubs by id in one query, keyed by id, role: 1-2-3
+@router.get("/batch", response_model=Dict[int, ClubInDb])
+def get_clubs_batch(
+    ids: List[int] = Depends(batch_ids), db: Session = Depends(get_read_db)
+):
+    clubs = db.query(ClubModel).filter(ClubModel.id.in_(ids)).all()
+    return {club.id: club for club in clubs}
+
+
 # getting club by id , role: 1-2-3
 
 
 @router.get("/{club_id}", response_model=ClubInDb)
-def get_club_by_id(club_id: int, db: Session = Depends(get_db)):
+def get_club_by_id(club_id: int, db: Session = Depends(get_read_db)):
     club = db.query(ClubModel).filter(ClubModel.id == club_id).first()
     if not club:
         raise HTTPException(
@@ -56,7 +106,8 @@ def get_club_by_id(club_id: int, db: Session = Depends(get_db)):
 )  # Consider a ClubMemberWithRole schema
 def get_club_members(
     club_id: int,
-    db: Session = Depends(get_db),
+    fields: Optional[List[str]] = Depends(sparse_fields(UserInDb)),
+    db: Session = Depends(get_read_db),
     current_user: UserModel = Depends(get_current_user),
 ):
     club = db.query(ClubModel).filter(ClubModel.id == club_id).first()
@@ -77,13 +128,14 @@ def get_club_members(
             detail="Not authorized to view members of this club",
         )
 
-    members = (
+    query = (
         db.query(UserModel)
         .join(club_memberships)
         .filter(club_memberships.c.club_id == club_id)
-        .all()
     )
-    return members
+    if fields:
+        return fields_response(query, UserModel, UserInDb, fields)
+    return query.all()
 
 
 # creating a club , role:1
@@ -105,6 +157,7 @@ def create_club(
     db_club = ClubModel(**club.model_dump())
     db.add(db_club)
     db.commit()
+    cache.delete_prefix(club_list_key_prefix())
     db.refresh(db_club)
     return db_club
 
@@ -159,9 +212,195 @@ def add_member_to_club(
     )
     db.execute(stmt)
     db.commit()
+    invalidate_feed(current_user.id)  # type: ignore
+    cache.delete(club_stats_key(club_id))
     return {"detail": f"User {user_to_add.name} added to club {club.name}"}
 
 
+# rows per multi-row INSERT/DELETE, keeps bind parameters well under driver limits
+MEMBERSHIP_CHUNK = 1000
+
+
+def _authorize_roster(db: Session, club_id: int, current_user: UserModel) -> ClubModel:
+    club = db.query(ClubModel).filter(ClubModel.id == club_id).first()
+    if not club:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Club not found"
+        )
+    is_sao_admin = current_user.role == UserRoleType.SAO_ADMIN
+    is_club_manager = (
+        current_user.role == UserRoleType.CLUB_MANAGER
+        and current_user.id == club.manager_id
+    )
+    if not (is_sao_admin or is_club_manager):  # type: ignore
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to manage members of this club",
+        )
+    return club
+
+
+def _resolve_members(
+    db: Session, body: MembershipBulkRequest
+) -> Tuple[Dict[int, MembershipOutcome], List[MembershipOutcome]]:
+    """Map requested user/student ids to users in one query.
+
+    Returns the outcome of every resolved user keyed by user id, in request
+    order, and not_found outcomes for the rest.
+    """
+    if len(body.user_ids) + len(body.student_ids) > BULK_MEMBERSHIP_MAX:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {BULK_MEMBERSHIP_MAX} ids per request",
+        )
+    rows = []
+    if body.user_ids or body.student_ids:
+        rows = (
+            db.query(UserModel.id, UserModel.student_id)
+            .filter(
+                or_(
+                    UserModel.id.in_(body.user_ids),
+                    UserModel.student_id.in_(body.student_ids),
+                )
+            )
+            .all()
+        )
+    student_of = {user_id: student_id for user_id, student_id in rows}
+    user_of = {student_id: user_id for user_id, student_id in rows}
+
+    resolved: Dict[int, MembershipOutcome] = {}
+    missing: List[MembershipOutcome] = []
+    for user_id in body.user_ids:
+        if user_id in student_of:
+            resolved.setdefault(
+                user_id,
+                MembershipOutcome(user_id=user_id, student_id=student_of[user_id], status="not_member"),
+            )
+        else:
+            missing.append(MembershipOutcome(user_id=user_id, status="not_found"))
+    for student_id in body.student_ids:
+        if student_id in user_of:
+            resolved.setdefault(
+                user_of[student_id],
+                MembershipOutcome(user_id=user_of[student_id], student_id=student_id, status="not_member"),
+            )
+        else:
+            missing.append(MembershipOutcome(student_id=student_id, status="not_found"))
+    return resolved, missing
+
+
+def _chunks(ids: Iterable[int]) -> Iterable[List[int]]:
+    ids = list(ids)
+    for start in range(0, len(ids), MEMBERSHIP_CHUNK):
+        yield ids[start : start + MEMBERSHIP_CHUNK]
+
+
+def _insert_members(db: Session, club_id: int, user_ids: Iterable[int]) -> Set[int]:
+    # ON CONFLICT DO NOTHING ... RETURNING tells us which rows were new, even under concurrent joins
+    inserted: Set[int] = set()
+    for chunk in _chunks(user_ids):
+        stmt = (
+            insert_ignore(club_memberships, db.get_bind())
+            .values([{"club_id": club_id, "user_id": user_id} for user_id in chunk])
+            .returning(club_memberships.c.user_id)
+        )
+        inserted.update(db.execute(stmt).scalars())
+    return inserted
+
+
+def _delete_members(db: Session, club_id: int, user_ids: Iterable[int]) -> Set[int]:
+    deleted: Set[int] = set()
+    for chunk in _chunks(user_ids):
+        stmt = (
+            club_memberships.delete()
+            .where(
+                club_memberships.c.club_id == club_id,
+                club_memberships.c.user_id.in_(chunk),
+            )
+            .returning(club_memberships.c.user_id)
+        )
+        deleted.update(db.execute(stmt).scalars())
+    return deleted
+
+
+def _finish_bulk(
+    db: Session,
+    club_id: int,
+    outcomes: List[MembershipOutcome],
+    added: Set[int],
+    removed: Set[int],
+) -> MembershipBulkResult:
+    db.commit()
+    if added or removed:
+        invalidate_feed(*added, *removed)
+        cache.delete(club_stats_key(club_id))
+    return MembershipBulkResult(added=len(added), removed=len(removed), results=outcomes)
+
+
+# add many members at once (club fairs), role 1,2
+@router.post("/{club_id}/members/bulk", response_model=MembershipBulkResult)
+def add_members_bulk(
+    club_id: int,
+    body: MembershipBulkRequest,
+    db: Session = Depends(get_db),
+    current_user: UserModel = Depends(get_current_user),
+):
+    _authorize_roster(db, club_id, current_user)
+    resolved, missing = _resolve_members(db, body)
+    added = _insert_members(db, club_id, resolved)
+    for user_id, outcome in resolved.items():
+        outcome.status = "added" if user_id in added else "already_member"
+    return _finish_bulk(db, club_id, list(resolved.values()) + missing, added, set())
+
+
+# remove many members at once, role 1,2
+@router.post("/{club_id}/members/bulk-remove", response_model=MembershipBulkResult)
+def remove_members_bulk(
+    club_id: int,
+    body: MembershipBulkRequest,
+    db: Session = Depends(get_db),
+    current_user: UserModel = Depends(get_current_user),
+):
+    _authorize_roster(db, club_id, current_user)
+    resolved, missing = _resolve_members(db, body)
+    removed = _delete_members(db, club_id, resolved)
+    for user_id, outcome in resolved.items():
+        outcome.status = "removed" if user_id in removed else "not_member"
+    return _finish_bulk(db, club_id, list(resolved.values()) + missing, set(), removed)
+
+
+# replace the roster with exactly the given users (registrar sync), role 1,2
+# members not in the list are removed, everything runs in one transaction
+@router.put("/{club_id}/members", response_model=MembershipBulkResult)
+def replace_members(
+    club_id: int,
+    body: MembershipReplaceRequest,
+    db: Session = Depends(get_db),
+    current_user: UserModel = Depends(get_current_user),
+):
+    _authorize_roster(db, club_id, current_user)
+    resolved, missing = _resolve_members(db, body)
+    if not resolved and not body.allow_empty:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="None of the given users exist, the roster was left unchanged",
+        )
+    current = set(
+        db.execute(
+            club_memberships.select()
+            .with_only_columns(club_memberships.c.user_id)
+            .where(club_memberships.c.club_id == club_id)
+        ).scalars()
+    )
+    removed = _delete_members(db, club_id, current - set(resolved))
+    added = _insert_members(db, club_id, [u for u in resolved if u not in current])
+    for user_id, outcome in resolved.items():
+        outcome.status = "added" if user_id in added else "already_member"
+    outcomes = list(resolved.values()) + missing
+    outcomes += [MembershipOutcome(user_id=user_id, status="removed") for user_id in sorted(removed)]
+    return _finish_bulk(db, club_id, outcomes, added, removed)
+
+
 # update club partially depending on role, role 1,2
 @router.put("/{club_id}", response_model=ClubInDb)
 def update_club_by_id(
@@ -211,13 +450,89 @@ def update_club_by_id(
 
     for key, value in update_data.items():
         setattr(club, key, value)
+    if "image_url" in update_data:
+        club.image_key = None  # type: ignore
 
     db.add(club)
     db.commit()
+    cache.delete_prefix(club_list_key_prefix())
     db.refresh(club)
     return club
 
 
+# upload the club image, thumbnails are rendered in the background, role 1.2
+@router.put(
+    "/{club_id}/image",
+    response_model=ImageUploadResult,
+    status_code=status.HTTP_202_ACCEPTED,
+)
+def upload_club_image(
+    club_id: int,
+    data: bytes = Depends(image_upload),
+    db: Session = Depends(get_db),
+    current_user: UserModel = Depends(get_current_user),
+):
+    club = db.query(ClubModel).filter(ClubModel.id == club_id).first()
+    if not club:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Club not found"
+        )
+    is_sao_admin = current_user.role == UserRoleType.SAO_ADMIN
+    is_club_manager = (
+        current_user.role == UserRoleType.CLUB_MANAGER
+        and current_user.id == club.manager_id
+    )
+    if not (is_sao_admin or is_club_manager):  # type: ignore
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to update this club",
+        )
+
+    try:
+        key = accept_upload(data)
+    except UnsupportedImage as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e)
+        )
+    result = upload_result(key)
+    club.image_key = result["image_key"]  # type: ignore
+    club.image_url = result["image_url"]  # type: ignore
+    db.commit()
+    cache.delete_prefix(club_list_key_prefix())
+    return result
+
+
+# delete club, role 1
+@router.delete("/{club_id}", status_code=status.HTTP_200_OK)
+def delete_club_by_id(
+    club_id: int,
+    db: Session = Depends(get_db),
+    current_user: UserModel = Depends(get_current_user),
+):
+    if current_user.role != UserRoleType.SAO_ADMIN:  # type: ignore
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to delete this club",
+        )
+
+    event_ids = [
+        row.id for row in db.query(EventModel.id).filter(EventModel.club_id == club_id)
+    ]
+    # events, their attendance and the memberships go with it through ON DELETE CASCADE
+    if not delete_where(db, ClubModel, ClubModel.id == club_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Club not found"
+        )
+    if SOFT_DELETE:
+        # nothing cascades on an UPDATE, hide the club's events along with it
+        delete_where(db, EventModel, EventModel.club_id == club_id)
+    discard_pending(db, event_ids=event_ids)
+    db.commit()
+    cache.delete_prefix(club_list_key_prefix())
+    cache.delete(club_stats_key(club_id))
+    return {"detail": "Club deleted successfully"}
+
+
 @router.delete("/{club_id}/members/{user_id}", status_code=status.HTTP_200_OK)
 def remove_member_from_club(
     club_id: int,
@@ -254,6 +569,8 @@ def remove_member_from_club(
         )
 
     db.commit()
+    invalidate_feed(user_id)
+    cache.delete(club_stats_key(club_id))
     return {"detail": f"User {user_id} removed from club {club_id}"}
 
 
@@ -265,10 +582,10 @@ def remove_member_from_club(
 # This is effectively a filter on GET /events/
 
 
-@router.get("/{club_id}/stats", status_code=status.HTTP_200_OK)
+@router.get("/{club_id}/stats", status_code=status.HTTP_200_OK, dependencies=[Depends(admission("stats"))])
 def get_club_stats_by_id(
     club_id: int,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_user: UserModel = Depends(get_current_user),
 ):
     # Fetch club
@@ -290,6 +607,10 @@ def get_club_stats_by_id(
             detail="Not authorized to view club stats",
         )
 
+    stats = cache.get(club_stats_key(club_id))
+    if stats is not None:
+        return stats
+
     # Total number of events
     num_events = len(club.events)
 
@@ -311,13 +632,26 @@ def get_club_stats_by_id(
                 .group_by(event_attendance.c.event_id)
                 .all()
             )
-            total_attendance = sum([count for _, count in attendance_counts])
+            hot_counts = dict(attendance_counts)
+            archived_counts = archive_reader.counts(db, event_ids)
+            total_attendance = sum(
+                count for event_id, count in hot_counts.items() if event_id not in archived_counts
+            )
+            # cold events live in the archive, a check-in after archiving may repeat an archived one
+            for event_id, count in archived_counts.items():
+                if event_id in hot_counts:
+                    late = db.query(event_attendance.c.user_id).filter(event_attendance.c.event_id == event_id)
+                    attendees = set(archive_reader.attendees(db, event_id).tolist())  # type: ignore
+                    count = len(attendees.union(user_id for (user_id,) in late))
+                total_attendance += count
             avg_attendance = total_attendance / num_events if num_events > 0 else 0
         else:
             avg_attendance = 0
 
-    return {
+    stats = {
         "total_events": num_events,
         "total_members": num_members,
         "avg_attendance_per_event": avg_attendance,
     }
+    cache.set(club_stats_key(club_id), stats, ttl=STATS_CACHE_TTL_SECONDS)
+    return stats
@@ -1,28 +1,72 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+import asyncio
+import base64
+import binascii
+import json
+
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from typing import List, Optional
-from sqlalchemy import text
-from pydantic import BaseModel
-
-from app.db import get_db
+from typing import Any, Dict, List, Literal, Optional, Tuple
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import or_, select, text
+from pydantic import BaseModel, ValidationError
+import numpy as np
+
+from app.api.routing import InstrumentedRoute
+from app.db import delete_where, get_db, get_read_db, insert_ignore
 from app.model.model import (
+    FaceEmbedding,
     Event as EventModel,
     User as UserModel,
     Club as ClubModel,
     event_attendance,
+    club_memberships,
+    attendance_term,
+    ROOM_EXCLUSION_CONSTRAINT,
 )
-from app.schema.event import EventCreate, EventUpdate, EventInDb
+from app.schema.event import EventCreate, EventUpdate, EventInDb, RoomConflict
+from app.schema.image import ImageUploadResult
+from app.schema.kiosk import KioskAttendanceBatch, KioskBatchResult
 from app.schema.user import UserInDb
 from app.schema.enums import EventStatusType, UserRoleType
-from app.api.deps import get_current_user
+from app.api.deps import admission, batch_ids, get_current_user, image_upload
+from app.api.fieldsets import fields_response, sparse_fields
+from app.core import pubsub
+from app.core.attendance import (
+    attendance_buffer,
+    attendance_channel,
+    attendance_snapshot,
+    discard_pending,
+    publish_attendance,
+)
+from app.core.attendance_archive import archive_reader
+from app.core.cache import cache, club_stats_key, event_stats_key, invalidate_event_stats
+from app.core.conflicts import ROOM_HOLDING_STATUSES, conflict_report, find_conflicts
+from app.core.notifications import enqueue_event_posted
+from app.core.config import (
+    CALENDAR_MAX_DAYS,
+    SSE_HEARTBEAT_SECONDS,
+    STATS_CACHE_TTL_SECONDS,
+    ATTENDANCE_WRITE_BEHIND,
+    FACE_EMBEDDING_DIM,
+)
+from app.core.face_dedup import recent_matches
+from app.core.face_index import face_matcher
+from app.core.images import UnsupportedImage, accept_upload, upload_result
+from app.core.terms import current_term, term_bounds
 
-router = APIRouter()
+router = APIRouter(route_class=InstrumentedRoute)
 
 
 class AttendanceRequest(BaseModel):
-    embedding: List[float]  # 128-dimensional FaceNet embedding
+    embedding: Optional[List[float]] = None  # 128-dimensional FaceNet embedding
+    embedding_b64: Optional[str] = None  # same embedding as base64 little-endian floats
+    dtype: Literal["float32", "float16"] = "float32"  # element type of embedding_b64
     modelName: str  # "FaceNet"
-    event_id: str  # Event identifier
+    event_id: int  # Event identifier
     face_id: str  # Unique face identifier
 
 
@@ -33,29 +77,98 @@ class AttendanceRequest(BaseModel):
   "event_id": "your_event_id",
   "face_id": "face_12345_abc"
 }
+or "embedding_b64": "<base64 of 128 little-endian float32>" instead of "embedding",
+or the raw bytes as an application/octet-stream body with the other fields as query params
 """
 
+EMBEDDING_DTYPES = {"float32": np.dtype("<f4"), "float16": np.dtype("<f2")}
 
-# get all events with optional club_id filter and role based evenstatus access, role 1.2.3
-@router.get("/", response_model=List[EventInDb])
-def get_all_events(
-    skip: int = 0,
-    limit: int = 100,
-    status_filter: Optional[List[EventStatusType]] = Query(None),
-    club_id: Optional[int] = Query(None),
-    db: Session = Depends(get_db),
-    current_user: UserModel = Depends(get_current_user),
-):
 
-    query = db.query(EventModel)
+def _decode_embedding(raw: bytes, dtype: str) -> np.ndarray:
+    expected = FACE_EMBEDDING_DIM * EMBEDDING_DTYPES[dtype].itemsize
+    if len(raw) != expected:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Embedding must be {expected} bytes of {dtype}",
+        )
+    return _finite_embedding(np.frombuffer(raw, dtype=EMBEDDING_DTYPES[dtype]).astype(np.float32))
 
+
+def _finite_embedding(vector: np.ndarray) -> np.ndarray:
+    # NaN compares false against every threshold and would slip through the matchers,
+    # values beyond float32's range are inf by now
+    if not np.isfinite(vector).all():
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Embedding values must be finite numbers",
+        )
+    return vector
+
+
+# reads the probe straight into numpy instead of validating 128 floats one by one
+async def read_face_probe(
+    request: Request,
+    event_id: Optional[int] = Query(None),
+    face_id: Optional[str] = Query(None),
+    modelName: Optional[str] = Query(None),
+    dtype: Literal["float32", "float16"] = Query("float32"),
+) -> Tuple[AttendanceRequest, np.ndarray]:
+    body = await request.body()
+    if request.headers.get("content-type", "").startswith("application/octet-stream"):
+        if event_id is None or face_id is None or modelName is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="event_id, face_id and modelName query parameters are required",
+            )
+        payload = AttendanceRequest(
+            event_id=event_id, face_id=face_id, modelName=modelName, dtype=dtype
+        )
+        return payload, _decode_embedding(body, dtype)
+
+    try:
+        payload = AttendanceRequest.model_validate_json(body)
+    except ValidationError as e:
+        raise RequestValidationError(
+            [
+                {**error, "loc": ("body", *error["loc"])}
+                for error in e.errors(include_url=False, include_input=False)
+            ]
+        )
+    if payload.embedding_b64 is not None:
+        try:
+            raw = base64.b64decode(payload.embedding_b64, validate=True)
+        except binascii.Error:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="embedding_b64 is not valid base64",
+            )
+        return payload, _decode_embedding(raw, payload.dtype)
+    if payload.embedding is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="embedding or embedding_b64 is required",
+        )
+    if len(payload.embedding) != FACE_EMBEDDING_DIM:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Embedding must have {FACE_EMBEDDING_DIM} dimensions",
+        )
+    with np.errstate(over="ignore"):
+        vector = np.asarray(payload.embedding, dtype=np.float32)
+    return payload, _finite_embedding(vector)
+
+
+def _visible_statuses(
+    db: Session,
+    current_user: UserModel,
+    club_id: Optional[int],
+    status_filter: Optional[List[EventStatusType]],
+) -> List[EventStatusType]:
     is_student = bool(current_user.role == UserRoleType.STUDENT)
     is_admin = bool(current_user.role == UserRoleType.SAO_ADMIN)
     is_manager = bool(current_user.role == UserRoleType.CLUB_MANAGER)
     is_filtered_club_manager = False
     if club_id:
-
-        query = query.filter(EventModel.club_id == club_id)
         club = db.query(ClubModel).filter(ClubModel.id == club_id).first()
         if not club:
             raise HTTPException(
@@ -76,7 +189,6 @@ def get_all_events(
     admin_status = student_status + [EventStatusType.PLANNING, EventStatusType.PENDING]
     manager_status = admin_status + [EventStatusType.IDEATION]
     if status_filter:
-        print("status filter", status_filter)
         if is_student:
             used_status = [x for x in student_status if x in status_filter]
         if is_admin:
@@ -91,10 +203,150 @@ def get_all_events(
         if is_filtered_club_manager:  # type: ignore
 
             used_status = manager_status
-    print("used status:", used_status)
+    return used_status
+
+
+# get all events with optional club_id filter and role based evenstatus access, role 1.2.3
+# starts_after/starts_before/ends_after are range scans on the start_time indexes
+@router.get("/", response_model=List[EventInDb])
+def get_all_events(
+    skip: int = 0,
+    limit: int = 100,
+    status_filter: Optional[List[EventStatusType]] = Query(None),
+    club_id: Optional[int] = Query(None),
+    starts_after: Optional[datetime] = Query(None),
+    starts_before: Optional[datetime] = Query(None),
+    ends_after: Optional[datetime] = Query(None),
+    fields: Optional[List[str]] = Depends(sparse_fields(EventInDb)),
+    db: Session = Depends(get_read_db),
+    current_user: UserModel = Depends(get_current_user),
+):
+
+    query = db.query(EventModel)
+
+    used_status = _visible_statuses(db, current_user, club_id, status_filter)
+    if club_id:
+        query = query.filter(EventModel.club_id == club_id)
     query = query.filter(EventModel.status.in_(used_status))
-    events = query.offset(skip).limit(limit).all()
-    return events
+
+    if starts_after or starts_before or ends_after:
+        if starts_after:
+            query = query.filter(EventModel.start_time >= starts_after)
+        if starts_before:
+            query = query.filter(EventModel.start_time < starts_before)
+        if ends_after:
+            query = query.filter(EventModel.end_time >= ends_after)
+        query = query.order_by(EventModel.start_time, EventModel.id)
+
+    query = query.offset(skip).limit(limit)
+    if fields:
+        return fields_response(query, EventModel, EventInDb, fields)
+    return query.all()
+
+
+# calendar view, events bucketed by the day they start on, role 1.2.3
+# registered before /{event_id} so "calendar" is not parsed as an id
+@router.get("/calendar", response_model=Dict[date, List[EventInDb]])
+def get_events_calendar(
+    start: date,
+    end: Optional[date] = None,
+    status_filter: Optional[List[EventStatusType]] = Query(None),
+    club_id: Optional[int] = Query(None),
+    db: Session = Depends(get_read_db),
+    current_user: UserModel = Depends(get_current_user),
+):
+    if end is None:
+        end = start + timedelta(days=7)
+    if end <= start:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="end must be after start",
+        )
+    if (end - start).days > CALENDAR_MAX_DAYS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Calendar range is limited to {CALENDAR_MAX_DAYS} days",
+        )
+
+    used_status = _visible_statuses(db, current_user, club_id, status_filter)
+    query = db.query(EventModel).filter(
+        EventModel.start_time >= datetime.combine(start, time.min),
+        EventModel.start_time < datetime.combine(end, time.min),
+        EventModel.status.in_(used_status),
+    )
+    if club_id:
+        query = query.filter(EventModel.club_id == club_id)
+
+    days: Dict[date, List[EventModel]] = {}
+    day = start
+    while day < end:
+        days[day] = []
+        day += timedelta(days=1)
+    for event in query.order_by(EventModel.start_time, EventModel.id).all():
+        days[event.start_time.date()].append(event)  # type: ignore
+    return days
+
+
+# several events by id in one query, keyed by id, role 1.2.3
+# same visibility as GET /{event_id}, ids that are missing or hidden are left out
+@router.get("/batch", response_model=Dict[int, EventInDb])
+def get_events_batch(
+    ids: List[int] = Depends(batch_ids),
+    db: Session = Depends(get_read_db),
+    current_user: UserModel = Depends(get_current_user),
+):
+    # an event without a status is public in GET /{event_id}, NOT IN alone would drop it
+    conditions = [
+        EventModel.status.is_(None),
+        EventModel.status.notin_(
+            [EventStatusType.IDEATION, EventStatusType.PLANNING, EventStatusType.PENDING]
+        ),
+    ]
+    if current_user.role == UserRoleType.CLUB_MANAGER:
+        conditions.append(ClubModel.manager_id == current_user.id)
+    if current_user.role == UserRoleType.SAO_ADMIN:
+        conditions.append(EventModel.status.in_([EventStatusType.PLANNING, EventStatusType.PENDING]))
+    visible = or_(*conditions)
+    events = (
+        db.query(EventModel)
+        .join(ClubModel, ClubModel.id == EventModel.club_id)
+        .filter(EventModel.id.in_(ids), visible)
+        .all()
+    )
+    return {event.id: event for event in events}
+
+
+# rooms booked by two events at once, defaults to the current term, role 1.2
+# managers only get the conflicts involving one of their clubs' events
+@router.get("/conflicts", response_model=List[RoomConflict])
+def get_room_conflicts(
+    starts_after: Optional[datetime] = Query(None),
+    starts_before: Optional[datetime] = Query(None),
+    location: Optional[str] = Query(None, min_length=1),
+    db: Session = Depends(get_read_db),
+    current_user: UserModel = Depends(get_current_user),
+):
+    if current_user.role == UserRoleType.STUDENT:  # type: ignore
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to access this resource",
+        )
+    term_start, term_end = term_bounds(current_term())
+    since = starts_after or term_start
+    until = starts_before or term_end
+    if until <= since:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="starts_before must be after starts_after",
+        )
+    conflicts = conflict_report(db, since, until, location)
+    if current_user.role != UserRoleType.SAO_ADMIN:  # type: ignore
+        managed = {
+            club_id
+            for (club_id,) in db.query(ClubModel.id).filter(ClubModel.manager_id == current_user.id)
+        }
+        conflicts = [c for c in conflicts if any(e.club_id in managed for e in c["events"])]
+    return conflicts
 
 
 # get event by id, role 1.2.3
@@ -148,7 +400,8 @@ def get_event_by_id(
 @router.get("/{event_id}/attendees", response_model=List[UserInDb])
 def get_event_attendees(
     event_id: int,
-    db: Session = Depends(get_db),
+    fields: Optional[List[str]] = Depends(sparse_fields(UserInDb)),
+    db: Session = Depends(get_read_db),
     current_user: UserModel = Depends(get_current_user),  # Permissions vary
 ):
     if current_user.role == UserRoleType.STUDENT:  # type: ignore
@@ -180,13 +433,53 @@ def get_event_attendees(
             detail="Not club owner not authorized to view event attendees",
         )
 
-    attendees = (
+    query = (
         db.query(UserModel)
         .join(event_attendance)
         .filter(event_attendance.c.event_id == event_id)
-        .all()
     )
-    return attendees
+    archived = archive_reader.attendees(db, event_id)
+    if archived is not None:
+        hot = select(event_attendance.c.user_id).where(event_attendance.c.event_id == event_id)
+        query = db.query(UserModel).filter(
+            or_(UserModel.id.in_(archived.tolist()), UserModel.id.in_(hot))
+        )
+    if fields:
+        return fields_response(query, UserModel, UserInDb, fields)
+    return query.all()
+
+
+def _check_room_free(
+    db: Session,
+    location: str,
+    start_time: Optional[datetime],
+    end_time: Optional[datetime],
+    event_status: Optional[EventStatusType],
+    event_id: Optional[int] = None,
+) -> None:
+    if start_time is None or event_status not in ROOM_HOLDING_STATUSES:
+        return
+    conflicts = find_conflicts(db, location, start_time, end_time, exclude_id=event_id)
+    if conflicts:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"{location.strip()} is already booked at that time by event "
+            + ", ".join(str(e.id) for e in conflicts),
+        )
+
+
+def _commit_booking(db: Session, location: str) -> None:
+    # with EVENT_ROOM_EXCLUSION postgres catches the booking that raced past the check
+    try:
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        if ROOM_EXCLUSION_CONSTRAINT in str(e.orig):
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"{location} is already booked at that time",
+            )
+        raise
 
 
 # create event , role 2
@@ -223,13 +516,41 @@ def create_event(
             detail="Not authorized to create events for this club",
         )
 
+    _check_room_free(db, event.location, event.start_time, event.end_time, event.status)
+
     db_event = EventModel(**event.model_dump())
     db.add(db_event)
-    db.commit()
+    _commit_booking(db, event.location)
+    cache.delete(club_stats_key(event.club_id))
     db.refresh(db_event)
     return db_event
 
 
+def _record_attendance(db: Session, event_id: int, user_id: int) -> bool:
+    """Record a check-in, False if the user is already registered or queued."""
+    existing_attendance = (
+        db.query(event_attendance)
+        .filter(
+            event_attendance.c.event_id == event_id,
+            event_attendance.c.user_id == user_id,
+        )
+        .first()
+    )
+    if existing_attendance or attendance_buffer.is_pending(event_id, user_id):
+        return False
+
+    # queued rows are committed by the buffer within ATTENDANCE_FLUSH_MS
+    if ATTENDANCE_WRITE_BEHIND and attendance_buffer.running:
+        return attendance_buffer.add(event_id, user_id)
+
+    stmt = event_attendance.insert().values(event_id=event_id, user_id=user_id)
+    db.execute(stmt)
+    publish_attendance(db, event_id, [user_id])
+    db.commit()
+    invalidate_event_stats(event_id, db.query(EventModel.club_id).filter(EventModel.id == event_id).scalar())
+    return True
+
+
 # register attendence, role 2
 
 
@@ -275,24 +596,11 @@ def register_user_for_event(
             detail="Not authorized to register for this event",
         )
 
-    existing_attendance = (
-        db.query(event_attendance)
-        .filter(
-            event_attendance.c.event_id == event_id,
-            event_attendance.c.user_id == user_id,
-        )
-        .first()
-    )
-
-    if existing_attendance:
+    if not _record_attendance(db, event_id, user_id):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="User is already registered for this event",
         )
-
-    stmt = event_attendance.insert().values(event_id=event_id, user_id=user_id)
-    db.execute(stmt)
-    db.commit()
     return {"detail": f"User {user_id} registered for event {event_id}"}
 
 
@@ -337,15 +645,81 @@ def update_event_by_id(
         )
 
     update_data = event_update.model_dump(exclude_unset=True)
+    old_club_id = event.club_id
+    if update_data.keys() & {"location", "start_time", "end_time", "status"}:
+        _check_room_free(
+            db,
+            update_data.get("location", event.location),
+            update_data.get("start_time", event.start_time),
+            update_data.get("end_time", event.end_time),
+            update_data.get("status", event.status),
+            event_id,
+        )
     for key, value in update_data.items():
         setattr(event, key, value)
+    if "image_url" in update_data:
+        event.image_key = None  # type: ignore
+    if "start_time" in update_data:
+        # attendance rows follow their event's term, moving partitions on postgres
+        term = attendance_term(event.start_time, event.created_at)  # type: ignore
+        db.execute(
+            event_attendance.update()
+            .where(event_attendance.c.event_id == event_id, event_attendance.c.term != term)
+            .values(term=term)
+        )
 
     db.add(event)
-    db.commit()
+    _commit_booking(db, event.location)  # type: ignore
+    if event.club_id != old_club_id:
+        # moved to another club, both clubs' event counts change
+        cache.delete(club_stats_key(old_club_id))  # type: ignore
+        cache.delete(club_stats_key(event.club_id))  # type: ignore
     db.refresh(event)
     return event
 
 
+# upload the event image, thumbnails are rendered in the background, role 2
+@router.put(
+    "/{event_id}/image",
+    response_model=ImageUploadResult,
+    status_code=status.HTTP_202_ACCEPTED,
+)
+def upload_event_image(
+    event_id: int,
+    data: bytes = Depends(image_upload),
+    db: Session = Depends(get_db),
+    current_user: UserModel = Depends(get_current_user),
+):
+    event = db.query(EventModel).filter(EventModel.id == event_id).first()
+    if not event:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Event not found"
+        )
+    club = db.query(ClubModel).filter(ClubModel.id == event.club_id).first()
+    is_club_manager = (
+        club is not None
+        and current_user.role == UserRoleType.CLUB_MANAGER
+        and current_user.id == club.manager_id
+    )
+    if not is_club_manager:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to update this event",
+        )
+
+    try:
+        key = accept_upload(data)
+    except UnsupportedImage as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e)
+        )
+    result = upload_result(key)
+    event.image_key = result["image_key"]  # type: ignore
+    event.image_url = result["image_url"]  # type: ignore
+    db.commit()
+    return result
+
+
 # delete event, role 2
 
 
@@ -383,8 +757,11 @@ def delete_event_by_id(
             detail="Not authorized to delete this event",
         )
 
-    db.delete(event)
+    delete_where(db, EventModel, EventModel.id == event_id)
+    discard_pending(db, event_ids=[event_id])
     db.commit()
+    invalidate_event_stats(event_id, club.id)
+    recent_matches.drop_event(event_id)
     return {"detail": "Event deleted successfully"}
 
 
@@ -454,9 +831,14 @@ def update_event_status_by_id(
 
         if next_index >= len(status_flow):
             next_index = current_index - 1
+        if event.status == EventStatusType.IDEATION:  # type: ignore
+            # leaving ideation is when the event starts holding its room
+            _check_room_free(
+                db, event.location, event.start_time, event.end_time, status_flow[next_index], event_id  # type: ignore
+            )
         event.status = status_flow[next_index]  # type: ignore
         db.add(event)
-        db.commit()
+        _commit_booking(db, event.location)  # type: ignore
         db.refresh(event)
         return {"detail": f"Event status updated to {event.status}"}
     except ValueError:
@@ -495,6 +877,8 @@ def review_event(
 
     if approve:
         event.status = EventStatusType.POSTED  # type: ignore
+        # members are mailed by the notification worker after commit, not here
+        enqueue_event_posted(db, event.id)  # type: ignore
     else:
         event.status = EventStatusType.PLANNING  # type: ignore
 
@@ -504,10 +888,10 @@ def review_event(
     return {"detail": f"Event status updated to {event.status}"}
 
 
-@router.get("/{event_id}/stats")
+@router.get("/{event_id}/stats", dependencies=[Depends(admission("stats"))])
 def get_event_stats(
     event_id: int,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_user: UserModel = Depends(get_current_user),
 ):
     if current_user.role == UserRoleType.STUDENT:  # type: ignore
@@ -539,6 +923,16 @@ def get_event_stats(
             detail="Not club owner not authorized to view event attendees",
         )
 
+    stats = cache.get(event_stats_key(event_id))
+    if stats is not None:
+        return stats
+
+    archived = archive_reader.attendees(db, event_id)
+    if archived is not None:
+        stats = _archived_event_stats(db, event_id, club.id, archived)  # type: ignore
+        cache.set(event_stats_key(event_id), stats, ttl=STATS_CACHE_TTL_SECONDS)
+        return stats
+
     # 1. Total attendance
     total_attendance = db.execute(
         text("SELECT COUNT(*) FROM event_attendance WHERE event_id = :event_id"),
@@ -580,20 +974,144 @@ def get_event_stats(
         {"event_id": event_id, "club_id": club.id},
     ).scalar()
 
-    return {
+    stats = {
         "total_attendance": total_attendance,
         "attendance_rate": attendance_rate,
         "member_attendance_rate": member_attendance_rate,
         "non_member_attendance": non_member_attendance,
     }
+    cache.set(event_stats_key(event_id), stats, ttl=STATS_CACHE_TTL_SECONDS)
+    return stats
+
+
+# same numbers for an event whose attendance was moved to the archive, late rows may still be hot
+def _archived_event_stats(
+    db: Session, event_id: int, club_id: int, archived: np.ndarray
+) -> Dict[str, Any]:
+    attendees = set(archived.tolist())
+    attendees.update(
+        db.execute(
+            text("SELECT user_id FROM event_attendance WHERE event_id = :event_id"),
+            {"event_id": event_id},
+        ).scalars()
+    )
+    members = set(
+        db.execute(
+            text("SELECT user_id FROM club_memberships WHERE club_id = :club_id"),
+            {"club_id": club_id},
+        ).scalars()
+    )
+    total_users = db.execute(text("SELECT COUNT(*) FROM users")).scalar()
+    return {
+        "total_attendance": len(attendees),
+        "attendance_rate": len(attendees) / total_users if total_users else 0,
+        "member_attendance_rate": len(attendees & members) / len(members) if members else 0,
+        "non_member_attendance": len(attendees - members),
+    }
+
+
+def _authorize_attendance_stream(
+    db: Session, event_id: int, current_user: UserModel
+) -> Dict[str, Any]:
+    if current_user.role == UserRoleType.STUDENT:  # type: ignore
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Student Not authorized to view event attendees",
+        )
+
+    event = db.query(EventModel).filter(EventModel.id == event_id).first()
+    if not event:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Event not found"
+        )
+
+    is_admin = current_user.role == UserRoleType.SAO_ADMIN
+    is_manager = current_user.role == UserRoleType.CLUB_MANAGER
+    club = db.query(ClubModel).filter(ClubModel.id == event.club_id).first()
+    if not club:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Club not found"
+        )
+    is_event_owner = is_manager and current_user.id == club.manager_id
+
+    if not (bool(is_admin) or bool(is_event_owner)):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not club owner not authorized to view event attendees",
+        )
+    return attendance_snapshot(db, event_id)
 
 
-@router.post("/attendbyface", status_code=status.HTTP_200_OK)
+def _sse(event_name: str, data: Dict[str, Any]) -> str:
+    return f"event: {event_name}\ndata: {json.dumps(data)}\n\n"
+
+
+# live attendance count as server-sent events, role 1.2
+# one snapshot query on connect, then only pushes from pubsub, no polling
+@router.get("/{event_id}/attendance/stream")
+async def stream_event_attendance(
+    event_id: int,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: UserModel = Depends(get_current_user),
+):
+    channel = attendance_channel(event_id)
+    # subscribe before the snapshot so nothing committed in between is missed
+    queue = pubsub.broker.subscribe(channel)
+    try:
+        snapshot = await run_in_threadpool(
+            _authorize_attendance_stream, db, event_id, current_user
+        )
+    except Exception:
+        pubsub.broker.unsubscribe(channel, queue)
+        raise
+
+    async def event_stream():
+        last_count = snapshot["count"]
+        try:
+            yield _sse("attendance", snapshot)
+            while not await request.is_disconnected():
+                try:
+                    message = await asyncio.wait_for(
+                        queue.get(), timeout=SSE_HEARTBEAT_SECONDS
+                    )
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                # counts only grow, an older message can arrive after the snapshot
+                if message["count"] < last_count:
+                    continue
+                last_count = message["count"]
+                yield _sse("attendance", message)
+        finally:
+            pubsub.broker.unsubscribe(channel, queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post(
+    "/attendbyface",
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(admission("face"))],
+    openapi_extra={
+        "requestBody": {
+            "content": {
+                "application/json": {"schema": AttendanceRequest.model_json_schema()},
+                "application/octet-stream": {"schema": {"type": "string", "format": "binary"}},
+            }
+        }
+    },
+)
 def register_attendance_by_face(
-    request: AttendanceRequest,
+    probe: Tuple[AttendanceRequest, np.ndarray] = Depends(read_face_probe),
     db: Session = Depends(get_db),
     current_user: UserModel = Depends(get_current_user),
 ):
+    request, embedding = probe
     event_id = request.event_id
     is_manager = current_user.role == UserRoleType.CLUB_MANAGER
 
@@ -602,21 +1120,170 @@ def register_attendance_by_face(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not authorized to register attendees",
         )
+    # a manager already checked against this event within the dedup window skips the lookups
+    if not recent_matches.is_authorized(event_id, current_user.id):  # type: ignore
+        event = db.query(EventModel).filter(EventModel.id == event_id).first()
+        if not event:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Event not found"
+            )
+        is_event_owner = False
+        club = db.query(ClubModel).filter(ClubModel.id == event.club_id).first()
+        if not club:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Club not found"
+            )
+        is_event_owner = is_manager and current_user.id == club.manager_id
+
+        if not (bool(is_event_owner)):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Not club owner not authorized to register attendees",
+            )
+        recent_matches.authorize(event_id, current_user.id)  # type: ignore
+
+    # another camera already matched this face here, answered without the index or the database
+    recent = recent_matches.find(event_id, embedding)
+    if recent is not None:
+        return _face_attendance_response(event_id, *recent, registered=False)
+
+    match = face_matcher.match(embedding)
+    if match is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="No enrolled student matches this face"
+        )
+    user_id, similarity = match
+    if recent_matches.seen(event_id, user_id):
+        return _face_attendance_response(event_id, user_id, similarity, registered=False)
+    # the index can lag behind a deleted account until the next rebuild
+    if db.get(UserModel, user_id) is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="No enrolled student matches this face"
+        )
+
+    registered = _record_attendance(db, event_id, user_id)
+    recent_matches.add(event_id, user_id, embedding)
+    return _face_attendance_response(event_id, user_id, similarity, registered)
+
+
+def _face_attendance_response(event_id: int, user_id: int, similarity: float, registered: bool):
+    return {
+        "user_id": user_id,
+        "similarity": round(similarity, 4),
+        "already_registered": not registered,
+        "detail": f"User {user_id} registered for event {event_id}"
+        if registered
+        else "User is already registered for this event",
+    }
+
+
+def _kiosk_club(db: Session, event_id: int, current_user: UserModel) -> Tuple[EventModel, ClubModel]:
     event = db.query(EventModel).filter(EventModel.id == event_id).first()
     if not event:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Event not found"
         )
-    is_event_owner = False
     club = db.query(ClubModel).filter(ClubModel.id == event.club_id).first()
     if not club:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Club not found"
         )
-    is_event_owner = is_manager and current_user.id == club.manager_id
-
-    if not (bool(is_event_owner)):
+    is_admin = current_user.role == UserRoleType.SAO_ADMIN
+    is_event_owner = current_user.role == UserRoleType.CLUB_MANAGER and current_user.id == club.manager_id
+    if not (bool(is_admin) or bool(is_event_owner)):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not club owner not authorized to register attendees",
+            detail="Not club owner not authorized to run a kiosk for this event",
+        )
+    return event, club
+
+
+# everything a kiosk needs to check in this event offline: the event, its club, roster and face embeddings, role 1.2
+@router.get("/{event_id}/kiosk-snapshot")
+def get_kiosk_snapshot(
+    event_id: int,
+    db: Session = Depends(get_read_db),
+    current_user: UserModel = Depends(get_current_user),
+):
+    event, club = _kiosk_club(db, event_id, current_user)
+    members = select(club_memberships.c.user_id).where(club_memberships.c.club_id == club.id)
+    users = (
+        db.query(UserModel)
+        .filter(or_(UserModel.id.in_(members), UserModel.id == club.manager_id))
+        .order_by(UserModel.id)
+        .all()
+    )
+    embeddings = (
+        db.query(FaceEmbedding.user_id, FaceEmbedding.model_name, FaceEmbedding.embedding)
+        .filter(FaceEmbedding.user_id.in_(members))
+        .all()
+    )
+    return {
+        "generated_at": datetime.utcnow().isoformat(),
+        "event": EventInDb.model_validate(event, from_attributes=True).model_dump(mode="json"),
+        "club": {
+            "id": club.id,
+            "name": club.name,
+            "description": club.description,
+            "color_code": club.color_code,
+            "is_active": club.is_active,
+            "manager_id": club.manager_id,
+        },
+        "users": [
+            {
+                "id": user.id,
+                "student_id": user.student_id,
+                "name": user.name,
+                "email": user.email,
+                "role": user.role.value if user.role is not None else None,
+                "wants_email_notif": user.wants_email_notif,
+            }
+            for user in users
+        ],
+        "members": [user_id for (user_id,) in db.execute(members)],
+        "embeddings": [
+            {"user_id": user_id, "model_name": model_name, "embedding": base64.b64encode(data).decode()}
+            for user_id, model_name, data in embeddings
+        ],
+    }
+
+
+# attendance recorded offline by a kiosk, safe to resend: rows already present are counted as duplicates, role 1.2
+@router.post("/{event_id}/attendance/batch", response_model=KioskBatchResult)
+def upload_kiosk_attendance(
+    event_id: int,
+    batch: KioskAttendanceBatch,
+    db: Session = Depends(get_db),
+    current_user: UserModel = Depends(get_current_user),
+):
+    event, _ = _kiosk_club(db, event_id, current_user)
+    term = attendance_term(event.start_time, event.created_at)  # type: ignore
+    records = {record.user_id: record.recorded_at for record in batch.records}
+    known = {
+        user_id
+        for (user_id,) in db.query(UserModel.id).filter(UserModel.id.in_(list(records)))
+    }
+    unknown = sorted(set(records) - known)
+    inserted: List[int] = []
+    if known:
+        stmt = (
+            insert_ignore(event_attendance, db.get_bind())
+            .values(
+                [
+                    {"event_id": event_id, "user_id": user_id, "recorded_at": records[user_id], "term": term}
+                    for user_id in sorted(known)
+                ]
+            )
+            .returning(event_attendance.c.user_id)
         )
+        inserted = [user_id for (user_id,) in db.execute(stmt)]
+        if inserted:
+            publish_attendance(db, event_id, inserted)
+        db.commit()
+        invalidate_event_stats(event_id, event.club_id)  # type: ignore
+    return {
+        "batch_id": batch.batch_id,
+        "inserted": len(inserted),
+        "duplicates": len(known) - len(inserted),
+        "unknown_users": unknown,
+    }
@@ -0,0 +1,36 @@
+from typing import Any, Dict
+
+from fastapi import APIRouter, Depends, HTTPException, status
+
+from app.api.deps import get_current_user
+from app.api.routing import InstrumentedRoute
+from app.core.attendance import attendance_buffer
+from app.kiosk.sync import kiosk_sync
+from app.model.model import User as UserModel
+from app.schema.enums import UserRoleType
+
+router = APIRouter(route_class=InstrumentedRoute)
+
+
+def require_operator(current_user: UserModel = Depends(get_current_user)) -> UserModel:
+    if current_user.role == UserRoleType.STUDENT:  # type: ignore
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to access this resource",
+        )
+    return current_user
+
+
+# rows waiting for the central API, rejected rows and pulled snapshots, kiosk mode only, role 1.2
+@router.get("/status", response_model=Dict[str, Any])
+def get_kiosk_status(current_user: UserModel = Depends(require_operator)):
+    return kiosk_sync.status()
+
+
+# sync now instead of at the next interval, e.g. once the network is back, role 1.2
+@router.post("/sync", status_code=status.HTTP_202_ACCEPTED)
+def trigger_kiosk_sync(current_user: UserModel = Depends(require_operator)):
+    # check-ins still held by the write-behind buffer go out with this sync
+    attendance_buffer.flush()
+    kiosk_sync.poke()
+    return {"detail": "Sync started"}
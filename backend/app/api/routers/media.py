@@ -0,0 +1,53 @@
+import os
+
+from fastapi import APIRouter, HTTPException, Request, Response, status
+from fastapi.responses import FileResponse
+
+from app.api.routing import InstrumentedRoute
+from app.core.images import (
+    CONTENT_TYPES,
+    KEY_RE,
+    VARIANT_RE,
+    image_dir,
+    original_name,
+    thumbnail_urls,
+    thumbnailer,
+)
+
+router = APIRouter(route_class=InstrumentedRoute)
+
+# a key is the sha256 of the upload, so a variant's bytes never change
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+# uploaded images and their thumbnails, public
+@router.get("/{image_key}/{variant}")
+def get_media(image_key: str, variant: str, request: Request):
+    if not KEY_RE.match(image_key) or not VARIANT_RE.match(variant):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
+
+    path = os.path.join(image_dir(image_key), variant)
+    if not os.path.exists(path):
+        # not rendered yet, or rendered by nothing: the uploading worker may have died or be
+        # another process. Serve the original uncached and queue the render here.
+        original = original_name(image_key)
+        if original is None or variant not in thumbnail_urls(image_key):
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
+        thumbnailer.ensure(image_key)
+        return FileResponse(
+            os.path.join(image_dir(image_key), original),
+            media_type=CONTENT_TYPES[original.rsplit(".", 1)[1]],
+            headers={"Cache-Control": "no-store"},
+        )
+
+    etag = f'"{image_key[:16]}-{variant}"'
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED,
+            headers={"ETag": etag, "Cache-Control": IMMUTABLE},
+        )
+    return FileResponse(
+        path,
+        media_type=CONTENT_TYPES[variant.rsplit(".", 1)[1]],
+        headers={"ETag": etag, "Cache-Control": IMMUTABLE},
+    )
@@ -1,23 +1,39 @@
-from fastapi import APIRouter, status, Depends, HTTPException
+import base64
+import binascii
+from datetime import datetime
+
+from fastapi import APIRouter, status, Depends, HTTPException, Query
+from sqlalchemy import and_, or_
 from sqlalchemy.orm import Session
 from passlib.context import CryptContext  # Added
-from typing import List
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
 
-from app.db import get_db
+from app.api.routing import InstrumentedRoute
+from app.db import delete_where, get_db, get_read_db
 from app.model.model import (
     User as UserModel,
     Club as ClubModel,
     Event as EventModel,
+    FaceEmbedding,
     club_memberships,
     event_attendance,
 )
-from app.schema.user import UserCreate, UserUpdate, UserInDb
-from app.schema.club import ClubInDb  # Added
-from app.schema.event import EventInDb  # Added
-from app.api.deps import get_current_user
-from app.model.enums import UserRoleType  # Changed from app.schema.enums
+from app.schema.user import UserCreate, UserUpdate, UserInDb, FaceEnrollment
+from app.schema.club import ClubInDb, ClubRecommendation  # Added
+from app.schema.event import EventInDb, EventFeedPage  # Added
+from app.api.deps import admission, batch_ids, get_current_user
+from app.api.fieldsets import fields_response, sparse_fields
+from app.model.enums import UserRoleType, EventStatusType  # Changed from app.schema.enums
+from app.core.attendance import discard_pending
+from app.core.attendance_archive import archive_reader
+from app.core.cache import cache, feed_key_prefix, invalidate_user
+from app.core.config import FEED_CACHE_TTL_SECONDS, FEED_PAGE_MAX, FACE_EMBEDDING_DIM, RECOMMEND_TOP_K
+from app.core.face_index import face_matcher
+from app.core.recommendations import club_recommender
 
-router = APIRouter()
+router = APIRouter(route_class=InstrumentedRoute)
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")  # Added
 
@@ -30,6 +46,84 @@ def get_current_user_me(
     return current_user
 
 
+def _encode_feed_cursor(start_time: datetime, event_id: int) -> str:
+    raw = f"{start_time.isoformat()}|{event_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def _decode_feed_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        start_time, event_id = base64.urlsafe_b64decode(cursor).decode().split("|")
+        return datetime.fromisoformat(start_time), int(event_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+        )
+
+
+# upcoming events from the current user's clubs, keyset paginated on (start_time, id)
+@router.get("/me/feed", response_model=EventFeedPage)
+def get_current_user_feed(
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1),
+    db: Session = Depends(get_db),
+    current_user: UserModel = Depends(get_current_user),
+):
+    limit = min(limit, FEED_PAGE_MAX)
+    after = _decode_feed_cursor(cursor) if cursor else None
+    # keyed on the decoded cursor, re-encoded, never on the raw client string
+    cache_key = f"{feed_key_prefix(current_user.id)}{_encode_feed_cursor(*after) if after else ''}:{limit}"  # type: ignore
+    page = cache.get(cache_key)
+    if page is not None:
+        return page
+
+    query = (
+        db.query(EventModel)
+        .join(club_memberships, club_memberships.c.club_id == EventModel.club_id)
+        .filter(
+            club_memberships.c.user_id == current_user.id,
+            EventModel.status.in_([EventStatusType.POSTED, EventStatusType.CURRENT]),
+            EventModel.start_time.isnot(None),
+            or_(
+                EventModel.start_time >= datetime.now(),
+                EventModel.status == EventStatusType.CURRENT,
+            ),
+        )
+    )
+    if after:
+        after_start, after_id = after
+        query = query.filter(
+            or_(
+                EventModel.start_time > after_start,
+                and_(EventModel.start_time == after_start, EventModel.id > after_id),
+            )
+        )
+    events = query.order_by(EventModel.start_time, EventModel.id).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(events) > limit:
+        events = events[:limit]
+        next_cursor = _encode_feed_cursor(events[-1].start_time, events[-1].id)  # type: ignore
+
+    page = EventFeedPage(
+        items=[EventInDb.model_validate(event, from_attributes=True) for event in events],
+        next_cursor=next_cursor,
+    ).model_dump(mode="json")
+    cache.set(cache_key, page, ttl=FEED_CACHE_TTL_SECONDS)
+    return page
+
+
+# clubs the current user has not joined yet, read from the precomputed model without sql
+# (the biggest clubs from sql until the first model is built)
+@router.get("/me/recommended-clubs", response_model=List[ClubRecommendation])
+def get_recommended_clubs(
+    limit: int = Query(10, ge=1, le=RECOMMEND_TOP_K),
+    db: Session = Depends(get_read_db),
+    current_user: UserModel = Depends(get_current_user),
+):
+    return club_recommender.recommend(db, current_user.id, limit)  # type: ignore
+
+
 # get all users only sao
 @router.get("/", response_model=List[UserInDb])
 def get_all_users(
@@ -37,14 +131,33 @@ def get_all_users(
     current_user: UserModel = Depends(get_current_user),
     skip: int = 0,
     limit: int = 100,
+    fields: Optional[List[str]] = Depends(sparse_fields(UserInDb)),
 ):  # Added current_user dependency
     if current_user.role != UserRoleType.SAO_ADMIN:  # type: ignore
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not authorized to access this resource",
         )
-    users = db.query(UserModel).offset(skip).limit(limit).all()
-    return users
+    query = db.query(UserModel).offset(skip).limit(limit)
+    if fields:
+        return fields_response(query, UserModel, UserInDb, fields)
+    return query.all()
+
+
+# several users by id in one query, keyed by id
+# sao and managers see everyone, anyone else only themselves
+@router.get("/batch", response_model=Dict[int, UserInDb])
+def get_users_batch(
+    ids: List[int] = Depends(batch_ids),
+    db: Session = Depends(get_read_db),
+    current_user: UserModel = Depends(get_current_user),
+):
+    if current_user.role not in (UserRoleType.SAO_ADMIN, UserRoleType.CLUB_MANAGER):
+        ids = [user_id for user_id in ids if user_id == current_user.id]
+    if not ids:
+        return {}
+    users = db.query(UserModel).filter(UserModel.id.in_(ids)).all()
+    return {user.id: user for user in users}
 
 
 # get user by id only sao or admin
@@ -106,15 +219,48 @@ def update_current_user_me(
     for key in list(user_update_data.keys()):
         if key in not_allowed_fields:
             del user_update_data[key]
+    old_email, old_student_id = current_user.email, current_user.student_id
     for key, value in user_update_data.items():
         setattr(current_user, key, value)
 
     db.add(current_user)
     db.commit()
+    invalidate_user(old_email, old_student_id)  # type: ignore
     db.refresh(current_user)
     return current_user
 
 
+# enroll or replace the current user's face for check-in by camera
+@router.put("/me/face", status_code=status.HTTP_200_OK, dependencies=[Depends(admission("face"))])
+def enroll_current_user_face(
+    enrollment: FaceEnrollment,
+    db: Session = Depends(get_db),
+    current_user: UserModel = Depends(get_current_user),
+):
+    if len(enrollment.embedding) != FACE_EMBEDDING_DIM:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Embedding must have {FACE_EMBEDDING_DIM} dimensions",
+        )
+    with np.errstate(over="ignore"):
+        vector = np.asarray(enrollment.embedding, dtype=np.float32)
+    # values beyond float32's range are inf by now
+    if not np.isfinite(vector).all():
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Embedding values must be finite numbers",
+        )
+    face = db.get(FaceEmbedding, current_user.id)
+    if face is None:
+        face = FaceEmbedding(user_id=current_user.id)
+        db.add(face)
+    face.embedding = vector.tobytes()  # type: ignore
+    face.model_name = enrollment.modelName  # type: ignore
+    db.commit()
+    face_matcher.enroll(current_user.id, vector)  # type: ignore
+    return {"detail": "Face enrolled"}
+
+
 # update user by id (Admin)
 @router.put("/{user_id}", response_model=UserInDb)
 def update_user_by_id(
@@ -136,11 +282,13 @@ def update_user_by_id(
         )
 
     user_update_data = user_data.model_dump(exclude_unset=True)
+    old_email, old_student_id = db_user.email, db_user.student_id
     for key, value in user_update_data.items():
         setattr(db_user, key, value)
 
     db.add(db_user)
     db.commit()
+    invalidate_user(old_email, old_student_id)  # type: ignore
     db.refresh(db_user)
     return db_user
 
@@ -164,8 +312,13 @@ def delete_user_by_id(
             status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
         )
 
-    db.delete(db_user)
+    email, student_id = db_user.email, db_user.student_id
+    # memberships, attendance and the face embedding go with it through ON DELETE CASCADE
+    delete_where(db, UserModel, UserModel.id == user_id)
+    discard_pending(db, user_id=user_id)
     db.commit()
+    invalidate_user(email, student_id)  # type: ignore
+    face_matcher.remove(user_id)
     return {"detail": "User deleted successfully"}
 
 
@@ -218,4 +371,7 @@ def get_events_attended_by_user(
         .filter(event_attendance.c.user_id == user_id)
         .all()
     )
+    archived_ids = set(archive_reader.events_for_user(db, user_id)) - {e.id for e in events}
+    if archived_ids:
+        events += db.query(EventModel).filter(EventModel.id.in_(archived_ids)).all()
     return events
@@ -0,0 +1,104 @@
+import asyncio
+import functools
+import time
+from contextvars import ContextVar
+from typing import Callable, Dict, Optional
+
+from fastapi import Request, Response
+from fastapi.routing import APIRoute
+
+from app.core import tracing
+from app.core.profiling import current_profile, phase
+from app.db import current_route
+
+# handler_start / handler_end of the request being profiled or traced, in time.time_ns()
+_marks: ContextVar[Optional[Dict[str, int]]] = ContextVar("route_marks", default=None)
+
+
+def _timed_endpoint(endpoint: Callable) -> Callable:
+    # include_router builds the route again from the already wrapped endpoint
+    if getattr(endpoint, "_timed", False):
+        return endpoint
+    name = endpoint.__name__
+    # functools.wraps keeps __wrapped__, so FastAPI still reads the original signature
+    if asyncio.iscoroutinefunction(endpoint):
+
+        @functools.wraps(endpoint)
+        async def async_wrapper(*args, **kwargs):
+            marks = _marks.get()
+            if marks is None:
+                return await endpoint(*args, **kwargs)
+            marks["handler_start"] = time.time_ns()
+            try:
+                with phase("handler"), tracing.span("handler", **{"code.function": name}):
+                    return await endpoint(*args, **kwargs)
+            finally:
+                marks["handler_end"] = time.time_ns()
+
+        async_wrapper._timed = True  # type: ignore
+        return async_wrapper
+
+    @functools.wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        marks = _marks.get()
+        if marks is None:
+            return endpoint(*args, **kwargs)
+        marks["handler_start"] = time.time_ns()
+        try:
+            with phase("handler"), tracing.span("handler", **{"code.function": name}):
+                return endpoint(*args, **kwargs)
+        finally:
+            marks["handler_end"] = time.time_ns()
+
+    wrapper._timed = True  # type: ignore
+    return wrapper
+
+
+class InstrumentedRoute(APIRoute):
+    """APIRoute that splits a profiled or traced request into its phases.
+
+    dependencies covers auth and request validation up to the handler call,
+    serialization covers response_model validation and JSON encoding after it.
+    Every request also records its route template for the slow query log.
+    """
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        super().__init__(path, _timed_endpoint(endpoint), **kwargs)
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def timed_handler(request: Request) -> Response:
+            route_token = current_route.set(f"{request.method} {self.path_format}")
+            try:
+                return await instrumented_handler(request)
+            finally:
+                current_route.reset(route_token)
+
+        async def instrumented_handler(request: Request) -> Response:
+            profile = current_profile.get()
+            request_span = tracing.current_span.get()
+            if profile is None and request_span is None:
+                return await handler(request)
+            if request_span is not None:
+                request_span.name = f"{request.method} {self.path_format}"
+                request_span.attributes["http.route"] = self.path_format
+            marks: Dict[str, int] = {}
+            token = _marks.set(marks)
+            start = time.time_ns()
+            try:
+                response = await handler(request)
+            finally:
+                _marks.reset(token)
+            end = time.time_ns()
+            handler_start = marks.get("handler_start")
+            handler_end = marks.get("handler_end")
+            if handler_start is not None and handler_end is not None:
+                if profile is not None:
+                    profile.add_phase("dependencies", (handler_start - start) / 1e9)
+                    profile.add_phase("serialization", (end - handler_end) / 1e9)
+                tracing.record_span("dependencies", start, handler_start)
+                tracing.record_span("serialization", handler_end, end)
+            return response
+
+        return timed_handler
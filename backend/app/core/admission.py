@@ -0,0 +1,122 @@
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Optional, Tuple
+
+from app.core.config import (
+    ADMISSION_MAX_KEYS,
+    ADMISSION_POLICIES,
+    ADMISSION_QUEUE_TIMEOUT_MS,
+)
+
+
+class RateLimiter:
+    """Token bucket per client key, count requests per seconds with bursts up to count."""
+
+    def __init__(self, count: float, seconds: float, max_keys: int = 100000):
+        self.capacity = count
+        self.rate = count / seconds
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()  # key -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def take(self, key: str) -> Optional[float]:
+        """Spend one token of key's bucket, or the seconds until one is available."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = None
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            # a key dropped here comes back with a full bucket, only idle keys get that far
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+class ConcurrencyLimiter:
+    """At most limit requests at once, up to max_queue more wait briefly for a slot.
+
+    Lives on the worker's event loop: acquire and release are called from
+    async dependencies only, so no lock is needed. Anything beyond the queue,
+    or still waiting after timeout, is turned away instead of piling up in
+    the threadpool.
+    """
+
+    def __init__(self, limit: int, max_queue: int, timeout: float):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    async def acquire(self) -> bool:
+        if self.limit <= 0:
+            return True
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return True
+        if len(self._waiters) >= self.max_queue or self.timeout <= 0:
+            return False
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.timeout)
+            return True
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                # the slot was handed over just as the wait ran out, keep it
+                return True
+            waiter.cancel()
+            return False
+        except asyncio.CancelledError:
+            # client went away, pass on a slot it was given meanwhile
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            waiter.cancel()
+            raise
+        finally:
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                pass
+
+    def release(self) -> None:
+        if self.limit <= 0:
+            return
+        # the slot passes straight to the oldest waiter, active stays the same
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+
+class Policy:
+    def __init__(self, name: str, concurrency: int, queue: int, per_ip=None, per_user=None):
+        self.name = name
+        self.slots = ConcurrencyLimiter(concurrency, queue, ADMISSION_QUEUE_TIMEOUT_MS / 1000)
+        self.per_ip = RateLimiter(*per_ip, max_keys=ADMISSION_MAX_KEYS) if per_ip else None
+        self.per_user = RateLimiter(*per_user, max_keys=ADMISSION_MAX_KEYS) if per_user else None
+
+    def check_rates(self, ip: Optional[str], user: Optional[str]) -> Optional[int]:
+        """Seconds the client should wait before retrying, None when within its rates."""
+        waits = []
+        if self.per_ip is not None and ip:
+            waits.append(self.per_ip.take(ip))
+        if self.per_user is not None and user:
+            waits.append(self.per_user.take(user))
+        waits = [w for w in waits if w is not None]
+        return max(1, math.ceil(max(waits))) if waits else None
+
+
+policies: Dict[str, Policy] = {
+    name: Policy(name, **settings) for name, settings in ADMISSION_POLICIES.items()
+}
@@ -0,0 +1,329 @@
+import glob
+import json
+import logging
+import os
+import socket
+import threading
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.core import pubsub
+from app.core.cache import invalidate_event_stats
+from app.core.config import (
+    ATTENDANCE_STREAM_ARRIVALS,
+    ATTENDANCE_FLUSH_MS,
+    ATTENDANCE_FLUSH_ROWS,
+    ATTENDANCE_SPOOL_PATH,
+)
+from app.db import SessionLocal, insert_ignore
+from app.core.terms import current_term
+from app.model.model import Event as EventModel, User as UserModel, event_attendance, event_terms
+
+logger = logging.getLogger(__name__)
+
+# rows per INSERT statement, 3 binds per row stays under sqlite's variable limit
+INSERT_CHUNK_ROWS = 300
+# deleted events and users whose queued records every worker drops
+DISCARD_CHANNEL = "attendance-discard"
+
+
+def attendance_channel(event_id: int) -> str:
+    return f"attendance:{event_id}"
+
+
+def attendance_snapshot(
+    db: Session, event_id: int, user_ids: Optional[List[int]] = None
+) -> Dict[str, Any]:
+    count = (
+        db.query(func.count())
+        .select_from(event_attendance)
+        .filter(event_attendance.c.event_id == event_id)
+        .scalar()
+    )
+    arrivals = db.query(
+        UserModel.id,
+        UserModel.name,
+        UserModel.student_id,
+        event_attendance.c.recorded_at,
+    ).join(event_attendance, event_attendance.c.user_id == UserModel.id)
+    arrivals = arrivals.filter(event_attendance.c.event_id == event_id)
+    if user_ids is not None:
+        arrivals = arrivals.filter(event_attendance.c.user_id.in_(user_ids))
+    arrivals = arrivals.order_by(event_attendance.c.recorded_at.desc()).limit(
+        ATTENDANCE_STREAM_ARRIVALS
+    )
+    return {
+        "event_id": event_id,
+        "count": count,
+        "arrivals": [
+            {
+                "user_id": row.id,
+                "name": row.name,
+                "student_id": row.student_id,
+                "recorded_at": row.recorded_at.isoformat() if row.recorded_at else None,
+            }
+            for row in arrivals.all()
+        ],
+    }
+
+
+# push the new count and arrivals to live attendance streams once the insert commits
+def publish_attendance(db: Session, event_id: int, user_ids: List[int]) -> None:
+    db.flush()
+    pubsub.publish(
+        db, attendance_channel(event_id), attendance_snapshot(db, event_id, user_ids)
+    )
+
+
+# tell every worker's buffer to forget queued records once the delete commits
+def discard_pending(
+    db: Session, event_ids: Optional[List[int]] = None, user_id: Optional[int] = None
+) -> None:
+    pubsub.publish(db, DISCARD_CHANNEL, {"event_ids": event_ids or [], "user_id": user_id})
+
+
+class AttendanceBuffer:
+    """Write-behind queue for event_attendance.
+
+    Records are deduplicated in memory per (event_id, user_id) and written as
+    multi-row INSERTs every flush_interval_ms or as soon as max_rows are
+    pending. A batch rejected by a constraint is retried row by row and the
+    rows whose event or user is gone are dropped. Whatever cannot be written
+    on shutdown is spooled to a file of this process next to spool_path and
+    replayed by whichever process starts next.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        flush_interval_ms: int,
+        max_rows: int,
+        spool_path: str,
+    ):
+        self.session_factory = session_factory
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_rows = max_rows
+        self.spool_path = spool_path
+        stem, ext = os.path.splitext(spool_path)
+        self._spool_stem, self._spool_ext = stem, ext
+        # one spool per process, workers sharing a directory never write the same file
+        self.own_spool_path = f"{stem}.{socket.gethostname()}.{os.getpid()}{ext}"
+        self._pending: Dict[Tuple[int, int], datetime] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        pubsub.broker.add_listener(DISCARD_CHANNEL, self._on_discard)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def add(self, event_id: int, user_id: int) -> bool:
+        """Queue one record, False when it is already waiting to be written."""
+        key = (event_id, user_id)
+        with self._lock:
+            if key in self._pending:
+                return False
+            self._pending[key] = datetime.now()
+            full = len(self._pending) >= self.max_rows
+        if full:
+            self._wakeup.set()
+        return True
+
+    def is_pending(self, event_id: int, user_id: int) -> bool:
+        with self._lock:
+            return (event_id, user_id) in self._pending
+
+    def discard_event(self, event_id: int) -> None:
+        """Forget pending records of a deleted event."""
+        with self._lock:
+            for key in [k for k in self._pending if k[0] == event_id]:
+                del self._pending[key]
+
+    def discard_user(self, user_id: int) -> None:
+        """Forget pending records of a deleted user."""
+        with self._lock:
+            for key in [k for k in self._pending if k[1] == user_id]:
+                del self._pending[key]
+
+    def _on_discard(self, message) -> None:
+        for event_id in message.get("event_ids", []):
+            self.discard_event(int(event_id))
+        if message.get("user_id") is not None:
+            self.discard_user(int(message["user_id"]))
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._replay_spool()
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="attendance-write-behind", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._wakeup.set()
+        self._thread.join()
+        self._thread = None
+        if not self.flush():
+            self._write_spool()
+
+    def _run(self) -> None:
+        while not self._stop_event.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self) -> bool:
+        """Write everything pending, False when the write failed and the rows were kept."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return True
+            try:
+                self._write(batch)
+                return True
+            except IntegrityError:
+                # one row pointing at a deleted event or user rejects the whole chunk
+                logger.warning(
+                    "attendance flush of %d rows hit a constraint, writing row by row",
+                    len(batch),
+                )
+                return self._write_rows(batch)
+            except Exception:
+                logger.exception("attendance flush of %d rows failed", len(batch))
+                with self._lock:
+                    # records added meanwhile keep their own timestamp
+                    for key, recorded_at in batch.items():
+                        self._pending.setdefault(key, recorded_at)
+                return False
+
+    def _write_rows(self, batch: Dict[Tuple[int, int], datetime]) -> bool:
+        failed: Dict[Tuple[int, int], datetime] = {}
+        for key, recorded_at in batch.items():
+            try:
+                self._write({key: recorded_at})
+            except IntegrityError:
+                logger.error(
+                    "dropping attendance of user %d at event %d, the event or user no longer exists",
+                    key[1],
+                    key[0],
+                )
+            except Exception:
+                logger.exception("attendance write of user %d at event %d failed", key[1], key[0])
+                failed[key] = recorded_at
+        if not failed:
+            return True
+        with self._lock:
+            for key, recorded_at in failed.items():
+                self._pending.setdefault(key, recorded_at)
+        return False
+
+    def _write(self, batch: Dict[Tuple[int, int], datetime]) -> None:
+        inserted: Dict[int, List[int]] = defaultdict(list)
+        db = self.session_factory()
+        try:
+            # one lookup for the batch instead of the column default's one per row
+            terms = event_terms(db.connection(), {event_id for event_id, _ in batch})
+            rows = [
+                {
+                    "event_id": event_id,
+                    "user_id": user_id,
+                    "recorded_at": recorded_at,
+                    "term": terms.get(event_id, current_term()),
+                }
+                for (event_id, user_id), recorded_at in batch.items()
+            ]
+            for start in range(0, len(rows), INSERT_CHUNK_ROWS):
+                stmt = (
+                    insert_ignore(event_attendance, db.get_bind())
+                    .values(rows[start : start + INSERT_CHUNK_ROWS])
+                    .returning(event_attendance.c.event_id, event_attendance.c.user_id)
+                )
+                for event_id, user_id in db.execute(stmt):
+                    inserted[event_id].append(user_id)
+            for event_id, user_ids in inserted.items():
+                publish_attendance(db, event_id, user_ids)
+            clubs = (
+                dict(db.query(EventModel.id, EventModel.club_id).filter(EventModel.id.in_(list(inserted))))
+                if inserted
+                else {}
+            )
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        for event_id in inserted:
+            invalidate_event_stats(event_id, clubs.get(event_id))
+
+    def _write_spool(self) -> None:
+        with self._lock:
+            rows = [
+                {"event_id": e, "user_id": u, "recorded_at": t.isoformat()}
+                for (e, u), t in self._pending.items()
+            ]
+        if not rows:
+            return
+        tmp_path = f"{self.own_spool_path}.tmp"
+        with open(tmp_path, "w") as f:
+            for row in rows:
+                f.write(json.dumps(row) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.own_spool_path)
+        logger.warning(
+            "spooled %d unwritten attendance rows to %s", len(rows), self.own_spool_path
+        )
+
+    def _spool_files(self) -> List[str]:
+        # spools of every process that ever ran here, plus the older shared file
+        paths = glob.glob(f"{glob.escape(self._spool_stem)}.*{self._spool_ext}")
+        if os.path.exists(self.spool_path):
+            paths.append(self.spool_path)
+        return sorted(set(paths))
+
+    def _replay_spool(self) -> None:
+        claimed = []
+        for path in self._spool_files():
+            claim = f"{path}.claimed.{os.getpid()}"
+            try:
+                # rename is atomic, only one starting worker gets each file
+                os.rename(path, claim)
+            except FileNotFoundError:
+                continue
+            with open(claim) as f:
+                rows = [json.loads(line) for line in f if line.strip()]
+            with self._lock:
+                for row in rows:
+                    key = (row["event_id"], row["user_id"])
+                    self._pending.setdefault(key, datetime.fromisoformat(row["recorded_at"]))
+            claimed.append(claim)
+        if not claimed:
+            return
+        # rows that still cannot be written go to this process's own spool before the claims go
+        if not self.flush():
+            self._write_spool()
+        for claim in claimed:
+            try:
+                os.unlink(claim)
+            except FileNotFoundError:
+                pass
+
+
+attendance_buffer = AttendanceBuffer(
+    SessionLocal, ATTENDANCE_FLUSH_MS, ATTENDANCE_FLUSH_ROWS, ATTENDANCE_SPOOL_PATH
+)
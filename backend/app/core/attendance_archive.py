@@ -0,0 +1,457 @@
+"""Term partitions of event_attendance and the archive of cold events.
+
+The hot table keeps the current and recent terms only. Attendance of PAST
+events that started more than ATTENDANCE_ARCHIVE_AFTER_TERMS terms ago is
+written to compressed columnar files under ATTENDANCE_ARCHIVE_DIR, one
+attendance_archives row per event, and deleted from event_attendance. Rows
+written for an archived event afterwards are merged with its archived ones
+into a new file on the next run. On postgres a term partition left empty is
+then detached and dropped.
+
+Run from backend/, e.g. nightly from cron:
+
+    python -m app.core.attendance_archive
+    python -m app.core.attendance_archive --after-terms 3 --dry-run
+"""
+import argparse
+import logging
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import exists, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from app.core.config import (
+    ATTENDANCE_ARCHIVE_AFTER_TERMS,
+    ATTENDANCE_ARCHIVE_BATCH_EVENTS,
+    ATTENDANCE_ARCHIVE_CACHE_FILES,
+    ATTENDANCE_ARCHIVE_DIR,
+    ATTENDANCE_ARCHIVE_FORMAT,
+    ATTENDANCE_PARTITIONS_AHEAD,
+)
+from app.core.terms import current_term, shift_term, term_of, term_start
+from app.model.model import (
+    AttendanceArchive,
+    AttendanceArchiveUser,
+    Event as EventModel,
+    User as UserModel,
+    event_attendance,
+)
+from app.model.enums import EventStatusType
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {"npz": "npz", "parquet": "parquet", "arrow": "arrow"}
+PARTITION_RE = re.compile(r"^event_attendance_t(\d+)$")
+EPOCH = datetime(1970, 1, 1)
+
+
+def partition_name(term: int) -> str:
+    return f"event_attendance_t{term}"
+
+
+def is_partitioned(bind) -> bool:
+    if bind.dialect.name != "postgresql":
+        return False
+    kind = bind.execute(
+        text("SELECT relkind FROM pg_class WHERE relname = 'event_attendance' AND pg_table_is_visible(oid)")
+    ).scalar()
+    return kind == "p"
+
+
+def ensure_partitions(engine: Engine, ahead: int = ATTENDANCE_PARTITIONS_AHEAD) -> None:
+    """Create the partitions of the current term and the next ahead terms, run at startup."""
+    with engine.connect() as conn:
+        if not is_partitioned(conn):
+            return
+        term = current_term()
+        for n in range(ahead + 1):
+            name = partition_name(shift_term(term, n))
+            try:
+                with conn.begin():
+                    conn.execute(
+                        text(
+                            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF event_attendance"
+                            f" FOR VALUES IN ({shift_term(term, n)})"
+                        )
+                    )
+            except Exception:
+                # the default partition already holds rows of that term, they have to move first
+                logger.exception("could not create attendance partition %s", name)
+
+
+def drop_empty_partitions(conn, through_term: int) -> List[str]:
+    """Detach and drop term partitions up to through_term that archiving has emptied."""
+    names = conn.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid"
+            " WHERE i.inhparent = 'event_attendance'::regclass"
+        )
+    ).scalars()
+    dropped = []
+    for name in names:
+        match = PARTITION_RE.match(name)
+        if not match or int(match.group(1)) > through_term:
+            continue
+        if conn.execute(text(f"SELECT 1 FROM {name} LIMIT 1")).first() is not None:
+            continue
+        conn.execute(text(f"ALTER TABLE event_attendance DETACH PARTITION {name}"))
+        conn.execute(text(f"DROP TABLE {name}"))
+        dropped.append(name)
+    return dropped
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError(
+            "ATTENDANCE_ARCHIVE_FORMAT parquet and arrow need pyarrow, pip install pyarrow or use npz"
+        )
+    return pyarrow
+
+
+def write_columns(path: str, columns: Dict[str, np.ndarray]) -> None:
+    """Write int64 columns to path atomically, the format follows the extension."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            if path.endswith(".npz"):
+                np.savez_compressed(f, **columns)
+            else:
+                pa = _pyarrow()
+                table = pa.table(columns)
+                if path.endswith(".parquet"):
+                    pa.parquet.write_table(table, f, compression="zstd")
+                else:
+                    options = pa.ipc.IpcWriteOptions(compression="zstd")
+                    with pa.ipc.new_file(f, table.schema, options=options) as writer:
+                        writer.write_table(table)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def read_columns(path: str) -> Dict[str, np.ndarray]:
+    if path.endswith(".npz"):
+        with np.load(path) as data:
+            return {name: data[name] for name in data.files}
+    pa = _pyarrow()
+    if path.endswith(".parquet"):
+        table = pa.parquet.read_table(path)
+    else:
+        with pa.memory_map(path) as source:
+            table = pa.ipc.open_file(source).read_all()
+    return {name: table.column(name).to_numpy() for name in table.column_names}
+
+
+class ArchiveReader:
+    """Read path over archived attendance, decoded files are kept in a small LRU."""
+
+    def __init__(self, root: str, max_files: int):
+        self.root = root
+        self.max_files = max_files
+        self._files: "OrderedDict[str, Dict[str, np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _columns(self, relative_path: str) -> Dict[str, np.ndarray]:
+        with self._lock:
+            columns = self._files.get(relative_path)
+            if columns is not None:
+                self._files.move_to_end(relative_path)
+                return columns
+        columns = read_columns(os.path.join(self.root, relative_path))
+        with self._lock:
+            self._files[relative_path] = columns
+            while len(self._files) > self.max_files:
+                self._files.popitem(last=False)
+        return columns
+
+    def attendees(self, db: Session, event_id: int) -> Optional[np.ndarray]:
+        """User ids archived for event_id, None when the event was never archived."""
+        archive = db.get(AttendanceArchive, event_id)
+        if archive is None:
+            return None
+        columns = self._columns(archive.path)
+        # rows are sorted by event_id
+        lo, hi = np.searchsorted(columns["event_id"], [event_id, event_id + 1])
+        return columns["user_id"][lo:hi]
+
+    def counts(self, db: Session, event_ids: List[int]) -> Dict[int, int]:
+        if not event_ids:
+            return {}
+        return dict(
+            db.query(AttendanceArchive.event_id, AttendanceArchive.attendee_count)
+            .filter(AttendanceArchive.event_id.in_(event_ids))
+            .all()
+        )
+
+    def events_for_user(self, db: Session, user_id: int) -> List[int]:
+        """Archived events user_id attended, reads only the files attendance_archive_users lists."""
+        found = set()
+        paths = db.query(AttendanceArchiveUser.path).filter(AttendanceArchiveUser.user_id == user_id)
+        for (path,) in paths:
+            columns = self._columns(path)
+            if "by_user_user_id" in columns:
+                lo, hi = np.searchsorted(columns["by_user_user_id"], [user_id, user_id + 1])
+                found.update(columns["by_user_event_id"][lo:hi].tolist())
+            else:
+                # written before the user ordered copy
+                found.update(columns["event_id"][columns["user_id"] == user_id].tolist())
+        return sorted(found)
+
+
+archive_reader = ArchiveReader(ATTENDANCE_ARCHIVE_DIR, ATTENDANCE_ARCHIVE_CACHE_FILES)
+
+
+def user_columns(event_ids: np.ndarray, user_ids: np.ndarray) -> Dict[str, np.ndarray]:
+    """A copy of the rows ordered by user, for binary searching one user's events."""
+    order = np.lexsort((event_ids, user_ids))
+    return {"by_user_user_id": user_ids[order], "by_user_event_id": event_ids[order]}
+
+
+def index_users(db: Session, relative_path: str, user_ids: np.ndarray) -> None:
+    """List the file under each of its users in attendance_archive_users."""
+    db.query(AttendanceArchiveUser).filter(AttendanceArchiveUser.path == relative_path).delete()
+    users = np.unique(user_ids).tolist()
+    if users:
+        db.execute(
+            AttendanceArchiveUser.__table__.insert(),
+            [{"user_id": user_id, "path": relative_path} for user_id in users],
+        )
+
+
+def reindex_users(session_factory: Callable[[], Session]) -> int:
+    """Rebuild attendance_archive_users from the files, for archives written before it existed."""
+    db = session_factory()
+    try:
+        paths = [path for (path,) in db.query(AttendanceArchive.path).distinct()]
+        existing = np.array(sorted(u for (u,) in db.query(UserModel.id)), dtype=np.int64)
+        for relative_path in paths:
+            columns = read_columns(os.path.join(ATTENDANCE_ARCHIVE_DIR, relative_path))
+            # users deleted since the file was written have no row to point at
+            user_ids = columns["user_id"]
+            index_users(db, relative_path, user_ids[np.isin(user_ids, existing)])
+            db.commit()
+        return len(paths)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def _to_micros(values: List[Optional[datetime]]) -> np.ndarray:
+    return np.array(
+        [(v - EPOCH) // timedelta(microseconds=1) if v is not None else -1 for v in values],
+        dtype=np.int64,
+    )
+
+
+def _select_rows(chunk: List[int]):
+    return (
+        event_attendance.select()
+        .with_only_columns(event_attendance.c.event_id, event_attendance.c.user_id, event_attendance.c.recorded_at)
+        .where(event_attendance.c.event_id.in_(chunk))
+        .order_by(event_attendance.c.event_id, event_attendance.c.user_id)
+    )
+
+
+def _archive_path(term: int, chunk: List[int], fmt: str) -> str:
+    # never the name of an existing file, archive rows point at files for good
+    stamp = datetime.now().strftime("%Y%m%dT%H%M%S%f")
+    return os.path.join(f"term={term}", f"events-{chunk[0]}-{chunk[-1]}-{stamp}.{FORMATS[fmt]}")
+
+
+def _write_archive(
+    db: Session, relative_path: str, columns: Dict[str, np.ndarray], existing: Optional[np.ndarray] = None
+) -> Dict[int, int]:
+    """Write rows sorted by event_id then user_id, index their users, returns the count per event.
+
+    existing, the sorted ids of the users still there, when the rows may name deleted ones.
+    """
+    write_columns(
+        os.path.join(ATTENDANCE_ARCHIVE_DIR, relative_path),
+        {**columns, **user_columns(columns["event_id"], columns["user_id"])},
+    )
+    user_ids = columns["user_id"]
+    index_users(db, relative_path, user_ids if existing is None else user_ids[np.isin(user_ids, existing)])
+    events, counts = np.unique(columns["event_id"], return_counts=True)
+    return dict(zip(events.tolist(), counts.tolist()))
+
+
+def _sweep_late_rows(db: Session, batch_events: int, fmt: str, dry_run: bool, summary: Dict[str, object]) -> None:
+    """Merge rows written after their event was archived into a new file per batch."""
+    late = (
+        db.query(AttendanceArchive.event_id, AttendanceArchive.term, AttendanceArchive.path)
+        .filter(exists().where(event_attendance.c.event_id == AttendanceArchive.event_id))
+        .order_by(AttendanceArchive.event_id)
+        .all()
+    )
+    by_term: Dict[int, List[tuple]] = defaultdict(list)
+    for event_id, term, path in late:
+        by_term[term].append((event_id, path))
+    # archived rows outlive their users, only the rows still in the table are covered by the foreign key
+    existing = np.array(sorted(u for (u,) in db.query(UserModel.id)), dtype=np.int64) if late else None
+
+    for term, archived in sorted(by_term.items()):
+        for start in range(0, len(archived), batch_events):
+            batch = archived[start : start + batch_events]
+            chunk = [event_id for event_id, _ in batch]
+            rows = db.execute(_select_rows(chunk)).all()
+            relative_path = _archive_path(term, chunk, fmt)
+            summary["late_rows"] += len(rows)  # type: ignore
+            summary["files"].append(relative_path)  # type: ignore
+            if dry_run:
+                continue
+            # what is archived already first, so a user checked in again keeps the first check-in
+            parts = []
+            for path in sorted({path for _, path in batch}):
+                columns = read_columns(os.path.join(ATTENDANCE_ARCHIVE_DIR, path))
+                keep = np.isin(columns["event_id"], chunk)
+                parts.append({name: columns[name][keep] for name in ("event_id", "user_id", "recorded_at_us")})
+            parts.append(
+                {
+                    "event_id": np.array([r.event_id for r in rows], dtype=np.int64),
+                    "user_id": np.array([r.user_id for r in rows], dtype=np.int64),
+                    "recorded_at_us": _to_micros([r.recorded_at for r in rows]),
+                }
+            )
+            merged = {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+            order = np.lexsort((merged["user_id"], merged["event_id"]))
+            merged = {name: values[order] for name, values in merged.items()}
+            first = np.ones(len(order), dtype=bool)
+            first[1:] = (np.diff(merged["event_id"]) != 0) | (np.diff(merged["user_id"]) != 0)
+            merged = {name: values[first] for name, values in merged.items()}
+
+            counts = _write_archive(db, relative_path, merged, existing)
+            for event_id in chunk:
+                db.query(AttendanceArchive).filter(AttendanceArchive.event_id == event_id).update(
+                    {AttendanceArchive.path: relative_path, AttendanceArchive.attendee_count: counts.get(event_id, 0)},
+                    synchronize_session=False,
+                )
+            db.execute(event_attendance.delete().where(event_attendance.c.event_id.in_(chunk)))
+            db.commit()
+            logger.info("merged %d late attendance rows of %d archived events into %s", len(rows), len(chunk), relative_path)
+
+
+def archive_cold_events(
+    session_factory: Callable[[], Session],
+    after_terms: int = ATTENDANCE_ARCHIVE_AFTER_TERMS,
+    batch_events: int = ATTENDANCE_ARCHIVE_BATCH_EVENTS,
+    fmt: str = ATTENDANCE_ARCHIVE_FORMAT,
+    dry_run: bool = False,
+) -> Dict[str, object]:
+    """Move attendance of PAST events older than after_terms terms to archive files."""
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown archive format {fmt}")
+    if fmt != "npz":
+        _pyarrow()
+    newest_cold_term = shift_term(current_term(), -after_terms)
+    cutoff = term_start(shift_term(newest_cold_term, 1))
+    summary: Dict[str, object] = {
+        "cutoff": cutoff.isoformat(), "events": 0, "rows": 0, "late_rows": 0, "files": [], "dropped": []
+    }
+
+    db = session_factory()
+    try:
+        cold = (
+            db.query(EventModel.id, EventModel.start_time)
+            .outerjoin(AttendanceArchive, AttendanceArchive.event_id == EventModel.id)
+            .filter(
+                EventModel.status == EventStatusType.PAST,
+                EventModel.start_time < cutoff,
+                AttendanceArchive.event_id.is_(None),
+            )
+            .order_by(EventModel.id)
+            .all()
+        )
+        by_term: Dict[int, List[int]] = defaultdict(list)
+        for event_id, start_time in cold:
+            by_term[term_of(start_time)].append(event_id)
+
+        for term, event_ids in sorted(by_term.items()):
+            for start in range(0, len(event_ids), batch_events):
+                chunk = event_ids[start : start + batch_events]
+                rows = db.execute(_select_rows(chunk)).all()
+                relative_path = _archive_path(term, chunk, fmt)
+                summary["events"] += len(chunk)  # type: ignore
+                summary["rows"] += len(rows)  # type: ignore
+                summary["files"].append(relative_path)  # type: ignore
+                if dry_run:
+                    continue
+                # the file is complete on disk before any row leaves the table
+                counts = _write_archive(
+                    db,
+                    relative_path,
+                    {
+                        "event_id": np.array([r.event_id for r in rows], dtype=np.int64),
+                        "user_id": np.array([r.user_id for r in rows], dtype=np.int64),
+                        "recorded_at_us": _to_micros([r.recorded_at for r in rows]),
+                    },
+                )
+                db.add_all(
+                    AttendanceArchive(event_id=e, term=term, path=relative_path, attendee_count=counts.get(e, 0))
+                    for e in chunk
+                )
+                db.execute(event_attendance.delete().where(event_attendance.c.event_id.in_(chunk)))
+                db.commit()
+                logger.info("archived %d attendance rows of %d events to %s", len(rows), len(chunk), relative_path)
+
+        _sweep_late_rows(db, batch_events, fmt, dry_run, summary)
+
+        if not dry_run and is_partitioned(db.connection()):
+            summary["dropped"] = drop_empty_partitions(db.connection(), newest_cold_term)
+            db.commit()
+        return summary
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--after-terms", type=int, default=ATTENDANCE_ARCHIVE_AFTER_TERMS)
+    parser.add_argument("--batch-events", type=int, default=ATTENDANCE_ARCHIVE_BATCH_EVENTS)
+    parser.add_argument("--format", choices=sorted(FORMATS), default=ATTENDANCE_ARCHIVE_FORMAT)
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be archived")
+    parser.add_argument(
+        "--index-users", action="store_true", help="rebuild attendance_archive_users from the existing files"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    from app.db import SessionLocal
+
+    if args.index_users:
+        print(f"indexed the users of {reindex_users(SessionLocal)} archive files")
+        return
+
+    summary = archive_cold_events(SessionLocal, args.after_terms, args.batch_events, args.format, args.dry_run)
+    print(
+        f"{'would archive' if args.dry_run else 'archived'} {summary['rows']} rows of"
+        f" {summary['events']} events started before {summary['cutoff']}"
+        f" and {summary['late_rows']} late rows of archived events in {len(summary['files'])} files"  # type: ignore
+    )
+    for name in summary["dropped"]:  # type: ignore
+        print(f"dropped partition {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,389 @@
+import base64
+import json
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+from urllib.parse import urlparse
+
+from app.core import pubsub
+from app.core.config import (
+    CACHE_BACKEND,
+    CACHE_DIR,
+    CACHE_MAX_ENTRIES,
+    CACHE_REDIS_URL,
+)
+
+logger = logging.getLogger(__name__)
+
+# other workers drop their in-process copies when a key is invalidated here
+INVALIDATION_CHANNEL = "cache:invalidate"
+
+
+class CacheBackend:
+    """get/set/delete by key, values must be JSON serializable for the shared backends."""
+
+    def get(self, key: str, default: Any = None) -> Any:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def delete_prefix(self, prefix: str) -> None:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+
+class TTLCache(CacheBackend):
+    """Thread-safe in-process LRU cache whose entries also expire after a ttl in seconds."""
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_prefix(self, prefix: str) -> None:
+        with self._lock:
+            for key in [k for k in self._data if str(k).startswith(prefix)]:
+                del self._data[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+class FileCache(CacheBackend):
+    """One file per key in a directory shared by every worker on the host.
+
+    File names are the urlsafe base64 of the key so prefix deletes only list
+    the directory. Writes go through a temp file and os.replace, so readers
+    never see a partial entry. A file's mtime is its expiry, so every
+    maxsize // 10 writes a sweep drops expired files, then the ones expiring
+    soonest while more than maxsize are left, without opening any of them.
+    """
+
+    def __init__(self, directory: str, ttl: float = 60, maxsize: int = 10000):
+        self.directory = directory
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._sweep_every = max(1, maxsize // 10)
+        self._writes = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        name = base64.urlsafe_b64encode(key.encode()).decode()
+        return os.path.join(self.directory, name)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            with open(self._path(key), "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return default
+        if entry["expires_at"] < time.time():
+            self.delete(key)
+            return default
+        return entry["value"]
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"expires_at": expires_at, "value": value}, f)
+            os.utime(tmp_path, (expires_at, expires_at))
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        with self._lock:
+            self._writes += 1
+            sweep = self._writes % self._sweep_every == 0
+        if sweep:
+            self.sweep()
+
+    def sweep(self) -> None:
+        now = time.time()
+        live = []
+        for entry in os.scandir(self.directory):
+            try:
+                expires_at = entry.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            # a temp file an hour past its expiry was left by a writer that died
+            stale_at = expires_at + 3600 if entry.name.startswith(".tmp-") else expires_at
+            if stale_at < now:
+                self._unlink(entry.path)
+            elif not entry.name.startswith(".tmp-"):
+                live.append((expires_at, entry.path))
+        if len(live) > self.maxsize:
+            live.sort()
+            for _, path in live[: len(live) - self.maxsize]:
+                self._unlink(path)
+
+    @staticmethod
+    def _unlink(path: str) -> None:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def delete(self, key: str) -> None:
+        self._unlink(self._path(key))
+
+    def delete_prefix(self, prefix: str) -> None:
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith(".tmp-"):
+                continue
+            try:
+                key = base64.urlsafe_b64decode(entry.name).decode()
+            except ValueError:
+                continue
+            if key.startswith(prefix):
+                self.delete(key)
+
+    def clear(self) -> None:
+        self.delete_prefix("")
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisCache(CacheBackend):
+    """Minimal RESP2 client, works against redis or any protocol compatible stand-in."""
+
+    def __init__(self, url: str, ttl: float = 60, timeout: float = 1.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.ttl = ttl
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = (sock, sock.makefile("rb"))
+            self._local.conn = conn
+            if self.password:
+                self._command("AUTH", self.password)
+            if self.db:
+                self._command("SELECT", self.db)
+        return conn
+
+    def _reset(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn is not None:
+            conn[1].close()
+            conn[0].close()
+
+    def _command(self, *args: Any) -> Any:
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        sock, reader = self._connection()
+        try:
+            sock.sendall(b"".join(parts))
+            return self._read_reply(reader)
+        except (OSError, EOFError):
+            self._reset()
+            raise
+
+    def _read_reply(self, reader) -> Any:
+        line = reader.readline()
+        if not line:
+            raise EOFError("connection closed by server")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload
+        if kind == b"-":
+            raise RedisError(payload.decode())
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length == -1:
+                return None
+            data = reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(payload)
+            if length == -1:
+                return None
+            return [self._read_reply(reader) for _ in range(length)]
+        raise RedisError(f"unexpected reply {line!r}")
+
+    def get(self, key: str, default: Any = None) -> Any:
+        data = self._command("GET", key)
+        return default if data is None else json.loads(data)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        ttl_ms = int((self.ttl if ttl is None else ttl) * 1000)
+        self._command("SET", key, json.dumps(value), "PX", max(ttl_ms, 1))
+
+    def delete(self, key: str) -> None:
+        self._command("DEL", key)
+
+    def delete_prefix(self, prefix: str) -> None:
+        cursor = b"0"
+        while True:
+            cursor, keys = self._command("SCAN", cursor, "MATCH", f"{prefix}*", "COUNT", 500)
+            if keys:
+                self._command("DEL", *keys)
+            if cursor == b"0":
+                break
+
+    def clear(self) -> None:
+        self.delete_prefix("")
+
+
+class Cache:
+    """Front door used by the routers.
+
+    Shared backends (file, redis) make an invalidation visible to every worker
+    by themselves. The in-process backend broadcasts invalidations on
+    INVALIDATION_CHANNEL so the copies held by other workers are dropped too.
+    """
+
+    def __init__(self, backend: CacheBackend):
+        self.backend = backend
+        self.broadcast = isinstance(backend, TTLCache)
+        if self.broadcast:
+            pubsub.broker.add_listener(INVALIDATION_CHANNEL, self._on_invalidate)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            return self.backend.get(key, default)
+        except (OSError, EOFError, RedisError):
+            return default  # a cache outage degrades to a miss
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        try:
+            self.backend.set(key, value, ttl)
+        except (OSError, EOFError, RedisError):
+            pass
+
+    # the write already committed when these run, a failed invalidation is
+    # logged and left to the entry's ttl instead of failing the request
+    def delete(self, key: str) -> None:
+        try:
+            self.backend.delete(key)
+            if self.broadcast:
+                pubsub.broadcast(INVALIDATION_CHANNEL, {"key": key})
+        except Exception:
+            logger.exception("cache invalidation of %s failed", key)
+
+    def delete_prefix(self, prefix: str) -> None:
+        try:
+            self.backend.delete_prefix(prefix)
+            if self.broadcast:
+                pubsub.broadcast(INVALIDATION_CHANNEL, {"prefix": prefix})
+        except Exception:
+            logger.exception("cache invalidation of %s* failed", prefix)
+
+    def _on_invalidate(self, message: Any) -> None:
+        if "key" in message:
+            self.backend.delete(message["key"])
+        else:
+            self.backend.delete_prefix(message["prefix"])
+
+
+def make_backend(name: str) -> CacheBackend:
+    if name == "memory":
+        return TTLCache(maxsize=CACHE_MAX_ENTRIES)
+    if name == "file":
+        return FileCache(CACHE_DIR, maxsize=CACHE_MAX_ENTRIES)
+    if name == "redis":
+        return RedisCache(CACHE_REDIS_URL)
+    raise ValueError(f"unknown CACHE_BACKEND {name!r}")
+
+
+cache = Cache(make_backend(CACHE_BACKEND))
+
+
+def feed_key_prefix(user_id: int) -> str:
+    return f"feed:{user_id}:"
+
+
+# past this many users one sweep over every feed beats a prefix scan per user
+FEED_INVALIDATE_ALL_OVER = 20
+
+
+def invalidate_feed(*user_ids: int) -> None:
+    if len(user_ids) > FEED_INVALIDATE_ALL_OVER:
+        cache.delete_prefix("feed:")
+        return
+    for user_id in user_ids:
+        cache.delete_prefix(feed_key_prefix(user_id))
+
+
+def user_cache_key(username: str) -> str:
+    return f"user:{username}"
+
+
+# tokens carry the email as sub, the student id form is dropped as well for older tokens
+def invalidate_user(email: str, student_id: Optional[int] = None) -> None:
+    cache.delete(user_cache_key(email))
+    if student_id is not None:
+        cache.delete(user_cache_key(str(student_id)))
+
+
+def club_list_key_prefix() -> str:
+    return "clubs:list:"
+
+
+def club_stats_key(club_id: int) -> str:
+    return f"clubs:stats:{club_id}"
+
+
+def event_stats_key(event_id: int) -> str:
+    return f"events:stats:{event_id}"
+
+
+# attendance and event changes move the club's stats as well as the event's
+def invalidate_event_stats(event_id: int, club_id: Optional[int]) -> None:
+    cache.delete(event_stats_key(event_id))
+    if club_id is not None:
+        cache.delete(club_stats_key(club_id))
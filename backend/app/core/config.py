@@ -9,4 +9,217 @@ SECRET_KEY = os.getenv("SECRET_KEY", "your-super-secret-key-please-change-it-and
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
 
+# longest window GET /events/calendar will bucket in one call
+CALENDAR_MAX_DAYS = int(os.getenv("CALENDAR_MAX_DAYS", 62))
 
+# /users/me/feed pages are cached per user for this long, membership changes drop them early
+FEED_CACHE_TTL_SECONDS = int(os.getenv("FEED_CACHE_TTL_SECONDS", 30))
+FEED_PAGE_MAX = int(os.getenv("FEED_PAGE_MAX", 100))
+
+# cross worker pub/sub goes through postgres LISTEN/NOTIFY when the database is postgres
+PUBSUB_PG_NOTIFY = os.getenv("PUBSUB_PG_NOTIFY", "1") == "1"
+PUBSUB_QUEUE_SIZE = int(os.getenv("PUBSUB_QUEUE_SIZE", 100))
+SSE_HEARTBEAT_SECONDS = int(os.getenv("SSE_HEARTBEAT_SECONDS", 15))
+ATTENDANCE_STREAM_ARRIVALS = int(os.getenv("ATTENDANCE_STREAM_ARRIVALS", 10))
+
+APP_ENV = os.getenv("APP_ENV", "development")
+# production only checks that the tables exist at startup, DDL is run out of band
+DB_AUTO_CREATE = os.getenv("DB_AUTO_CREATE", "0" if APP_ENV == "production" else "1") == "1"
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+
+# memory (per worker LRU), file (shared by the workers of one host) or redis
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+CACHE_DIR = os.getenv("CACHE_DIR", "/tmp/techcom-cache")
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+# entries per worker for memory, files in CACHE_DIR for file
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 10000))
+USER_CACHE_TTL_SECONDS = int(os.getenv("USER_CACHE_TTL_SECONDS", 60))
+CLUB_LIST_CACHE_TTL_SECONDS = int(os.getenv("CLUB_LIST_CACHE_TTL_SECONDS", 300))
+STATS_CACHE_TTL_SECONDS = int(os.getenv("STATS_CACHE_TTL_SECONDS", 15))
+
+# comma separated, read-only routes are spread over these and fall back to DATABASE_URL
+REPLICA_DATABASE_URLS = [u.strip() for u in os.getenv("REPLICA_DATABASE_URLS", "").split(",") if u.strip()]
+# a replica that failed is skipped for this long
+REPLICA_RETRY_SECONDS = int(os.getenv("REPLICA_RETRY_SECONDS", 30))
+
+# attendance writes are queued and flushed in batches instead of one commit per check-in
+ATTENDANCE_WRITE_BEHIND = os.getenv("ATTENDANCE_WRITE_BEHIND", "1") == "1"
+ATTENDANCE_FLUSH_MS = int(os.getenv("ATTENDANCE_FLUSH_MS", 200))
+ATTENDANCE_FLUSH_ROWS = int(os.getenv("ATTENDANCE_FLUSH_ROWS", 500))
+# rows that could not be written at shutdown are kept next to this, one file per process, and replayed at startup
+ATTENDANCE_SPOOL_PATH = os.getenv("ATTENDANCE_SPOOL_PATH", "attendance_spool.jsonl")
+
+# attendbyface matches against an IVF-PQ index persisted here, exact search below FACE_INDEX_MIN_IVF
+FACE_INDEX_DIR = os.getenv("FACE_INDEX_DIR", "face_index")
+FACE_EMBEDDING_DIM = int(os.getenv("FACE_EMBEDDING_DIM", 128))
+FACE_MATCH_THRESHOLD = float(os.getenv("FACE_MATCH_THRESHOLD", 0.85))
+FACE_INDEX_MIN_IVF = int(os.getenv("FACE_INDEX_MIN_IVF", 4096))
+FACE_INDEX_PQ_M = int(os.getenv("FACE_INDEX_PQ_M", 32))
+FACE_INDEX_NPROBE = int(os.getenv("FACE_INDEX_NPROBE", 16))
+FACE_INDEX_RERANK = int(os.getenv("FACE_INDEX_RERANK", 32))
+# enrollments since the last build are searched exactly, past this many the index is rebuilt
+FACE_INDEX_REBUILD_DELTA = int(os.getenv("FACE_INDEX_REBUILD_DELTA", 2000))
+# a face matched at an event is answered from memory for this long, 0 turns it off
+FACE_DEDUP_WINDOW_SECONDS = float(os.getenv("FACE_DEDUP_WINDOW_SECONDS", 120))
+# probe to probe similarity answered without the index, only used when strictly above FACE_MATCH_THRESHOLD
+FACE_DEDUP_THRESHOLD = float(os.getenv("FACE_DEDUP_THRESHOLD", 0.95))
+FACE_DEDUP_EVENTS = int(os.getenv("FACE_DEDUP_EVENTS", 256))
+FACE_DEDUP_PER_EVENT = int(os.getenv("FACE_DEDUP_PER_EVENT", 1024))
+
+# clubs and events get a deleted_at column and are hidden instead of deleted, users are always removed
+SOFT_DELETE = os.getenv("SOFT_DELETE", "0") == "1"
+
+# most ids the /batch endpoints resolve in one call
+BATCH_MAX_IDS = int(os.getenv("BATCH_MAX_IDS", 200))
+
+# most user/student ids one bulk membership call accepts
+BULK_MEMBERSHIP_MAX = int(os.getenv("BULK_MEMBERSHIP_MAX", 5000))
+
+# SAO admins can send X-Profile: 1 (or ?_profile=1) to get a sampled profile of that request
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/techcom-profiles")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", 1))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", 50))
+
+# request tracing, exporter is none, file (OTLP/JSON lines in TRACE_FILE), otlp, log or package.module:Class
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none")
+TRACE_FILE = os.getenv("TRACE_FILE", "traces/spans.jsonl")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "techcom-backend")
+# share of requests without an incoming traceparent that are traced
+TRACE_SAMPLE_RATIO = float(os.getenv("TRACE_SAMPLE_RATIO", 1.0))
+TRACE_EXPORT_BATCH = int(os.getenv("TRACE_EXPORT_BATCH", 512))
+TRACE_EXPORT_INTERVAL_MS = int(os.getenv("TRACE_EXPORT_INTERVAL_MS", 2000))
+TRACE_SQL_MAX_CHARS = int(os.getenv("TRACE_SQL_MAX_CHARS", 2000))
+
+# statements slower than this many ms land in the slow query log with their EXPLAIN plan, 0 turns it off
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", 250))
+SLOW_QUERY_LOG_SIZE = int(os.getenv("SLOW_QUERY_LOG_SIZE", 200))
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "1") == "1"
+
+# uploaded club/event images, stored by sha256 under MEDIA_DIR with thumbnails rendered in a process pool
+MEDIA_DIR = os.getenv("MEDIA_DIR", "media")
+IMAGE_MAX_UPLOAD_BYTES = int(os.getenv("IMAGE_MAX_UPLOAD_BYTES", 10 * 1024 * 1024))
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", 40_000_000))
+# longest side in pixels, each size is written as WebP and JPEG
+IMAGE_THUMBNAIL_SIZES = sorted(int(s) for s in os.getenv("IMAGE_THUMBNAIL_SIZES", "160,480,1200").split(",") if s.strip())
+IMAGE_WEBP_QUALITY = int(os.getenv("IMAGE_WEBP_QUALITY", 80))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", 82))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", 2))
+
+# outgoing mail, notifications are only logged while SMTP_HOST is empty
+SMTP_HOST = os.getenv("SMTP_HOST", "")
+SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
+SMTP_USERNAME = os.getenv("SMTP_USERNAME", "")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", "")
+# STARTTLS on a plain connection, or SMTP_SSL=1 for implicit TLS (port 465)
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "1") == "1"
+SMTP_SSL = os.getenv("SMTP_SSL", "0") == "1"
+SMTP_FROM = os.getenv("SMTP_FROM", "SAO Clubs <no-reply@techcom.local>")
+SMTP_TIMEOUT_SECONDS = float(os.getenv("SMTP_TIMEOUT_SECONDS", 10))
+# open connections kept to the relay, also how many jobs are sent at once
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", 4))
+
+NOTIFY_ENABLED = os.getenv("NOTIFY_ENABLED", "1") == "1"
+# recipients per message, they only appear in the envelope
+NOTIFY_BATCH_SIZE = int(os.getenv("NOTIFY_BATCH_SIZE", 100))
+# recipients per second over every process sending, each gets an equal share
+NOTIFY_RATE_PER_SECOND = float(os.getenv("NOTIFY_RATE_PER_SECOND", 50))
+# processes running the sender (NOTIFY_ENABLED=1), defaults to the server's worker count
+NOTIFY_SENDERS = max(1, int(os.getenv("NOTIFY_SENDERS", os.getenv("WEB_CONCURRENCY", 1))))
+NOTIFY_MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", 8))
+NOTIFY_RETRY_BASE_SECONDS = int(os.getenv("NOTIFY_RETRY_BASE_SECONDS", 30))
+NOTIFY_POLL_SECONDS = int(os.getenv("NOTIFY_POLL_SECONDS", 5))
+# a job claimed by a worker that died is picked up again after this long
+NOTIFY_LEASE_SECONDS = int(os.getenv("NOTIFY_LEASE_SECONDS", 120))
+
+
+def _rate(value: str):
+    """"count/seconds" as (count, seconds), None for "0" or empty."""
+    if not value or value == "0":
+        return None
+    count, _, seconds = value.partition("/")
+    return float(count), float(seconds or 1)
+
+
+# admission control, expensive routes get a slot limit and per client token buckets
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1") == "1"
+# a request waits this long for a free slot, then gets 503
+ADMISSION_QUEUE_TIMEOUT_MS = int(os.getenv("ADMISSION_QUEUE_TIMEOUT_MS", 100))
+ADMISSION_RETRY_AFTER_SECONDS = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", 1))
+# client keys kept per bucket, least recently seen go first
+ADMISSION_MAX_KEYS = int(os.getenv("ADMISSION_MAX_KEYS", 100000))
+# proxies in front of the app whose X-Forwarded-For entries are trusted, 0 uses the peer address
+ADMISSION_TRUSTED_PROXIES = int(os.getenv("ADMISSION_TRUSTED_PROXIES", 0))
+# per worker: concurrent requests, how many more may wait, and "count/seconds" per IP and per user
+# (login counts per username and IP)
+ADMISSION_POLICIES = {
+    "login": {
+        "concurrency": int(os.getenv("LOGIN_MAX_CONCURRENT", 8)),
+        "queue": int(os.getenv("LOGIN_MAX_QUEUED", 16)),
+        "per_ip": _rate(os.getenv("LOGIN_RATE_PER_IP", "30/60")),
+        "per_user": _rate(os.getenv("LOGIN_RATE_PER_USER", "10/300")),
+    },
+    "face": {
+        "concurrency": int(os.getenv("FACE_MAX_CONCURRENT", 8)),
+        "queue": int(os.getenv("FACE_MAX_QUEUED", 16)),
+        "per_ip": _rate(os.getenv("FACE_RATE_PER_IP", "0")),
+        "per_user": _rate(os.getenv("FACE_RATE_PER_USER", "1200/60")),
+    },
+    "stats": {
+        "concurrency": int(os.getenv("STATS_MAX_CONCURRENT", 4)),
+        "queue": int(os.getenv("STATS_MAX_QUEUED", 8)),
+        "per_ip": _rate(os.getenv("STATS_RATE_PER_IP", "0")),
+        "per_user": _rate(os.getenv("STATS_RATE_PER_USER", "60/60")),
+    },
+}
+
+# attendance is kept per academic term, terms start on the 1st of these months
+ATTENDANCE_TERM_START_MONTHS = sorted(int(m) for m in os.getenv("ATTENDANCE_TERM_START_MONTHS", "1,9").split(",") if m)
+# postgres only: event_attendance is created LIST partitioned by term, one partition per term
+ATTENDANCE_PARTITIONED = os.getenv("ATTENDANCE_PARTITIONED", "1") == "1"
+# partitions created ahead of the current term at startup, so the default partition stays empty
+ATTENDANCE_PARTITIONS_AHEAD = int(os.getenv("ATTENDANCE_PARTITIONS_AHEAD", 1))
+# PAST events that started more than this many terms ago are moved out to ATTENDANCE_ARCHIVE_DIR
+ATTENDANCE_ARCHIVE_AFTER_TERMS = int(os.getenv("ATTENDANCE_ARCHIVE_AFTER_TERMS", 2))
+ATTENDANCE_ARCHIVE_DIR = os.getenv("ATTENDANCE_ARCHIVE_DIR", "archive/attendance")
+# npz (numpy, always available), parquet or arrow (both need pyarrow)
+ATTENDANCE_ARCHIVE_FORMAT = os.getenv("ATTENDANCE_ARCHIVE_FORMAT", "npz")
+# events written per archive file
+ATTENDANCE_ARCHIVE_BATCH_EVENTS = int(os.getenv("ATTENDANCE_ARCHIVE_BATCH_EVENTS", 2000))
+# decoded archive files kept in memory per worker
+ATTENDANCE_ARCHIVE_CACHE_FILES = int(os.getenv("ATTENDANCE_ARCHIVE_CACHE_FILES", 8))
+
+# kiosk mode: this process runs on a check-in station against a local SQLite copy of one club
+KIOSK_MODE = os.getenv("KIOSK_MODE", "0") == "1"
+# WAL and tuned pragmas on SQLite connections, on by default in kiosk mode
+SQLITE_WAL = os.getenv("SQLITE_WAL", "1" if KIOSK_MODE else "0") == "1"
+# central API the kiosk pulls its snapshot from and pushes attendance to, e.g. https://host/api/v1
+KIOSK_CENTRAL_URL = os.getenv("KIOSK_CENTRAL_URL", "").rstrip("/")
+# the club manager the kiosk signs in to the central API as
+KIOSK_USERNAME = os.getenv("KIOSK_USERNAME", "")
+KIOSK_PASSWORD = os.getenv("KIOSK_PASSWORD", "")
+KIOSK_ID = os.getenv("KIOSK_ID", os.getenv("HOSTNAME", "kiosk"))
+KIOSK_SYNC_SECONDS = int(os.getenv("KIOSK_SYNC_SECONDS", 15))
+# records per upload, also the most the central batch endpoint accepts
+KIOSK_SYNC_BATCH = int(os.getenv("KIOSK_SYNC_BATCH", 500))
+KIOSK_HTTP_TIMEOUT_SECONDS = float(os.getenv("KIOSK_HTTP_TIMEOUT_SECONDS", 10))
+
+# an event without end_time holds its room this long after start_time
+EVENT_DEFAULT_DURATION_MINUTES = int(os.getenv("EVENT_DEFAULT_DURATION_MINUTES", 60))
+# postgres only: also enforce room bookings with a GiST exclusion constraint, needs btree_gist
+EVENT_ROOM_EXCLUSION = os.getenv("EVENT_ROOM_EXCLUSION", "0") == "1"
+
+# club recommendations, rebuilt in the background from co-membership and co-attendance
+RECOMMEND_ENABLED = os.getenv("RECOMMEND_ENABLED", "1") == "1"
+RECOMMEND_DIR = os.getenv("RECOMMEND_DIR", "recommendations")
+RECOMMEND_REFRESH_SECONDS = int(os.getenv("RECOMMEND_REFRESH_SECONDS", 3600))
+# off when a cron job builds the model, workers then only load what it saved
+RECOMMEND_BACKGROUND_BUILD = os.getenv("RECOMMEND_BACKGROUND_BUILD", "1") == "1"
+# clubs kept per user and similar clubs kept per club
+RECOMMEND_TOP_K = int(os.getenv("RECOMMEND_TOP_K", 20))
+RECOMMEND_NEIGHBORS = int(os.getenv("RECOMMEND_NEIGHBORS", 50))
+# weight of log(1 + events attended) next to 1.0 for being a member
+RECOMMEND_ATTENDANCE_WEIGHT = float(os.getenv("RECOMMEND_ATTENDANCE_WEIGHT", 0.5))
+# superseded face index and recommendation builds stay on disk this long for workers still loading them
+VERSION_KEEP_SECONDS = int(os.getenv("VERSION_KEEP_SECONDS", 600))
@@ -0,0 +1,157 @@
+"""Room double-booking detection.
+
+A room is an event's location, trimmed and lowercased. An event holds its room
+from start_time to end_time, or for EVENT_DEFAULT_DURATION_MINUTES when it has
+no end_time. IDEATION events and events without a start_time hold nothing.
+
+Within a room, bookings are kept sorted by start. Every booking overlapping
+booking i then starts in [start_i, end_i), which is one binary search, so a
+term's schedule is checked in O(n log n + conflicts) instead of pair by pair.
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.core.config import EVENT_DEFAULT_DURATION_MINUTES
+from app.model.enums import EventStatusType
+from app.model.model import Event as EventModel
+
+DEFAULT_DURATION = timedelta(minutes=EVENT_DEFAULT_DURATION_MINUTES)
+ROOM_HOLDING_STATUSES = [s for s in EventStatusType if s != EventStatusType.IDEATION]
+EPOCH = datetime(1970, 1, 1)
+
+# same expression as the ix_events_room_end_time index
+room_column = func.lower(func.trim(EventModel.location))
+booking_end_column = func.coalesce(EventModel.end_time, EventModel.start_time)
+
+
+def room_key(location: str) -> str:
+    # sql trim only strips spaces
+    return location.strip(" ").lower()
+
+
+def _naive(moment: datetime) -> datetime:
+    # the TIMESTAMP columns store naive UTC
+    if moment.tzinfo is None:
+        return moment
+    return moment.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def booking(start_time: datetime, end_time: Optional[datetime]) -> Tuple[datetime, datetime]:
+    """The span an event holds its room, empty when end_time is before start_time."""
+    start = _naive(start_time)
+    end = _naive(end_time) if end_time is not None else start + DEFAULT_DURATION
+    return start, max(start, end)
+
+
+class RoomSchedule:
+    """Bookings of one room as int64 microsecond arrays sorted by start."""
+
+    def __init__(self, ids: np.ndarray, starts: np.ndarray, ends: np.ndarray):
+        # empty bookings overlap nothing
+        keep = ends > starts
+        order = np.argsort(starts[keep], kind="stable")
+        self.ids = ids[keep][order]
+        self.starts = starts[keep][order]
+        self.ends = ends[keep][order]
+
+    def pairs(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Positions (i, j), i < j, of every overlapping pair of bookings."""
+        n = len(self.ids)
+        # bookings after i that start before i ends all overlap it
+        hi = np.searchsorted(self.starts, self.ends, side="left")
+        counts = np.maximum(hi - np.arange(n) - 1, 0)
+        first = np.repeat(np.arange(n), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return first, first + 1 + offsets
+
+
+def find_conflicts(
+    db: Session,
+    location: str,
+    start_time: datetime,
+    end_time: Optional[datetime],
+    exclude_id: Optional[int] = None,
+) -> List[EventModel]:
+    """Events already holding location at some moment of the given booking."""
+    start, end = booking(start_time, end_time)
+    if end <= start:
+        return []
+    # ix_events_room_end_time narrows this to the room's bookings ending after start
+    query = db.query(EventModel).filter(
+        room_column == room_key(location),
+        booking_end_column > start - DEFAULT_DURATION,
+        EventModel.start_time < end,
+        EventModel.status.in_(ROOM_HOLDING_STATUSES),
+    )
+    if exclude_id is not None:
+        query = query.filter(EventModel.id != exclude_id)
+    conflicts = []
+    for event in query.order_by(EventModel.start_time):
+        other_start, other_end = booking(event.start_time, event.end_time)  # type: ignore
+        if other_start < end and other_end > start and other_end > other_start:
+            conflicts.append(event)
+    return conflicts
+
+
+def conflict_report(
+    db: Session, since: datetime, until: datetime, location: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """Every pair of events double-booking a room between since and until."""
+    query = db.query(
+        EventModel.id,
+        EventModel.name,
+        EventModel.club_id,
+        EventModel.location,
+        EventModel.start_time,
+        EventModel.end_time,
+    ).filter(
+        EventModel.start_time.isnot(None),
+        EventModel.start_time < until,
+        booking_end_column > since - DEFAULT_DURATION,
+        EventModel.status.in_(ROOM_HOLDING_STATUSES),
+    )
+    if location is not None:
+        query = query.filter(room_column == room_key(location))
+    rows = query.all()
+    if len(rows) < 2:
+        return []
+
+    ids = np.fromiter((row.id for row in rows), dtype=np.int64, count=len(rows))
+    starts = np.array([row.start_time for row in rows], dtype="datetime64[us]").astype(np.int64)
+    ends = np.array(
+        [row.end_time if row.end_time is not None else row.start_time + DEFAULT_DURATION for row in rows],
+        dtype="datetime64[us]",
+    ).astype(np.int64)
+    ends = np.maximum(starts, ends)
+    _, rooms = np.unique([room_key(row.location) for row in rows], return_inverse=True)
+    events = {row.id: row for row in rows}
+    # the query also reads bookings ending shortly before since, their overlaps may end before it too
+    since_us = (_naive(since) - EPOCH) // timedelta(microseconds=1)
+
+    conflicts = []
+    order = np.argsort(rooms, kind="stable")
+    bounds = np.flatnonzero(np.diff(rooms[order])) + 1
+    for positions in np.split(order, bounds):
+        if len(positions) < 2:
+            continue
+        schedule = RoomSchedule(ids[positions], starts[positions], ends[positions])
+        first, second = schedule.pairs()
+        for i, j in zip(first.tolist(), second.tolist()):
+            overlap_end = int(min(schedule.ends[i], schedule.ends[j]))
+            if overlap_end <= since_us:
+                continue
+            a, b = events[int(schedule.ids[i])], events[int(schedule.ids[j])]
+            conflicts.append(
+                {
+                    "location": a.location,
+                    "events": [a, b],
+                    "overlap_start": EPOCH + timedelta(microseconds=int(schedule.starts[j])),
+                    "overlap_end": EPOCH + timedelta(microseconds=overlap_end),
+                }
+            )
+    conflicts.sort(key=lambda c: (c["overlap_start"], c["location"]))
+    return conflicts
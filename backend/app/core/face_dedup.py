@@ -0,0 +1,206 @@
+import base64
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from app.core import pubsub
+from app.core.config import (
+    FACE_DEDUP_EVENTS,
+    FACE_DEDUP_PER_EVENT,
+    FACE_DEDUP_THRESHOLD,
+    FACE_DEDUP_WINDOW_SECONDS,
+    FACE_EMBEDDING_DIM,
+    FACE_MATCH_THRESHOLD,
+)
+from app.core.face_index import normalize
+
+logger = logging.getLogger(__name__)
+
+# every worker adds the matches of the others, so any camera's repeat hits stay local
+MATCH_CHANNEL = "face:recent"
+
+
+class _EventWindow:
+    """Users matched at one event in the last window seconds, with the probe that matched them."""
+
+    def __init__(self, size: int, dim: int):
+        self.users: "OrderedDict[int, int]" = OrderedDict()  # user_id -> row
+        self.seen_at = np.zeros(size, dtype=np.float64)
+        self.row_users = np.full(size, -1, dtype=np.int64)
+        self.vectors = np.zeros((size, dim), dtype=np.float32)
+        self.authorized: Dict[int, float] = {}  # caller id -> expiry
+
+    def add(self, user_id: int, vector: np.ndarray, now: float) -> None:
+        row = self.users.pop(user_id, None)
+        if row is None:
+            if len(self.users) < len(self.row_users):
+                row = len(self.users)
+            else:
+                _, row = self.users.popitem(last=False)  # least recently matched
+        self.users[user_id] = row
+        self.row_users[row] = user_id
+        self.vectors[row] = vector
+        self.seen_at[row] = now
+
+    def find(self, vector: np.ndarray, since: float, threshold: float) -> Optional[Tuple[int, float]]:
+        n = len(self.users)
+        if not n:
+            return None
+        if not np.isfinite(vector).all():
+            return None
+        sims = self.vectors[:n] @ vector
+        sims[self.seen_at[:n] < since] = -1
+        row = int(np.argmax(sims))
+        # written so a NaN similarity never passes
+        if not sims[row] >= threshold:
+            return None
+        return int(self.row_users[row]), float(sims[row])
+
+    def touch(self, user_id: int, now: float) -> None:
+        row = self.users.get(user_id)
+        if row is not None:
+            self.users.move_to_end(user_id)
+            self.seen_at[row] = now
+
+
+class RecentMatches:
+    """Per-event window of recent face matches, checked before the index and the database.
+
+    Several cameras at one entrance see the same student within seconds. The
+    first match is written as usual and remembered here, later probes of the
+    same face (or index matches of the same user) at that event are answered
+    from memory for window seconds. Events are kept in LRU order, at most
+    max_events of them with per_event users each, so memory stays bounded at
+    roughly max_events * per_event * (4 * dim + 16) bytes.
+
+    A probe close to a remembered probe is only a different photo of the
+    same face if it is closer than any two faces the index would tell apart,
+    so that shortcut needs threshold strictly above match_threshold and is
+    skipped otherwise. Index matches of a remembered user are always
+    answered from memory.
+
+    Matches are broadcast on MATCH_CHANNEL so every worker learns them.
+    Authorization of the calling manager is remembered per worker only.
+    """
+
+    def __init__(
+        self,
+        window: float,
+        threshold: float,
+        max_events: int,
+        per_event: int,
+        dim: int = 128,
+        match_threshold: float = FACE_MATCH_THRESHOLD,
+    ):
+        self.window = window
+        self.threshold = threshold
+        self.probe_shortcut = threshold > match_threshold
+        if window > 0 and not self.probe_shortcut:
+            logger.warning(
+                "FACE_DEDUP_THRESHOLD %.3f is not above FACE_MATCH_THRESHOLD %.3f, probes always go to the index",
+                threshold,
+                match_threshold,
+            )
+        self.max_events = max_events
+        self.per_event = per_event
+        self.dim = dim
+        self._events: "OrderedDict[int, _EventWindow]" = OrderedDict()
+        self._lock = threading.Lock()
+        pubsub.broker.add_listener(MATCH_CHANNEL, self._on_match)
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    def _window(self, event_id: int, create: bool) -> Optional[_EventWindow]:
+        window = self._events.get(event_id)
+        if window is not None:
+            self._events.move_to_end(event_id)
+        elif create:
+            window = self._events[event_id] = _EventWindow(self.per_event, self.dim)
+            while len(self._events) > self.max_events:
+                self._events.popitem(last=False)
+        return window
+
+    def is_authorized(self, event_id: int, caller_id: int) -> bool:
+        if not self.enabled:
+            return False
+        with self._lock:
+            window = self._window(event_id, create=False)
+            return window is not None and window.authorized.get(caller_id, 0) > time.monotonic()
+
+    def authorize(self, event_id: int, caller_id: int) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            window = self._window(event_id, create=True)
+            window.authorized[caller_id] = time.monotonic() + self.window
+
+    def find(self, event_id: int, vector: np.ndarray) -> Optional[Tuple[int, float]]:
+        """User whose recent probe at this event is the same face, as (user_id, similarity)."""
+        if not self.enabled or not self.probe_shortcut:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            window = self._window(event_id, create=False)
+            if window is None:
+                return None
+            hit = window.find(normalize(vector), now - self.window, self.threshold)
+            if hit is not None:
+                window.touch(hit[0], now)
+            return hit
+
+    def seen(self, event_id: int, user_id: int) -> bool:
+        if not self.enabled:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            window = self._window(event_id, create=False)
+            if window is None or user_id not in window.users:
+                return False
+            if window.seen_at[window.users[user_id]] < now - self.window:
+                return False
+            window.touch(user_id, now)
+            return True
+
+    def add(self, event_id: int, user_id: int, vector: np.ndarray) -> None:
+        if not self.enabled:
+            return
+        vector = normalize(vector)
+        self._add(event_id, user_id, vector)
+        message = {
+            "event_id": event_id,
+            "user_id": user_id,
+            "embedding": base64.b64encode(vector.astype("<f4").tobytes()).decode(),
+        }
+        # the attendance is already written, other workers then only miss the shortcut
+        try:
+            pubsub.broadcast(MATCH_CHANNEL, message)
+        except Exception:
+            logger.exception("could not broadcast face match for event %s", event_id)
+
+    def _add(self, event_id: int, user_id: int, vector: np.ndarray) -> None:
+        with self._lock:
+            self._window(event_id, create=True).add(user_id, vector, time.monotonic())
+
+    def drop_event(self, event_id: int) -> None:
+        with self._lock:
+            self._events.pop(event_id, None)
+
+    def _on_match(self, message) -> None:
+        vector = np.frombuffer(base64.b64decode(message["embedding"]), dtype="<f4")
+        if len(vector) == self.dim and np.isfinite(vector).all():
+            self._add(int(message["event_id"]), int(message["user_id"]), vector)
+
+
+recent_matches = RecentMatches(
+    FACE_DEDUP_WINDOW_SECONDS,
+    FACE_DEDUP_THRESHOLD,
+    FACE_DEDUP_EVENTS,
+    FACE_DEDUP_PER_EVENT,
+    FACE_EMBEDDING_DIM,
+)
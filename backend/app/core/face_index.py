@@ -0,0 +1,556 @@
+import base64
+import json
+import logging
+import os
+import socket
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.core import pubsub
+from app.core.config import (
+    FACE_EMBEDDING_DIM,
+    FACE_INDEX_DIR,
+    FACE_INDEX_MIN_IVF,
+    FACE_INDEX_NPROBE,
+    FACE_INDEX_PQ_M,
+    FACE_INDEX_REBUILD_DELTA,
+    FACE_INDEX_RERANK,
+    FACE_MATCH_THRESHOLD,
+)
+from app.core.versions import build_lock, new_version, publish
+
+logger = logging.getLogger(__name__)
+
+# enrollments, removals and rebuilds of one worker, replayed by every other
+INDEX_CHANNEL = "face:index"
+
+# rows per distance matrix block, keeps (chunk x k) float32 blocks around 64MB at k=4096
+CHUNK_ROWS = 4096
+
+
+def normalize(vectors) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _assign(x: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    # argmin ||x - c||^2 = argmin (||c||^2 - 2 x.c), ||x||^2 is constant per row
+    c_sq = (centroids * centroids).sum(1)
+    out = np.empty(len(x), dtype=np.int32)
+    for start in range(0, len(x), CHUNK_ROWS):
+        block = x[start : start + CHUNK_ROWS]
+        out[start : start + len(block)] = np.argmin(c_sq - 2 * block @ centroids.T, axis=1)
+    return out
+
+
+def kmeans(x: np.ndarray, k: int, iters: int = 20, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    k = min(k, len(x))
+    centroids = x[rng.choice(len(x), k, replace=False)].copy()
+    for _ in range(iters):
+        assign = _assign(x, centroids)
+        counts = np.bincount(assign, minlength=k)
+        order = np.argsort(assign, kind="stable")
+        filled = np.flatnonzero(counts)
+        starts = np.searchsorted(assign[order], filled)
+        sums = np.add.reduceat(x[order], starts, axis=0)
+        centroids[filled] = sums / counts[filled, None]
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = x[rng.choice(len(x), len(empty), replace=False)]
+    return centroids
+
+
+class FlatIndex:
+    """Exact inner product search, used while the enrolled set is small."""
+
+    kind = "flat"
+
+    def __init__(self, vectors: np.ndarray, ids: np.ndarray):
+        self.vectors = vectors
+        self.ids = ids
+
+    @property
+    def ntotal(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, vectors, ids) -> "FlatIndex":
+        return cls(normalize(vectors), np.asarray(ids, dtype=np.int64))
+
+    def search(self, query, k: int = 1, **_) -> Tuple[np.ndarray, np.ndarray]:
+        if self.ntotal == 0:
+            return np.empty(0, np.int64), np.empty(0, np.float32)
+        sims = self.vectors @ normalize(query)
+        k = min(k, len(sims))
+        top = np.argpartition(-sims, k - 1)[:k]
+        top = top[np.argsort(-sims[top])]
+        return self.ids[top], sims[top]
+
+    def search_batch(self, queries, k: int = 1, **_) -> List[Tuple[np.ndarray, np.ndarray]]:
+        return [self.search(q, k) for q in normalize(queries)]
+
+    def memory_bytes(self) -> int:
+        return self.vectors.nbytes + self.ids.nbytes
+
+    def save(self, path: str) -> None:
+        np.save(os.path.join(path, "vectors.npy"), self.vectors)
+        np.save(os.path.join(path, "ids.npy"), self.ids)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "FlatIndex":
+        mode = "r" if mmap else None
+        return cls(
+            np.load(os.path.join(path, "vectors.npy"), mmap_mode=mode),
+            np.load(os.path.join(path, "ids.npy")),
+        )
+
+
+class IVFPQIndex:
+    """Inverted file over k-means lists with product-quantized residuals.
+
+    Each vector is kept in RAM as m one-byte codes (m=32 is 16x smaller than
+    128 float32). A query probes the nprobe closest lists, ranks their codes
+    with per-list lookup tables and re-ranks the best rerank candidates
+    exactly against the float32 vectors, which stay on disk behind mmap.
+    """
+
+    kind = "ivfpq"
+
+    def __init__(self, centroids, codebooks, codes, biases, ids, offsets, vectors):
+        self.centroids = centroids  # (nlist, d)
+        self.codebooks = codebooks  # (m, ksub, dsub)
+        self.codes = codes  # (n, m) uint8, grouped by list
+        self.biases = biases  # (n,) ||r||^2 + 2 c.r of each reconstructed residual
+        self.ids = ids  # (n,)
+        self.offsets = offsets  # (nlist + 1,) list boundaries in codes
+        self.vectors = vectors  # (n, d) float32, same order as codes
+        self.centroid_norms = (centroids * centroids).sum(1)
+        self.code_offsets = np.arange(codebooks.shape[0], dtype=np.int32) * codebooks.shape[1]
+
+    @property
+    def ntotal(self) -> int:
+        return len(self.ids)
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    @property
+    def m(self) -> int:
+        return self.codebooks.shape[0]
+
+    @classmethod
+    def build(
+        cls,
+        vectors,
+        ids,
+        nlist: Optional[int] = None,
+        m: int = 32,
+        train_size: int = 65536,
+        iters: int = 20,
+        seed: int = 0,
+    ) -> "IVFPQIndex":
+        x = normalize(vectors)
+        ids = np.asarray(ids, dtype=np.int64)
+        n, d = x.shape
+        if d % m:
+            raise ValueError(f"dimension {d} is not divisible by m={m}")
+        dsub = d // m
+        if nlist is None:
+            nlist = int(min(4096, max(1, 4 * np.sqrt(n))))
+        rng = np.random.default_rng(seed)
+        train = x[rng.choice(n, min(n, max(train_size, nlist * 39)), replace=False)]
+
+        centroids = kmeans(train, nlist, iters=iters, seed=seed)
+        nlist = len(centroids)
+        train_residuals = train - centroids[_assign(train, centroids)]
+        codebooks = np.stack(
+            [
+                kmeans(train_residuals[:, j * dsub : (j + 1) * dsub], 256, iters=iters, seed=seed + j)
+                for j in range(m)
+            ]
+        )
+
+        assign = _assign(x, centroids)
+        order = np.argsort(assign, kind="stable")
+        x, ids, assign = x[order], ids[order], assign[order]
+        residuals = x - centroids[assign]
+        codes = np.empty((n, m), dtype=np.uint8)
+        for j in range(m):
+            codes[:, j] = _assign(residuals[:, j * dsub : (j + 1) * dsub], codebooks[j])
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(assign, minlength=nlist))
+        reconstructed = codebooks[np.arange(m), codes.astype(np.int64)].reshape(n, d)
+        biases = (reconstructed * (reconstructed + 2 * centroids[assign])).sum(1)
+        return cls(centroids, codebooks, codes, biases.astype(np.float32), ids, offsets, x)
+
+    def _candidates(self, q: np.ndarray, nprobe: int) -> Tuple[np.ndarray, np.ndarray]:
+        # ||q - c - r||^2 = ||q - c||^2 + (||r||^2 + 2 c.r) - 2 q.r, the middle term is
+        # stored per vector at build time so only the q.r table depends on the query
+        coarse = self.centroid_norms - 2 * (self.centroids @ q)
+        nprobe = min(nprobe, self.nlist)
+        probe = np.argpartition(coarse, nprobe - 1)[:nprobe]
+        starts, ends = self.offsets[probe], self.offsets[probe + 1]
+        lengths = ends - starts
+        if not lengths.sum():
+            return np.empty(0, np.int64), np.empty(0, np.float32)
+        positions = np.concatenate([np.arange(s, e) for s, e in zip(starts, ends)])
+
+        m, ksub, dsub = self.codebooks.shape
+        lut = np.einsum("mkd,md->mk", self.codebooks, q.reshape(m, dsub)).ravel()
+        codes = self.codes[positions] + self.code_offsets
+        approx = np.repeat(coarse[probe], lengths) + self.biases[positions] - 2 * lut[codes].sum(1)
+        return positions, approx
+
+    def search(
+        self, query, k: int = 1, nprobe: int = 8, rerank: int = 32
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        q = normalize(query)
+        positions, approx = self._candidates(q, nprobe)
+        if not len(positions):
+            return np.empty(0, np.int64), np.empty(0, np.float32)
+        r = min(max(rerank, k), len(positions))
+        best = np.sort(positions[np.argpartition(approx, r - 1)[:r]])  # sorted reads on the mmap
+        sims = self.vectors[best] @ q
+        top = np.argsort(-sims)[:k]
+        return self.ids[best[top]], sims[top]
+
+    def search_batch(
+        self, queries, k: int = 1, nprobe: int = 8, rerank: int = 32
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        return [self.search(q, k, nprobe, rerank) for q in normalize(queries)]
+
+    def memory_bytes(self) -> int:
+        # resident part only, vectors are read through the page cache on re-rank
+        return sum(
+            a.nbytes
+            for a in (self.centroids, self.codebooks, self.codes, self.biases, self.ids, self.offsets)
+        )
+
+    def save(self, path: str) -> None:
+        for name in ("centroids", "codebooks", "codes", "biases", "ids", "offsets", "vectors"):
+            np.save(os.path.join(path, f"{name}.npy"), getattr(self, name))
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "IVFPQIndex":
+        def load(name, mode=None):
+            return np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mode)
+
+        return cls(
+            load("centroids"),
+            load("codebooks"),
+            load("codes"),
+            load("biases"),
+            load("ids"),
+            load("offsets"),
+            load("vectors", "r" if mmap else None),
+        )
+
+
+INDEX_TYPES = {FlatIndex.kind: FlatIndex, IVFPQIndex.kind: IVFPQIndex}
+
+
+def build_index(vectors, ids, min_ivf: int = FACE_INDEX_MIN_IVF, m: int = FACE_INDEX_PQ_M):
+    if len(ids) < min_ivf:
+        return FlatIndex.build(vectors, ids)
+    return IVFPQIndex.build(vectors, ids, m=m)
+
+
+def save_index(index, root: str, meta: Dict) -> str:
+    """Write index into a new version directory under root and point CURRENT at it.
+
+    The caller holds root's build lock. Replaced versions stay for
+    VERSION_KEEP_SECONDS so workers still loading them keep working.
+    """
+    path = os.path.join(root, new_version(root))
+    index.save(path)
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump({**meta, "kind": index.kind}, f)
+    publish(root, os.path.basename(path))
+    return path
+
+
+def load_version(path: str):
+    """Return (index, meta) of one version directory, the index memory mapped."""
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    meta["version"] = os.path.basename(path)
+    return INDEX_TYPES[meta["kind"]].load(path), meta
+
+
+def load_index(root: str):
+    """Return (index, meta) for the CURRENT version under root, or (None, None)."""
+    try:
+        with open(os.path.join(root, "CURRENT")) as f:
+            return load_version(os.path.join(root, f.read().strip()))
+    except OSError:
+        return None, None
+
+
+def _origin() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class FaceMatcher:
+    """Matches probe embeddings against every enrolled student.
+
+    The bulk of the enrolled vectors sit in an IVF-PQ (or flat) index built
+    from the face_embeddings table and persisted under FACE_INDEX_DIR.
+    Enrollments made after the build are searched exactly in a small delta
+    set, and their previous vectors in the main index are ignored. The main
+    index is rebuilt in the background once the delta grows past
+    FACE_INDEX_REBUILD_DELTA, by whichever worker takes the build lock on
+    FACE_INDEX_DIR first.
+
+    Enrollments, removals and rebuilds are broadcast on INDEX_CHANNEL so
+    every worker applies them, not only the one that served the request.
+    """
+
+    def __init__(self, index_dir: str, threshold: float, dim: int):
+        self.index_dir = index_dir
+        self.threshold = threshold
+        self.dim = dim
+        self._index = None
+        self._version = ""
+        self._watermark = None
+        self._delta: Dict[int, np.ndarray] = {}
+        self._delta_matrix = (np.empty(0, np.int64), np.empty((0, dim), np.float32))
+        # removed users whose vectors may still be in the main index
+        self._removed: set = set()
+        self._stale: set = set()
+        # every enroll or remove gets the next sequence number, so a build knows what it missed
+        self._sequence = 0
+        self._changed: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._rebuilding = False
+        self.session_factory = None
+        pubsub.broker.add_listener(INDEX_CHANNEL, self._on_message)
+
+    @property
+    def size(self) -> int:
+        index = self._index
+        return (index.ntotal if index is not None else 0) + len(self._delta)
+
+    def load(self, session_factory) -> None:
+        """Load the persisted index, or build one, then pick up newer enrollments."""
+        self.session_factory = session_factory
+        index, meta = load_index(self.index_dir)
+        if index is None:
+            # the first worker to start builds, the others wait and load its copy
+            with build_lock(self.index_dir, wait=True):
+                index, meta = load_index(self.index_dir)
+                if index is None:
+                    self.rebuild()
+                    return
+        self._adopt(index, meta)
+        self._maybe_rebuild()
+
+    def rebuild(self) -> None:
+        """Build from the face_embeddings table and save it, the caller holds the build lock."""
+        with self._lock:
+            since = self._sequence
+        db = self.session_factory()
+        try:
+            rows = self._fetch(db)
+        finally:
+            db.close()
+        ids = np.array([row[0] for row in rows], dtype=np.int64)
+        vectors = (
+            np.stack([row[1] for row in rows])
+            if rows
+            else np.empty((0, self.dim), np.float32)
+        )
+        watermark = max((row[2] for row in rows if row[2] is not None), default=None)
+        watermark = watermark.isoformat() if watermark is not None else None
+        path = save_index(build_index(vectors, ids), self.index_dir, {"watermark": watermark, "count": len(ids)})
+        # serve the saved copy, memory mapped, rather than the one built in memory
+        index, meta = load_version(path)
+        with self._lock:
+            self._index = index
+            self._version = meta["version"]
+            self._watermark = watermark
+            # whatever changed after the fetch began is newer than the index and stays
+            self._forget_changes(since)
+            self._removed &= set(self._changed)
+            self._refresh_delta_matrix()
+        self._broadcast({"op": "rebuilt", "path": path})
+
+    def _adopt(self, index, meta: Dict) -> None:
+        """Serve an index built elsewhere, with everything enrolled after its watermark."""
+        with self._lock:
+            since = self._sequence
+        db = self.session_factory()
+        try:
+            rows = self._fetch(db, since=meta.get("watermark"))
+        finally:
+            db.close()
+        with self._lock:
+            if meta["version"] < self._version:
+                return
+            self._index = index
+            self._version = meta["version"]
+            self._watermark = meta.get("watermark")
+            self._forget_changes(since)
+            for user_id, vector, _ in rows:
+                if user_id not in self._changed:
+                    self._delta[user_id] = normalize(vector)
+            # the builder's fetch may predate a removal, keep ignoring removed users it still holds
+            if self._removed:
+                removed = np.fromiter(self._removed, dtype=np.int64, count=len(self._removed))
+                self._removed = set(removed[np.isin(removed, index.ids)].tolist())
+            self._refresh_delta_matrix()
+
+    def _forget_changes(self, since: int) -> None:
+        # caller holds the lock
+        kept = {u for u, sequence in self._changed.items() if sequence > since}
+        self._delta = {u: v for u, v in self._delta.items() if u in kept}
+        self._changed = {u: self._changed[u] for u in kept}
+
+    def _fetch(self, db, since: Optional[str] = None):
+        from app.model.model import FaceEmbedding
+
+        query = db.query(
+            FaceEmbedding.user_id, FaceEmbedding.embedding, FaceEmbedding.updated_at
+        )
+        if since is not None:
+            # >= so rows sharing the watermark timestamp are never skipped
+            query = query.filter(FaceEmbedding.updated_at >= datetime.fromisoformat(since))
+        rows = []
+        for user_id, data, updated_at in query.yield_per(10000):
+            vector = np.frombuffer(data, dtype=np.float32)
+            # a NaN row would win every argmax of the exact search
+            if not np.isfinite(vector).all():
+                logger.warning("skipping non-finite face embedding of user %s", user_id)
+                continue
+            rows.append((user_id, vector, updated_at))
+        return rows
+
+    def _put_delta(self, user_id: int, vector: np.ndarray) -> None:
+        self._delta[user_id] = normalize(vector)
+        self._removed.discard(user_id)
+        self._sequence += 1
+        self._changed[user_id] = self._sequence
+
+    def _refresh_delta_matrix(self) -> None:
+        ids = np.fromiter(self._delta.keys(), dtype=np.int64, count=len(self._delta))
+        vectors = (
+            np.stack(list(self._delta.values()))
+            if self._delta
+            else np.empty((0, self.dim), np.float32)
+        )
+        self._delta_matrix = (ids, vectors)
+        # a new set rather than in place, match() reads it without the lock
+        self._stale = set(self._delta) | self._removed
+
+    def enroll(self, user_id: int, vector: np.ndarray) -> None:
+        if not np.isfinite(vector).all():
+            raise ValueError("face embedding must be finite")
+        self._enroll(user_id, vector)
+        self._broadcast(
+            {
+                "op": "enroll",
+                "user_id": user_id,
+                "embedding": base64.b64encode(np.asarray(vector, "<f4").tobytes()).decode(),
+            }
+        )
+
+    def _enroll(self, user_id: int, vector: np.ndarray) -> None:
+        with self._lock:
+            self._put_delta(user_id, vector)
+            self._refresh_delta_matrix()
+        self._maybe_rebuild()
+
+    def remove(self, user_id: int) -> None:
+        self._remove(user_id)
+        self._broadcast({"op": "remove", "user_id": user_id})
+
+    def _remove(self, user_id: int) -> None:
+        with self._lock:
+            self._delta.pop(user_id, None)
+            self._removed.add(user_id)
+            self._sequence += 1
+            self._changed[user_id] = self._sequence
+            self._refresh_delta_matrix()
+
+    def _broadcast(self, message: Dict) -> None:
+        # the change is already in the database, other workers then only lag until their next rebuild
+        try:
+            pubsub.broadcast(INDEX_CHANNEL, {**message, "origin": _origin()})
+        except Exception:
+            logger.exception("could not broadcast face index %s", message["op"])
+
+    def _on_message(self, message) -> None:
+        if message.get("origin") == _origin():
+            return
+        if message["op"] == "enroll":
+            vector = np.frombuffer(base64.b64decode(message["embedding"]), dtype="<f4")
+            if len(vector) == self.dim and np.isfinite(vector).all():
+                self._enroll(int(message["user_id"]), vector)
+        elif message["op"] == "remove":
+            self._remove(int(message["user_id"]))
+        elif message["op"] == "rebuilt" and self.session_factory is not None:
+            if os.path.basename(message["path"]) <= self._version:
+                return
+            try:
+                index, meta = load_version(message["path"])
+            except OSError:
+                # superseded and deleted already, the newer version's message follows
+                return
+            self._adopt(index, meta)
+
+    def match(self, vector) -> Optional[Tuple[int, float]]:
+        """Best enrolled (user_id, cosine similarity) at or above the threshold."""
+        q = normalize(vector)
+        if not np.isfinite(q).all():
+            return None
+        best: Optional[Tuple[int, float]] = None
+        index, stale = self._index, self._stale
+        if index is not None and index.ntotal:
+            ids, sims = index.search(
+                q, k=4, nprobe=FACE_INDEX_NPROBE, rerank=FACE_INDEX_RERANK
+            )
+            for user_id, sim in zip(ids.tolist(), sims.tolist()):
+                if user_id not in stale:
+                    best = (user_id, sim)
+                    break
+        delta_ids, delta_vectors = self._delta_matrix
+        if len(delta_ids):
+            sims = delta_vectors @ q
+            i = int(np.argmax(sims))
+            if best is None or sims[i] > best[1]:
+                best = (int(delta_ids[i]), float(sims[i]))
+        # written so a NaN similarity never passes
+        if best is None or not best[1] >= self.threshold:
+            return None
+        return best
+
+    def _maybe_rebuild(self) -> None:
+        if len(self._delta) < FACE_INDEX_REBUILD_DELTA or self._rebuilding:
+            return
+        self._rebuilding = True
+
+        def run():
+            try:
+                with build_lock(self.index_dir) as held:
+                    if not held:
+                        return  # another worker is rebuilding, its version is broadcast
+                    index, meta = load_index(self.index_dir)
+                    if index is not None and meta["version"] > self._version:
+                        # saved by another worker, its broadcast may not be here yet
+                        self._adopt(index, meta)
+                    else:
+                        self.rebuild()
+            except Exception:
+                logger.exception("face index rebuild failed")
+            finally:
+                self._rebuilding = False
+
+        threading.Thread(target=run, name="face-index-rebuild", daemon=True).start()
+
+
+face_matcher = FaceMatcher(FACE_INDEX_DIR, FACE_MATCH_THRESHOLD, FACE_EMBEDDING_DIM)
@@ -0,0 +1,269 @@
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional
+
+from app.core.config import (
+    IMAGE_JPEG_QUALITY,
+    IMAGE_MAX_PIXELS,
+    IMAGE_THUMBNAIL_SIZES,
+    IMAGE_WEBP_QUALITY,
+    IMAGE_WORKERS,
+    MEDIA_DIR,
+)
+
+logger = logging.getLogger(__name__)
+
+MEDIA_URL_PREFIX = "/api/v1/media"
+THUMBNAIL_FORMATS = {"webp": "WEBP", "jpg": "JPEG"}
+# width of the thumbnail list endpoints return
+LIST_THUMBNAIL_SIZE = IMAGE_THUMBNAIL_SIZES[len(IMAGE_THUMBNAIL_SIZES) // 2]
+
+KEY_RE = re.compile(r"^[0-9a-f]{64}$")
+VARIANT_RE = re.compile(r"^(original\.(?:jpg|png|webp|gif)|\d+\.(?:webp|jpg))$")
+CONTENT_TYPES = {"jpg": "image/jpeg", "png": "image/png", "webp": "image/webp", "gif": "image/gif"}
+# a key whose render failed is not retried by GET /media before this many seconds
+RENDER_RETRY_SECONDS = 300
+
+
+class UnsupportedImage(ValueError):
+    pass
+
+
+def sniff_extension(data: bytes) -> str:
+    """Extension of a JPEG, PNG, WebP or GIF by its magic bytes, the upload's name and type are not trusted."""
+    if data[:3] == b"\xff\xd8\xff":
+        return "jpg"
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    raise UnsupportedImage("only JPEG, PNG, WebP and GIF images are accepted")
+
+
+def image_dir(key: str) -> str:
+    return os.path.join(MEDIA_DIR, key[:2], key)
+
+
+def media_url(key: str, variant: str) -> str:
+    return f"{MEDIA_URL_PREFIX}/{key}/{variant}"
+
+
+def thumbnail_urls(key: Optional[str]) -> Dict[str, str]:
+    if not key:
+        return {}
+    return {
+        f"{size}.{ext}": media_url(key, f"{size}.{ext}")
+        for size in IMAGE_THUMBNAIL_SIZES
+        for ext in THUMBNAIL_FORMATS
+    }
+
+
+def list_thumbnail_url(key: Optional[str]) -> Optional[str]:
+    return media_url(key, f"{LIST_THUMBNAIL_SIZE}.webp") if key else None
+
+
+def original_name(key: str) -> Optional[str]:
+    directory = image_dir(key)
+    if not os.path.isdir(directory):
+        return None
+    for name in os.listdir(directory):
+        if name.startswith("original."):
+            return name
+    return None
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def store_original(data: bytes) -> str:
+    """Keep the upload under its sha256, an identical upload is stored once."""
+    ext = sniff_extension(data)
+    key = hashlib.sha256(data).hexdigest()
+    directory = image_dir(key)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"original.{ext}")
+    if not os.path.exists(path):
+        _write_atomic(path, data)
+    return key
+
+
+def accept_upload(data: bytes) -> str:
+    """Check the upload decodes, store the original and queue its thumbnails, returns the image key."""
+    thumbnailer.verify(data)
+    key = store_original(data)
+    if not all(os.path.exists(os.path.join(image_dir(key), name)) for name in thumbnail_urls(key)):
+        thumbnailer.submit(key)
+    return key
+
+
+def upload_result(key: str) -> Dict[str, object]:
+    return {
+        "image_key": key,
+        "image_url": media_url(key, original_name(key) or "original"),
+        "thumbnail_url": list_thumbnail_url(key),
+        "thumbnails": thumbnail_urls(key),
+    }
+
+
+def _pillow():
+    import warnings
+
+    from PIL import Image
+
+    Image.MAX_IMAGE_PIXELS = IMAGE_MAX_PIXELS
+    warnings.simplefilter("error", Image.DecompressionBombWarning)
+    return Image
+
+
+def verify_image(data: bytes) -> None:
+    """Raise if Pillow cannot parse the upload or it is over IMAGE_MAX_PIXELS, runs in a pool process."""
+    Image = _pillow()
+    with Image.open(io.BytesIO(data)) as image:
+        image.verify()
+
+
+def render_thumbnails(directory: str, sizes: List[int]) -> List[str]:
+    """Decode the original once and write every size as WebP and JPEG, runs in a pool process."""
+    from PIL import ImageOps
+
+    Image = _pillow()
+
+    name = next(n for n in os.listdir(directory) if n.startswith("original."))
+    written = []
+    with Image.open(os.path.join(directory, name)) as source:
+        # JPEG can decode straight at a reduced scale, far cheaper than a full decode then resize
+        source.draft("RGB", (max(sizes), max(sizes)))
+        image = ImageOps.exif_transpose(source)
+        has_alpha = image.mode in ("RGBA", "LA") or "transparency" in image.info
+        image = image.convert("RGBA" if has_alpha else "RGB")
+        for size in sorted(sizes, reverse=True):
+            # sizes go largest first so each resize starts from the previous, smaller image
+            image.thumbnail((size, size), Image.Resampling.LANCZOS, reducing_gap=3.0)
+            for ext, fmt in THUMBNAIL_FORMATS.items():
+                path = os.path.join(directory, f"{size}.{ext}")
+                if os.path.exists(path):
+                    continue
+                frame = image if fmt == "WEBP" or not has_alpha else _flatten(image)
+                fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+                try:
+                    with os.fdopen(fd, "wb") as f:
+                        if fmt == "WEBP":
+                            frame.save(f, fmt, quality=IMAGE_WEBP_QUALITY, method=4)
+                        else:
+                            frame.save(f, fmt, quality=IMAGE_JPEG_QUALITY, optimize=True, progressive=True)
+                    os.replace(tmp_path, path)
+                except BaseException:
+                    os.unlink(tmp_path)
+                    raise
+                written.append(path)
+    return written
+
+
+def _flatten(image):
+    from PIL import Image
+
+    background = Image.new("RGB", image.size, (255, 255, 255))
+    background.paste(image, mask=image.getchannel("A"))
+    return background
+
+
+class Thumbnailer:
+    """Process pool that renders thumbnails off the request path.
+
+    Resizing and encoding are CPU bound and hold the GIL, a pool of processes
+    keeps them away from the event loop and the request threadpool. Work for
+    a key already in flight is not queued twice.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pending: Dict[str, Future] = {}
+        self._failed: Dict[str, float] = {}  # key -> monotonic time of the failed render
+        # reentrant, a future that is already done runs its callback inside submit
+        self._lock = threading.RLock()
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # forkserver, forking a process that already runs threads is not safe
+            self._pool = ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context("forkserver")
+            )
+        return self._pool
+
+    def _run(self, fn, *args) -> Future:
+        with self._lock:
+            try:
+                return self._executor().submit(fn, *args)
+            except BrokenProcessPool:
+                # a worker died (e.g. killed for memory), start a fresh pool
+                self._pool = None
+                return self._executor().submit(fn, *args)
+
+    def verify(self, data: bytes) -> None:
+        """Raise UnsupportedImage unless data decodes, checked in the pool like the renders."""
+        try:
+            self._run(verify_image, data).result()
+        except BrokenProcessPool:
+            raise
+        except Exception as e:
+            raise UnsupportedImage(f"the image could not be decoded: {e}")
+
+    def submit(self, key: str) -> Future:
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                future = self._run(render_thumbnails, image_dir(key), IMAGE_THUMBNAIL_SIZES)
+                self._pending[key] = future
+                future.add_done_callback(lambda f, key=key: self._done(key, f))
+            return future
+
+    def ensure(self, key: str) -> None:
+        """Queue the render of a key with missing variants, unless it failed recently."""
+        with self._lock:
+            failed_at = self._failed.get(key)
+            if failed_at is not None and time.monotonic() - failed_at < RENDER_RETRY_SECONDS:
+                return
+            self.submit(key)
+
+    def pending(self, key: str) -> bool:
+        with self._lock:
+            return key in self._pending
+
+    def _done(self, key: str, future: Future) -> None:
+        with self._lock:
+            self._pending.pop(key, None)
+            if future.exception() is None:
+                self._failed.pop(key, None)
+            else:
+                self._failed[key] = time.monotonic()
+        if future.exception() is not None:
+            logger.error("thumbnails for %s failed: %r", key, future.exception())
+
+    def shutdown(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=False)
+
+
+thumbnailer = Thumbnailer(IMAGE_WORKERS)
@@ -0,0 +1,473 @@
+import logging
+import queue
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import or_, update
+from sqlalchemy.orm import Session
+
+from app.core import pubsub
+from app.core.config import (
+    NOTIFY_BATCH_SIZE,
+    NOTIFY_LEASE_SECONDS,
+    NOTIFY_MAX_ATTEMPTS,
+    NOTIFY_POLL_SECONDS,
+    NOTIFY_RATE_PER_SECOND,
+    NOTIFY_SENDERS,
+    NOTIFY_RETRY_BASE_SECONDS,
+    SMTP_FROM,
+    SMTP_HOST,
+    SMTP_PASSWORD,
+    SMTP_POOL_SIZE,
+    SMTP_PORT,
+    SMTP_SSL,
+    SMTP_STARTTLS,
+    SMTP_TIMEOUT_SECONDS,
+    SMTP_USERNAME,
+)
+from app.db import SessionLocal, insert_ignore
+from app.model.model import (
+    Club as ClubModel,
+    Event as EventModel,
+    NotificationJob,
+    User as UserModel,
+    club_memberships,
+)
+from app.schema.enums import EventStatusType
+
+logger = logging.getLogger(__name__)
+
+# workers wake on this as soon as a job commits instead of waiting for the next poll
+WAKE_CHANNEL = "notifications:wake"
+EVENT_POSTED = "event_posted"
+# an idle relay connection is checked with NOOP before it is reused
+IDLE_CHECK_SECONDS = 30
+
+
+def utcnow() -> datetime:
+    return datetime.utcnow()
+
+
+def enqueue_event_posted(db: Session, event_id: int) -> NotificationJob:
+    """Queue the "new event" mail to the club's members, sent once db commits.
+
+    Only one row is written here, the members are read and mailed by the
+    worker so the request costs the same for a club of 3 or 3,000. An event
+    approved again after going back to PENDING keeps its first job, members
+    are mailed about an event once. The insert skips on the (kind, event_id)
+    unique constraint, so two approvals racing still queue a single job.
+    """
+    stmt = (
+        insert_ignore(NotificationJob.__table__, db.get_bind())
+        .values(kind=EVENT_POSTED, event_id=event_id, next_attempt_at=utcnow())
+        .returning(NotificationJob.id)
+    )
+    if db.execute(stmt).first() is not None:
+        pubsub.publish(db, WAKE_CHANNEL, {"kind": EVENT_POSTED, "event_id": event_id})
+    return (
+        db.query(NotificationJob)
+        .filter(NotificationJob.kind == EVENT_POSTED, NotificationJob.event_id == event_id)
+        .one()
+    )
+
+
+class TokenBucket:
+    """Recipients per second shared by every sending thread, bursts up to capacity."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, n: int, stop: Optional[threading.Event] = None) -> bool:
+        """Block until n tokens are taken, False when stop is set first."""
+        if self.rate <= 0:
+            return True
+        n = min(n, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= n:
+                    self._tokens -= n
+                    return True
+                wait = (n - self._tokens) / self.rate
+            if stop is None:
+                time.sleep(wait)
+            elif stop.wait(wait):
+                return False
+
+
+class SMTPPool:
+    """Reusable, already authenticated connections to the relay.
+
+    Opening a connection costs a TCP and TLS handshake plus AUTH, several
+    round trips per message if done every time. Connections are handed out
+    one per thread and returned after use, a connection that failed is
+    closed instead of returned.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        username: str = "",
+        password: str = "",
+        starttls: bool = True,
+        ssl: bool = False,
+        size: int = 4,
+        timeout: float = 10,
+    ):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.ssl = ssl
+        self.size = size
+        self.timeout = timeout
+        self._idle: "queue.LifoQueue[Tuple[smtplib.SMTP, float]]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self) -> smtplib.SMTP:
+        if self.ssl:
+            conn: smtplib.SMTP = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            conn = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.starttls:
+                conn.starttls()
+        if self.username:
+            conn.login(self.username, self.password)
+        return conn
+
+    def _checkout(self) -> smtplib.SMTP:
+        while True:
+            try:
+                conn, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if time.monotonic() - last_used < IDLE_CHECK_SECONDS:
+                return conn
+            try:
+                if conn.noop()[0] == 250:
+                    return conn
+            except smtplib.SMTPException:
+                pass
+            self._discard(conn)
+
+    @contextmanager
+    def connection(self) -> Iterator[smtplib.SMTP]:
+        with self._slots:
+            conn = self._checkout()
+            try:
+                yield conn
+            except BaseException:
+                self._discard(conn)
+                raise
+            self._idle.put((conn, time.monotonic()))
+
+    def send(self, message: EmailMessage, recipients: List[str]) -> Dict[str, Tuple[int, bytes]]:
+        """Send one message to recipients, returns those the relay refused."""
+        with self.connection() as conn:
+            return conn.send_message(message, to_addrs=recipients)
+
+    @staticmethod
+    def _discard(conn: smtplib.SMTP) -> None:
+        try:
+            conn.quit()
+        except Exception:
+            conn.close()
+
+    def close(self) -> None:
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(conn)
+
+
+class LogTransport:
+    """Stand-in while no relay is configured, messages are logged and count as sent."""
+
+    size = 1
+
+    def send(self, message: EmailMessage, recipients: List[str]) -> Dict[str, Tuple[int, bytes]]:
+        logger.info("mail %r to %d recipients (SMTP_HOST not set)", message["Subject"], len(recipients))
+        return {}
+
+    def close(self) -> None:
+        pass
+
+
+def make_transport():
+    if not SMTP_HOST:
+        return LogTransport()
+    return SMTPPool(
+        SMTP_HOST,
+        SMTP_PORT,
+        SMTP_USERNAME,
+        SMTP_PASSWORD,
+        starttls=SMTP_STARTTLS,
+        ssl=SMTP_SSL,
+        size=SMTP_POOL_SIZE,
+        timeout=SMTP_TIMEOUT_SECONDS,
+    )
+
+
+def is_transient(exc: Exception) -> bool:
+    """Worth retrying later: network trouble or a 4xx reply from the relay."""
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        return False
+    if isinstance(exc, smtplib.SMTPResponseException):
+        return 400 <= exc.smtp_code < 500
+    return isinstance(exc, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError))
+
+
+def event_posted_message(event: EventModel, club: ClubModel) -> EmailMessage:
+    message = EmailMessage()
+    message["Subject"] = f"New event from {club.name}: {event.name}"
+    message["From"] = SMTP_FROM
+    # recipients only travel in the envelope, members never see each other's address
+    message["To"] = "undisclosed-recipients:;"
+    when = event.start_time.strftime("%A %d %B %Y, %H:%M") if event.start_time else "to be announced"
+    lines = [
+        f"{club.name} just posted a new event.",
+        "",
+        event.name,
+        f"When: {when}",
+        f"Where: {event.location}",
+    ]
+    if event.description:
+        lines += ["", event.description]
+    lines += [
+        "",
+        "You get this email because you are a member of the club.",
+        "Turn off email notifications in your profile to stop them.",
+    ]
+    message.set_content("\n".join(lines))
+    return message
+
+
+class NotificationWorker:
+    """Sends queued notification_jobs in batches from a background thread.
+
+    A job is claimed with a lease (locked_until) so several app workers can
+    run side by side, one whose process died is picked up again once its
+    lease runs out. Recipients are walked in user id order, NOTIFY_BATCH_SIZE
+    per message, and the job's cursor is committed after every message, so
+    a retry or a restart resumes where it stopped instead of mailing anyone
+    twice. Up to transport.size jobs are sent at once, all sharing one rate
+    limit. The bucket is per process, so every sender gets
+    NOTIFY_RATE_PER_SECOND / NOTIFY_SENDERS. Transient failures back off
+    exponentially, a job fails for good after max_attempts failures in a row.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        transport_factory: Callable = make_transport,
+        batch_size: int = NOTIFY_BATCH_SIZE,
+        rate_per_second: float = NOTIFY_RATE_PER_SECOND / NOTIFY_SENDERS,
+        max_attempts: int = NOTIFY_MAX_ATTEMPTS,
+        retry_base_seconds: int = NOTIFY_RETRY_BASE_SECONDS,
+        poll_seconds: int = NOTIFY_POLL_SECONDS,
+        lease_seconds: int = NOTIFY_LEASE_SECONDS,
+    ):
+        self.session_factory = session_factory
+        self.transport_factory = transport_factory
+        self.batch_size = batch_size
+        self.rate = TokenBucket(rate_per_second, max(rate_per_second, batch_size))
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self.poll_seconds = poll_seconds
+        self.lease = timedelta(seconds=lease_seconds)
+        self.transport = None
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        pubsub.broker.add_listener(WAKE_CHANNEL, lambda message: self._wakeup.set())
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self.transport = self.transport_factory()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="notification-worker", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._wakeup.set()
+        self._thread.join()
+        self._thread = None
+        self.transport.close()
+
+    def _run(self) -> None:
+        with ThreadPoolExecutor(self.transport.size, thread_name_prefix="notification-send") as pool:
+            while not self._stop_event.is_set():
+                try:
+                    job_ids = self._claim(self.transport.size)
+                    # the lease is ours now, each job is sent on its own thread and connection
+                    list(pool.map(self._process, job_ids))
+                except Exception:
+                    logger.exception("notification worker pass failed")
+                    job_ids = []
+                if not job_ids:
+                    self._wakeup.wait(self.poll_seconds)
+                    self._wakeup.clear()
+
+    def run_pending(self) -> int:
+        """Send every job that is due on the calling thread, returns how many were worked on."""
+        if self.transport is None:
+            self.transport = self.transport_factory()
+        done = 0
+        while True:
+            job_ids = self._claim(1)
+            if not job_ids:
+                return done
+            self._process(job_ids[0])
+            done += 1
+
+    def _claim(self, limit: int) -> List[int]:
+        now = utcnow()
+        db = self.session_factory()
+        try:
+            candidates = [
+                job_id
+                for (job_id,) in db.query(NotificationJob.id)
+                .filter(
+                    NotificationJob.status.in_(("pending", "running")),
+                    NotificationJob.next_attempt_at <= now,
+                    or_(NotificationJob.locked_until.is_(None), NotificationJob.locked_until < now),
+                )
+                .order_by(NotificationJob.next_attempt_at, NotificationJob.id)
+                .limit(limit)
+            ]
+            claimed = []
+            for job_id in candidates:
+                # conditional update, only one worker sees its row change
+                result = db.execute(
+                    update(NotificationJob)
+                    .where(
+                        NotificationJob.id == job_id,
+                        or_(NotificationJob.locked_until.is_(None), NotificationJob.locked_until < now),
+                    )
+                    .values(status="running", locked_until=now + self.lease)
+                )
+                if result.rowcount == 1:
+                    claimed.append(job_id)
+            db.commit()
+            return claimed
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _process(self, job_id: int) -> None:
+        db = self.session_factory()
+        try:
+            job = db.get(NotificationJob, job_id)
+            if job is None:
+                return
+            if job.kind != EVENT_POSTED:
+                self._finish(db, job, "failed", f"unknown kind {job.kind}")
+                return
+            event = db.get(EventModel, job.event_id)
+            if event is None or event.status != EventStatusType.POSTED:
+                # deleted or sent back to planning since it was approved
+                self._finish(db, job, "done", "event no longer posted")
+                return
+            club = db.get(ClubModel, event.club_id)
+            if club is None:
+                self._finish(db, job, "done", "club no longer exists")
+                return
+            message = event_posted_message(event, club)
+            while not self._stop_event.is_set():
+                batch = self._recipients(db, club.id, job.cursor)
+                if not batch:
+                    self._finish(db, job, "done", None)
+                    return
+                if not self.rate.acquire(len(batch), self._stop_event):
+                    break
+                try:
+                    refused = self._send(message, [email for _, email in batch])
+                except Exception as exc:
+                    self._failed(db, job, exc)
+                    return
+                job.cursor = batch[-1][0]
+                job.sent += len(batch) - len(refused)
+                job.refused += len(refused)
+                job.attempts = 0
+                job.locked_until = utcnow() + self.lease
+                db.commit()
+            # stopping, hand the rest back to whichever worker runs next
+            job.status = "pending"
+            job.locked_until = None
+            db.commit()
+        except Exception:
+            db.rollback()
+            logger.exception("notification job %s failed", job_id)
+        finally:
+            db.close()
+
+    def _recipients(self, db: Session, club_id: int, after_user_id: int) -> List[Tuple[int, str]]:
+        return (
+            db.query(UserModel.id, UserModel.email)
+            .join(club_memberships, club_memberships.c.user_id == UserModel.id)
+            .filter(
+                club_memberships.c.club_id == club_id,
+                UserModel.wants_email_notif.is_(True),
+                UserModel.id > after_user_id,
+            )
+            .order_by(UserModel.id)
+            .limit(self.batch_size)
+            .all()
+        )
+
+    def _send(self, message: EmailMessage, recipients: List[str]) -> Dict[str, Tuple[int, bytes]]:
+        try:
+            return self.transport.send(message, recipients)
+        except smtplib.SMTPRecipientsRefused as exc:
+            # every address of the batch refused, nothing to retry
+            return exc.recipients
+
+    def _failed(self, db: Session, job: NotificationJob, exc: Exception) -> None:
+        job.attempts += 1
+        job.last_error = repr(exc)[:1000]
+        if not is_transient(exc) or job.attempts >= self.max_attempts:
+            logger.error("notification job %s gave up after %d attempts: %r", job.id, job.attempts, exc)
+            self._finish(db, job, "failed", job.last_error)
+            return
+        delay = self.retry_base_seconds * 2 ** (job.attempts - 1)
+        logger.warning("notification job %s retrying in %ds: %r", job.id, delay, exc)
+        job.status = "pending"
+        job.next_attempt_at = utcnow() + timedelta(seconds=delay)
+        job.locked_until = None
+        db.commit()
+
+    @staticmethod
+    def _finish(db: Session, job: NotificationJob, status: str, error: Optional[str]) -> None:
+        job.status = status
+        job.last_error = error
+        job.locked_until = None
+        db.commit()
+
+
+notification_worker = NotificationWorker(SessionLocal)
@@ -0,0 +1,212 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.core.config import PROFILE_DIR, PROFILE_INTERVAL_MS, PROFILE_KEEP
+
+logger = logging.getLogger(__name__)
+
+
+class Profile:
+    """Everything recorded for one profiled request.
+
+    Threads register themselves while they work on the request (see phase),
+    and only those threads are sampled. The request can then be followed from
+    the event loop into the threadpool without picking up other requests.
+    """
+
+    def __init__(self, method: str, path: str):
+        self.id = uuid.uuid4().hex
+        self.method = method
+        self.path = path
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.sql: List[Dict[str, Any]] = []
+        self.samples: Counter = Counter()
+        self.threads: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def add_phase(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def add_sql(self, statement: str, seconds: float) -> None:
+        with self._lock:
+            self.sql.append({"statement": statement, "ms": round(seconds * 1000, 3)})
+        self.add_phase("sql", seconds)
+
+    def enter_thread(self) -> None:
+        with self._lock:
+            self.threads[threading.get_ident()] += 1
+
+    def exit_thread(self) -> None:
+        with self._lock:
+            ident = threading.get_ident()
+            self.threads[ident] -= 1
+            if self.threads[ident] <= 0:
+                del self.threads[ident]
+
+    def sample(self, frames: Dict[int, Any]) -> None:
+        with self._lock:
+            idents = list(self.threads)
+        for ident in idents:
+            frame = frames.get(ident)
+            if frame is not None:
+                self.samples[_collapse(frame)] += 1
+
+    def summary(self, status_code: int, total: float) -> Dict[str, Any]:
+        phases = {name: round(seconds * 1000, 3) for name, seconds in self.phases.items()}
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status_code": status_code,
+            "started_at": self.started_at,
+            "total_ms": round(total * 1000, 3),
+            "phases_ms": phases,
+            "sql": self.sql,
+            "samples": sum(self.samples.values()),
+            "interval_ms": PROFILE_INTERVAL_MS,
+        }
+
+
+current_profile: ContextVar[Optional[Profile]] = ContextVar("current_profile", default=None)
+
+
+def _collapse(frame) -> str:
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+@contextmanager
+def phase(name: str):
+    """Time a phase of the current request and sample the thread running it."""
+    profile = current_profile.get()
+    if profile is None:
+        yield
+        return
+    profile.enter_thread()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_phase(name, time.perf_counter() - start)
+        profile.exit_thread()
+
+
+class Sampler:
+    """Walks the stacks of the profile's registered threads every interval."""
+
+    def __init__(self, profile: Profile, interval: float):
+        self.profile = profile
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def __enter__(self) -> "Sampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.profile.sample(sys._current_frames())
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_profile.get() is not None:
+        conn.info.setdefault("profile_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = current_profile.get()
+    starts = conn.info.get("profile_start")
+    if profile is not None and starts:
+        profile.add_sql(statement, time.perf_counter() - starts.pop())
+
+
+def install(engine: Engine) -> None:
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def _path(profile_id: str, suffix: str) -> str:
+    return os.path.join(PROFILE_DIR, f"{profile_id}{suffix}")
+
+
+def save(profile: Profile, status_code: int, total: float) -> Dict[str, Any]:
+    """Write the summary and the collapsed stacks under PROFILE_DIR, keeping the newest PROFILE_KEEP."""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    summary = profile.summary(status_code, total)
+    # flamegraph.pl / speedscope collapsed format, "frame;frame;frame count"
+    with open(_path(profile.id, ".collapsed"), "w") as f:
+        for stack, count in profile.samples.most_common():
+            f.write(f"{stack} {count}\n")
+    with open(_path(profile.id, ".json"), "w") as f:
+        json.dump(summary, f)
+    try:
+        entries = sorted(
+            (e for e in os.scandir(PROFILE_DIR) if e.name.endswith(".json")),
+            key=lambda e: e.stat().st_mtime,
+        )
+        for entry in entries[:-PROFILE_KEEP]:
+            for suffix in (".json", ".collapsed"):
+                try:
+                    os.remove(_path(entry.name[: -len(".json")], suffix))
+                except FileNotFoundError:
+                    pass
+    except OSError:
+        logger.exception("could not prune old profiles")
+    return summary
+
+
+def _valid_id(profile_id: str) -> bool:
+    return len(profile_id) == 32 and all(c in "0123456789abcdef" for c in profile_id)
+
+
+def load_summary(profile_id: str) -> Optional[Dict[str, Any]]:
+    if not _valid_id(profile_id):
+        return None
+    try:
+        with open(_path(profile_id, ".json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def collapsed_path(profile_id: str) -> Optional[str]:
+    if not _valid_id(profile_id):
+        return None
+    path = _path(profile_id, ".collapsed")
+    return path if os.path.exists(path) else None
+
+
+def list_summaries() -> List[Dict[str, Any]]:
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    summaries = []
+    for entry in os.scandir(PROFILE_DIR):
+        if entry.name.endswith(".json"):
+            summary = load_summary(entry.name[: -len(".json")])
+            if summary is not None:
+                summaries.append(summary)
+    return sorted(summaries, key=lambda s: s["started_at"], reverse=True)
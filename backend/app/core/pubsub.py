@@ -0,0 +1,175 @@
+import asyncio
+import json
+import logging
+import select
+import threading
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from app.core.config import PUBSUB_PG_NOTIFY, PUBSUB_QUEUE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# single postgres channel, the app level channel travels inside the payload
+PG_CHANNEL = "app_pubsub"
+
+
+class Broker:
+    """In-process fan-out of messages to asyncio queues and plain callbacks, safe to publish from any thread."""
+
+    def __init__(self, queue_size: int = 100):
+        self.queue_size = queue_size
+        self._subscribers: Dict[str, Dict[asyncio.Queue, asyncio.AbstractEventLoop]] = defaultdict(dict)
+        self._listeners: Dict[str, List[Callable[[Any], None]]] = defaultdict(list)
+        self._lock = threading.Lock()
+
+    # callbacks run on the publishing thread and must be quick
+    def add_listener(self, channel: str, callback: Callable[[Any], None]) -> None:
+        with self._lock:
+            self._listeners[channel].append(callback)
+
+    def subscribe(self, channel: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subscribers[channel][queue] = asyncio.get_running_loop()
+        return queue
+
+    def unsubscribe(self, channel: str, queue: asyncio.Queue) -> None:
+        with self._lock:
+            subscribers = self._subscribers.get(channel)
+            if subscribers is None:
+                return
+            subscribers.pop(queue, None)
+            if not subscribers:
+                del self._subscribers[channel]
+
+    def publish(self, channel: str, message: Any) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, {}).items())
+            listeners = list(self._listeners.get(channel, []))
+        for callback in listeners:
+            try:
+                callback(message)
+            except Exception:
+                logger.exception("pubsub listener on %s failed", channel)
+        for queue, loop in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._offer, queue, message)
+            except RuntimeError:  # loop already closed
+                self.unsubscribe(channel, queue)
+
+    @staticmethod
+    def _offer(queue: asyncio.Queue, message: Any) -> None:
+        # a slow consumer loses its oldest message rather than blocking publishers
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(message)
+
+
+broker = Broker(queue_size=PUBSUB_QUEUE_SIZE)
+
+
+class PgListener(threading.Thread):
+    """LISTENs on PG_CHANNEL and republishes every NOTIFY into the local broker."""
+
+    def __init__(self, engine: Engine):
+        super().__init__(name="pubsub-pg-listener", daemon=True)
+        self.engine = engine
+        self._stop_event = threading.Event()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def run(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                self._listen()
+            except Exception:
+                logger.exception("pubsub listener lost its connection, retrying")
+                self._stop_event.wait(1)
+
+    def _listen(self) -> None:
+        conn = self.engine.raw_connection()
+        conn.detach()  # held for the life of the thread, keep it out of the pool
+        dbapi_conn = conn.dbapi_connection
+        try:
+            dbapi_conn.autocommit = True  # type: ignore
+            with dbapi_conn.cursor() as cursor:  # type: ignore
+                cursor.execute(f"LISTEN {PG_CHANNEL}")
+            while not self._stop_event.is_set():
+                if select.select([dbapi_conn], [], [], 1.0) == ([], [], []):
+                    continue
+                dbapi_conn.poll()  # type: ignore
+                while dbapi_conn.notifies:  # type: ignore
+                    notify = dbapi_conn.notifies.pop(0)  # type: ignore
+                    data = json.loads(notify.payload)
+                    broker.publish(data["channel"], data["message"])
+        finally:
+            conn.close()
+
+
+_listener: Optional[PgListener] = None
+
+
+def uses_pg_notify(engine: Engine) -> bool:
+    return PUBSUB_PG_NOTIFY and engine.dialect.name == "postgresql"
+
+
+def start_listener(engine: Engine) -> None:
+    global _listener
+    if _listener is None and uses_pg_notify(engine):
+        _listener = PgListener(engine)
+        _listener.start()
+
+
+def stop_listener() -> None:
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener.join(timeout=5)
+        _listener = None
+
+
+def broadcast(channel: str, message: Any) -> None:
+    """Publish outside of any transaction, to every worker when NOTIFY is in use."""
+    if _listener is None:
+        broker.publish(channel, message)
+        return
+    payload = json.dumps({"channel": channel, "message": message}, default=str)
+    with _listener.engine.begin() as connection:
+        connection.execute(
+            text("SELECT pg_notify(:pg_channel, :payload)"),
+            {"pg_channel": PG_CHANNEL, "payload": payload},
+        )
+
+
+def publish(db: Session, channel: str, message: Any) -> None:
+    """Publish message once db's current transaction commits.
+
+    On postgres this is a NOTIFY inside the transaction, so every worker's
+    listener (this one included) receives it. Otherwise the message is queued
+    on the session and handed to the local broker after commit.
+    """
+    if uses_pg_notify(db.get_bind()):  # type: ignore
+        payload = json.dumps({"channel": channel, "message": message}, default=str)
+        db.execute(
+            text("SELECT pg_notify(:pg_channel, :payload)"),
+            {"pg_channel": PG_CHANNEL, "payload": payload},
+        )
+    else:
+        db.info.setdefault("pubsub_pending", []).append((channel, message))
+
+
+@event.listens_for(Session, "after_commit")
+def _flush_pending(session: Session) -> None:
+    for channel, message in session.info.pop("pubsub_pending", []):
+        broker.publish(channel, message)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_pending(session: Session) -> None:
+    session.info.pop("pubsub_pending", None)
@@ -0,0 +1,368 @@
+"""Club recommendations from co-membership and co-attendance.
+
+Each student is a row of a sparse user x club matrix: 1.0 for being a member
+plus RECOMMEND_ATTENDANCE_WEIGHT * log(1 + events attended) in that club.
+Clubs are compared by the cosine similarity of their columns, keeping the
+RECOMMEND_NEIGHBORS most similar clubs of each. A student's score for a club is
+the sum of weight * similarity over the clubs they are in, and the best
+RECOMMEND_TOP_K clubs they have not joined are kept per student.
+
+The matrix only exists as COO arrays, multiplied with numpy sort, unique
+and bincount. The result is persisted under RECOMMEND_DIR like the face index,
+and a lookup is a dict access and a slice, no SQL.
+
+Workers load the newest saved version. Once it is older than
+RECOMMEND_REFRESH_SECONDS, the one worker holding the build lock rebuilds it
+and the others pick up what it saved. Until the first build exists the
+biggest clubs are served from SQL. Run by hand, or from cron with
+RECOMMEND_BACKGROUND_BUILD=0:
+
+    python -m app.core.recommendations
+"""
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from app.core.config import (
+    RECOMMEND_ATTENDANCE_WEIGHT,
+    RECOMMEND_BACKGROUND_BUILD,
+    RECOMMEND_DIR,
+    RECOMMEND_NEIGHBORS,
+    RECOMMEND_REFRESH_SECONDS,
+    RECOMMEND_TOP_K,
+)
+from app.core.versions import build_lock, current_version, new_version, publish
+from app.model.model import Club as ClubModel, Event as EventModel, club_memberships, event_attendance
+
+logger = logging.getLogger(__name__)
+
+ARRAYS = ("user_ids", "offsets", "clubs", "scores", "seen_offsets", "seen", "popular")
+# users x clubs cells per dense scoring block, 4M float64 is 32MB
+BLOCK_CELLS = 4_000_000
+
+
+def _aggregate(keys: np.ndarray, weights: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Sum the weights of equal keys, returns the sorted unique keys and their sums."""
+    unique, inverse = np.unique(keys, return_inverse=True)
+    return unique, np.bincount(inverse, weights=weights, minlength=len(unique))
+
+
+def _expand(counts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """For items with counts[i] children each, the item and the child number of every child."""
+    owner = np.repeat(np.arange(len(counts)), counts)
+    child = np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owner, child
+
+
+def _top_per_group(groups: np.ndarray, scores: np.ndarray, k: int) -> np.ndarray:
+    """Positions of the k best scores of every group, by group then best first."""
+    # one integer sort on (group, score rank) instead of np.lexsort, several times faster
+    ranks = np.empty(len(scores), dtype=np.int64)
+    ranks[np.argsort(-scores)] = np.arange(len(scores))
+    order = np.argsort(groups * len(scores) + ranks)
+    sorted_groups = groups[order]
+    rank = np.arange(len(order)) - np.searchsorted(sorted_groups, sorted_groups, side="left")
+    return order[rank < k]
+
+
+def build(
+    club_ids: np.ndarray,
+    members: np.ndarray,
+    attended: np.ndarray,
+    top_k: int = RECOMMEND_TOP_K,
+    neighbors: int = RECOMMEND_NEIGHBORS,
+    attendance_weight: float = RECOMMEND_ATTENDANCE_WEIGHT,
+) -> Dict[str, np.ndarray]:
+    """Recommendation arrays from (user_id, club_id) and (user_id, club_id, events) rows.
+
+    club_ids are the sorted clubs that may be recommended, rows of other clubs are dropped.
+    """
+    n = len(club_ids)
+    users = np.concatenate([members[:, 0], attended[:, 0]])
+    clubs = np.concatenate([members[:, 1], attended[:, 1]])
+    weights = np.concatenate(
+        [np.ones(len(members)), attendance_weight * np.log1p(attended[:, 2].astype(np.float64))]
+    )
+    is_member = np.arange(len(users)) < len(members)
+    cols = np.searchsorted(club_ids, clubs)
+    known = cols < n
+    known[known] = club_ids[cols[known]] == clubs[known]
+    user_ids, rows = np.unique(users[known], return_inverse=True)
+    cols, weights, is_member = cols[known], weights[known], is_member[known]
+
+    # the matrix, sorted by row then column
+    keys, values = _aggregate(rows * n + cols, weights)
+    member_keys = np.intersect1d(keys, rows[is_member] * n + cols[is_member])
+    rows, cols = keys // n, keys % n
+
+    # cosine similarity of the club columns from the products of each row's entries
+    norms = np.sqrt(np.bincount(cols, weights=values * values, minlength=n))
+    per_row = np.bincount(rows, minlength=len(user_ids))
+    ends = np.repeat(np.cumsum(per_row), per_row)
+    first, offset = _expand(ends - np.arange(len(rows)) - 1)
+    second = first + 1 + offset
+    pair_keys, co = _aggregate(cols[first] * n + cols[second], values[first] * values[second])
+    a, b = pair_keys // n, pair_keys % n
+    src, dst = np.concatenate([a, b]), np.concatenate([b, a])
+    sim = np.concatenate([co, co]) / (norms[src] * norms[dst])
+    keep = _top_per_group(src, sim, neighbors)
+    nb_dst, nb_sim = dst[keep], sim[keep]
+    nb_offsets = np.searchsorted(src[keep], np.arange(n + 1))
+
+    # scores: every matrix entry spreads its weight over its club's neighbors, summed into
+    # a dense block of users x clubs, members zeroed, then the top_k of every row
+    out_rows, out_cols, out_scores = [], [], []
+    block_users = max(1, BLOCK_CELLS // max(n, 1))
+    k = min(top_k, n)
+    for first_user in range(0, len(user_ids) if k else 0, block_users):
+        size = min(block_users, len(user_ids) - first_user)
+        lo, hi = np.searchsorted(rows, [first_user, first_user + size])
+        block_cols = cols[lo:hi]
+        entry, child = _expand(nb_offsets[block_cols + 1] - nb_offsets[block_cols])
+        position = nb_offsets[block_cols][entry] + child
+        dense = np.bincount(
+            (rows[lo:hi][entry] - first_user) * n + nb_dst[position],
+            weights=values[lo:hi][entry] * nb_sim[position],
+            minlength=size * n,
+        )
+        m_lo, m_hi = np.searchsorted(member_keys, [first_user * n, (first_user + size) * n])
+        dense[member_keys[m_lo:m_hi] - first_user * n] = 0
+        dense = dense.reshape(size, n)
+        top = np.argpartition(-dense, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(dense, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        scored = top_scores > 0
+        out_rows.append(np.nonzero(scored)[0] + first_user)
+        out_cols.append(top[scored])
+        out_scores.append(top_scores[scored])
+    rec_rows = np.concatenate(out_rows) if out_rows else np.empty(0, np.int64)
+    rec_cols = np.concatenate(out_cols) if out_cols else np.empty(0, np.int64)
+    rec_scores = np.concatenate(out_scores) if out_scores else np.empty(0)
+
+    member_counts = np.bincount(member_keys % n, minlength=n)
+    popular = np.argsort(-member_counts, kind="stable")[:top_k]
+    return {
+        "user_ids": user_ids.astype(np.int64),
+        "offsets": np.searchsorted(rec_rows, np.arange(len(user_ids) + 1)).astype(np.int64),
+        "clubs": club_ids[rec_cols].astype(np.int64),
+        "scores": rec_scores.astype(np.float32),
+        "seen_offsets": np.searchsorted(member_keys // n, np.arange(len(user_ids) + 1)).astype(np.int64),
+        "seen": club_ids[member_keys % n].astype(np.int64),
+        "popular": club_ids[popular].astype(np.int64),
+    }
+
+
+def fetch(db: Session) -> Tuple[np.ndarray, Dict[int, str], np.ndarray, np.ndarray]:
+    """Active clubs, their names, membership rows and per club attendance counts."""
+    clubs = (
+        db.query(ClubModel.id, ClubModel.name)
+        .filter(ClubModel.is_active.isnot(False))
+        .order_by(ClubModel.id)
+        .all()
+    )
+    members = db.execute(select(club_memberships.c.user_id, club_memberships.c.club_id)).all()
+    attended = (
+        db.query(event_attendance.c.user_id, EventModel.club_id, func.count())
+        .join(EventModel, EventModel.id == event_attendance.c.event_id)
+        .group_by(event_attendance.c.user_id, EventModel.club_id)
+        .all()
+    )
+    return (
+        np.array([club_id for club_id, _ in clubs], dtype=np.int64),
+        {club_id: name for club_id, name in clubs},
+        np.array(members, dtype=np.int64).reshape(-1, 2),
+        np.array(attended, dtype=np.int64).reshape(-1, 3),
+    )
+
+
+def save(arrays: Dict[str, np.ndarray], root: str, meta: Dict[str, Any]) -> str:
+    """Write a new version directory under root and point CURRENT at it, caller holds the build lock."""
+    version = new_version(root)
+    path = os.path.join(root, version)
+    for name in ARRAYS:
+        np.save(os.path.join(path, f"{name}.npy"), arrays[name])
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    publish(root, version)
+    return version
+
+
+def popular_clubs(db: Session, user_id: int, limit: int) -> List[Dict[str, Any]]:
+    """Biggest active clubs the user is not in, served until the first model is built."""
+    joined = select(club_memberships.c.club_id).where(club_memberships.c.user_id == user_id)
+    rows = (
+        db.query(ClubModel.id, ClubModel.name)
+        .outerjoin(club_memberships, club_memberships.c.club_id == ClubModel.id)
+        .filter(ClubModel.is_active.isnot(False), ClubModel.id.notin_(joined))
+        .group_by(ClubModel.id, ClubModel.name)
+        .order_by(func.count(club_memberships.c.user_id).desc(), ClubModel.id)
+        .limit(limit)
+        .all()
+    )
+    return [{"club_id": club_id, "name": name, "score": 0.0, "reason": "popular"} for club_id, name in rows]
+
+
+class Recommendations:
+    """One loaded model, top-k club ids and scores per user in CSR arrays."""
+
+    def __init__(self, arrays: Dict[str, np.ndarray], meta: Dict[str, Any]):
+        self.arrays = arrays
+        self.meta = meta
+        self.names = {int(club_id): name for club_id, name in meta["names"].items()}
+        self.row_of = {user_id: row for row, user_id in enumerate(arrays["user_ids"].tolist())}
+
+    @classmethod
+    def load(cls, path: str) -> "Recommendations":
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        return cls({name: np.load(os.path.join(path, f"{name}.npy")) for name in ARRAYS}, meta)
+
+    def for_user(self, user_id: int, limit: int) -> List[Dict[str, Any]]:
+        arrays = self.arrays
+        row = self.row_of.get(user_id)
+        results: List[Dict[str, Any]] = []
+        seen = set()
+        if row is not None:
+            lo, hi = arrays["offsets"][row], arrays["offsets"][row + 1]
+            for club_id, score in zip(arrays["clubs"][lo:hi][:limit].tolist(), arrays["scores"][lo:hi].tolist()):
+                results.append(
+                    {"club_id": club_id, "name": self.names[club_id], "score": round(score, 4), "reason": "similar"}
+                )
+            seen.update(arrays["seen"][arrays["seen_offsets"][row] : arrays["seen_offsets"][row + 1]].tolist())
+        # new students, and lists too short, are filled up with the biggest clubs
+        seen.update(r["club_id"] for r in results)
+        for club_id in arrays["popular"].tolist():
+            if len(results) >= limit:
+                break
+            if club_id not in seen:
+                results.append({"club_id": club_id, "name": self.names[club_id], "score": 0.0, "reason": "popular"})
+        return results
+
+
+class ClubRecommender:
+    """Serves the current model and rebuilds it from a background thread."""
+
+    def __init__(self, root: str, refresh_seconds: float, background_build: bool = True):
+        self.root = root
+        self.refresh_seconds = refresh_seconds
+        self.background_build = background_build
+        self.session_factory: Optional[Callable[[], Session]] = None
+        self._model: Optional[Recommendations] = None
+        self._version: Optional[str] = None
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def model(self) -> Optional[Recommendations]:
+        return self._model
+
+    def start(self, session_factory: Callable[[], Session]) -> None:
+        if self._thread is not None:
+            return
+        self.session_factory = session_factory
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="club-recommender", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("club recommendation refresh failed")
+            # look again soon while another worker is still building the first version
+            self._stop_event.wait(min(self.refresh_seconds, 60 if self._model is not None else 5))
+
+    def refresh(self) -> None:
+        """Load the newest saved version, rebuild it when too old and no other worker is."""
+        self._load_current()
+        if not self.background_build or not self._outdated():
+            return
+        with build_lock(self.root) as held:
+            if not held:
+                return
+            # the previous holder may have saved a fresh version while this one checked
+            self._load_current()
+            if self._outdated():
+                self.rebuild()
+
+    def _outdated(self) -> bool:
+        model = self._model
+        return model is None or time.time() - model.meta["built_at"] >= self.refresh_seconds
+
+    def _load_current(self) -> None:
+        version = current_version(self.root)
+        if version is None or version == self._version:
+            return
+        try:
+            self._model = Recommendations.load(os.path.join(self.root, version))
+        except (OSError, ValueError):
+            # replaced and removed while loading, the next pass reads the newer CURRENT
+            logger.warning("could not load club recommendations %s, retrying", version)
+            return
+        self._version = version
+
+    def rebuild(self) -> Dict[str, Any]:
+        started = time.perf_counter()
+        db = self.session_factory()  # type: ignore
+        try:
+            club_ids, names, members, attended = fetch(db)
+        finally:
+            db.close()
+        arrays = build(club_ids, members, attended)
+        meta = {
+            "built_at": time.time(),
+            "seconds": round(time.perf_counter() - started, 3),
+            "users": len(arrays["user_ids"]),
+            "clubs": len(club_ids),
+            "names": {str(club_id): name for club_id, name in names.items()},
+        }
+        version = save(arrays, self.root, meta)
+        self._model = Recommendations(arrays, meta)
+        self._version = version
+        logger.info(
+            "club recommendations rebuilt for %d users and %d clubs in %.2fs",
+            meta["users"], meta["clubs"], meta["seconds"],
+        )
+        return meta
+
+    def recommend(self, db: Session, user_id: int, limit: int) -> List[Dict[str, Any]]:
+        model = self._model
+        if model is None:
+            return popular_clubs(db, user_id, limit)
+        return model.for_user(user_id, limit)
+
+
+club_recommender = ClubRecommender(RECOMMEND_DIR, RECOMMEND_REFRESH_SECONDS, RECOMMEND_BACKGROUND_BUILD)
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+
+    from app.db import SessionLocal
+
+    club_recommender.session_factory = SessionLocal
+    # waits for a worker that is rebuilding right now
+    with build_lock(club_recommender.root, wait=True):
+        meta = club_recommender.rebuild()
+    print(f"recommendations for {meta['users']} users over {meta['clubs']} clubs in {meta['seconds']}s")
+
+
+if __name__ == "__main__":
+    main()
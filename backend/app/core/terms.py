@@ -0,0 +1,34 @@
+from datetime import datetime
+from typing import Tuple
+
+from app.core.config import ATTENDANCE_TERM_START_MONTHS
+
+# a term id is year * 10 + its 1-based index in the year, e.g. 20262 for the fall 2026 term
+TERMS_PER_YEAR = len(ATTENDANCE_TERM_START_MONTHS)
+
+
+def term_of(moment: datetime) -> int:
+    index = sum(1 for month in ATTENDANCE_TERM_START_MONTHS if month <= moment.month)
+    if index == 0:
+        # before the first start month, still the last term of the previous year
+        return (moment.year - 1) * 10 + TERMS_PER_YEAR
+    return moment.year * 10 + index
+
+
+def shift_term(term: int, n: int) -> int:
+    year, index = divmod(term, 10)
+    year, index = divmod(year * TERMS_PER_YEAR + index - 1 + n, TERMS_PER_YEAR)
+    return year * 10 + index + 1
+
+
+def term_start(term: int) -> datetime:
+    year, index = divmod(term, 10)
+    return datetime(year, ATTENDANCE_TERM_START_MONTHS[index - 1], 1)
+
+
+def term_bounds(term: int) -> Tuple[datetime, datetime]:
+    return term_start(term), term_start(shift_term(term, 1))
+
+
+def current_term() -> int:
+    return term_of(datetime.now())
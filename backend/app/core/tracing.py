@@ -0,0 +1,346 @@
+import importlib
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.core.config import (
+    TRACE_EXPORT_BATCH,
+    TRACE_EXPORT_INTERVAL_MS,
+    TRACE_EXPORTER,
+    TRACE_FILE,
+    TRACE_OTLP_ENDPOINT,
+    TRACE_SAMPLE_RATIO,
+    TRACE_SERVICE_NAME,
+    TRACE_SQL_MAX_CHARS,
+)
+
+logger = logging.getLogger(__name__)
+
+# OTLP span kinds and status codes
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+KIND_CLIENT = 3
+STATUS_UNSET = 0
+STATUS_ERROR = 2
+
+TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+
+class Span:
+    def __init__(
+        self,
+        name: str,
+        trace_id: str,
+        parent_id: Optional[str] = None,
+        kind: int = KIND_INTERNAL,
+        start_ns: Optional[int] = None,
+    ):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = "%016x" % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.kind = kind
+        self.start_ns = time.time_ns() if start_ns is None else start_ns
+        self.end_ns: Optional[int] = None
+        self.attributes: Dict[str, Any] = {}
+        self.status = STATUS_UNSET
+        self.status_message = ""
+
+    def child(self, name: str, kind: int = KIND_INTERNAL, start_ns: Optional[int] = None) -> "Span":
+        return Span(name, self.trace_id, self.span_id, kind, start_ns)
+
+    def set_error(self, exc: BaseException) -> None:
+        self.status = STATUS_ERROR
+        self.status_message = f"{type(exc).__name__}: {exc}"
+
+    def end(self, end_ns: Optional[int] = None) -> None:
+        self.end_ns = time.time_ns() if end_ns is None else end_ns
+        processor.on_end(self)
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_otlp_attribute(k, v) for k, v in self.attributes.items()],
+            "status": {"code": self.status, "message": self.status_message},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+def otlp_payload(spans: List[Span]) -> Dict[str, Any]:
+    """ExportTraceServiceRequest in OTLP/JSON encoding."""
+    return {
+        "resourceSpans": [
+            {
+                "resource": {"attributes": [_otlp_attribute("service.name", TRACE_SERVICE_NAME)]},
+                "scopeSpans": [
+                    {"scope": {"name": __name__}, "spans": [s.to_otlp() for s in spans]}
+                ],
+            }
+        ]
+    }
+
+
+class SpanExporter:
+    """Receives finished spans in batches from the export thread."""
+
+    def export(self, spans: List[Span]) -> None:
+        raise NotImplementedError
+
+    def shutdown(self) -> None:
+        pass
+
+
+class FileExporter(SpanExporter):
+    """One OTLP/JSON export request per line, a collector's file receiver or otel-cli can replay it."""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def export(self, spans: List[Span]) -> None:
+        line = json.dumps(otlp_payload(spans), separators=(",", ":"))
+        with self._lock, open(self.path, "a") as f:
+            f.write(line + "\n")
+
+
+class OTLPHttpExporter(SpanExporter):
+    """POSTs OTLP/JSON to a collector, e.g. http://localhost:4318/v1/traces."""
+
+    def __init__(self, endpoint: str, timeout: float = 5.0):
+        self.endpoint = endpoint
+        self.timeout = timeout
+
+    def export(self, spans: List[Span]) -> None:
+        request = urllib.request.Request(
+            self.endpoint,
+            data=json.dumps(otlp_payload(spans)).encode(),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+class LogExporter(SpanExporter):
+    def export(self, spans: List[Span]) -> None:
+        for s in spans:
+            logger.info(
+                "span %s trace=%s span=%s parent=%s %.3fms %s",
+                s.name,
+                s.trace_id,
+                s.span_id,
+                s.parent_id,
+                (s.end_ns - s.start_ns) / 1e6,
+                s.attributes,
+            )
+
+
+def make_exporter(name: str) -> Optional[SpanExporter]:
+    if name == "none":
+        return None
+    if name == "file":
+        return FileExporter(TRACE_FILE)
+    if name == "otlp":
+        return OTLPHttpExporter(TRACE_OTLP_ENDPOINT)
+    if name == "log":
+        return LogExporter()
+    # anything else is a "package.module:Class" SpanExporter built without arguments
+    module_name, _, class_name = name.partition(":")
+    if class_name:
+        return getattr(importlib.import_module(module_name), class_name)()
+    raise ValueError(f"unknown TRACE_EXPORTER {name!r}")
+
+
+class BatchProcessor:
+    """Queues finished spans and hands them to the exporter from a background thread.
+
+    Spans are dropped rather than blocking a request when the queue is full or
+    no exporter is configured.
+    """
+
+    def __init__(self, exporter: Optional[SpanExporter], batch_size: int, interval: float):
+        self.exporter = exporter
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queue: "queue.Queue[Span]" = queue.Queue(maxsize=batch_size * 20)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    def on_end(self, span: Span) -> None:
+        if self.exporter is None:
+            return
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            pass
+
+    def start(self) -> None:
+        if self.exporter is None or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="trace-export", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self._flush()
+        self.exporter.shutdown()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._flush()
+
+    def _flush(self) -> None:
+        while True:
+            batch: List[Span] = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return
+            try:
+                self.exporter.export(batch)
+            except Exception:
+                logger.exception("could not export %d spans", len(batch))
+                return
+
+
+processor = BatchProcessor(
+    make_exporter(TRACE_EXPORTER), TRACE_EXPORT_BATCH, TRACE_EXPORT_INTERVAL_MS / 1000
+)
+
+current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def start_request_span(name: str, traceparent: Optional[str]) -> Optional[Span]:
+    """Root span of an incoming request, continuing the caller's trace when traceparent is valid.
+
+    A caller that did not sample its trace is not sampled here either, requests
+    without a parent are sampled at TRACE_SAMPLE_RATIO. None means untraced.
+    """
+    if not processor.enabled:
+        return None
+    match = TRACEPARENT_RE.match((traceparent or "").strip().lower())
+    if match:
+        trace_id, parent_id, flags = match.groups()
+        if trace_id == "0" * 32 or parent_id == "0" * 16:
+            match = None
+        elif not int(flags, 16) & 1:
+            return None
+    if not match:
+        if random.random() >= TRACE_SAMPLE_RATIO:
+            return None
+        trace_id, parent_id = "%032x" % random.getrandbits(128), None
+    return Span(name, trace_id, parent_id, KIND_SERVER)
+
+
+@contextmanager
+def span(name: str, **attributes: Any):
+    """Child span of the current one, a no-op outside of a traced request."""
+    parent = current_span.get()
+    if parent is None:
+        yield None
+        return
+    child = parent.child(name)
+    child.attributes.update(attributes)
+    token = current_span.set(child)
+    try:
+        yield child
+    except BaseException as exc:
+        child.set_error(exc)
+        raise
+    finally:
+        current_span.reset(token)
+        child.end()
+
+
+def record_span(name: str, start_ns: int, end_ns: int, **attributes: Any) -> None:
+    """Add an already finished child span, for phases only known after the fact."""
+    parent = current_span.get()
+    if parent is None:
+        return
+    child = parent.child(name, start_ns=start_ns)
+    child.attributes.update(attributes)
+    child.end(end_ns)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    parent = current_span.get()
+    if parent is None:
+        return
+    child = parent.child(statement.lstrip().split(" ", 1)[0].upper(), KIND_CLIENT)
+    child.attributes["db.system"] = conn.dialect.name
+    child.attributes["db.statement"] = statement[:TRACE_SQL_MAX_CHARS]
+    if executemany:
+        child.attributes["db.executemany"] = True
+    conn.info.setdefault("trace_spans", []).append(child)
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    spans = conn.info.get("trace_spans")
+    if spans and current_span.get() is not None:
+        spans.pop().end()
+
+
+def _handle_error(context):
+    spans = context.connection.info.get("trace_spans") if context.connection is not None else None
+    if spans and current_span.get() is not None:
+        child = spans.pop()
+        child.set_error(context.original_exception)
+        child.end()
+
+
+def install(engine: Engine) -> None:
+    if not processor.enabled:
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
@@ -0,0 +1,71 @@
+"""Versioned build directories shared by the worker processes of one host.
+
+A build is written to root/v<time_ns> and published by pointing root/CURRENT
+at it. Only the process holding root's build lock writes, the others load
+what it saved. Superseded versions are removed VERSION_KEEP_SECONDS after
+the next one replaced them, so a worker still loading one is not cut off.
+"""
+import logging
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:  # windows dev setups, a single process there
+    fcntl = None  # type: ignore
+
+from app.core.config import VERSION_KEEP_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def build_lock(root: str, wait: bool = False) -> Iterator[bool]:
+    """Hold root's build lock, yields False when another process has it and wait is off."""
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, "BUILD.lock"), "a") as f:
+        if fcntl is None:
+            yield True
+            return
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def new_version(root: str) -> str:
+    os.makedirs(root, exist_ok=True)
+    version = f"v{time.time_ns()}"
+    os.makedirs(os.path.join(root, version))
+    return version
+
+
+def current_version(root: str) -> Optional[str]:
+    try:
+        with open(os.path.join(root, "CURRENT")) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def publish(root: str, version: str, keep_seconds: float = VERSION_KEEP_SECONDS) -> None:
+    """Point CURRENT at version, then drop versions superseded longer than keep_seconds ago."""
+    pointer = os.path.join(root, "CURRENT")
+    with open(pointer + ".tmp", "w") as f:
+        f.write(version)
+    os.replace(pointer + ".tmp", pointer)
+    versions = sorted(v for v in os.listdir(root) if v[:1] == "v" and v[1:].isdigit())
+    now = time.time_ns()
+    # the two newest always stay, an older one went out of use when its successor was written
+    for old, successor in zip(versions[:-2], versions[1:-1]):
+        if now - int(successor[1:]) >= keep_seconds * 1e9:
+            logger.info("removing superseded version %s", os.path.join(root, old))
+            shutil.rmtree(os.path.join(root, old), ignore_errors=True)
@@ -1,20 +1,293 @@
-from sqlalchemy import create_engine
+import itertools
+import logging
+import queue
+import re
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import Table, create_engine, event, func, insert, inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 
 import os
 from dotenv import load_dotenv
 
+from app.core.config import (
+    DB_AUTO_CREATE,
+    SOFT_DELETE,
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    REPLICA_DATABASE_URLS,
+    REPLICA_RETRY_SECONDS,
+    SLOW_QUERY_EXPLAIN,
+    SLOW_QUERY_LOG_SIZE,
+    SLOW_QUERY_MS,
+    SQLITE_WAL,
+)
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 DATABASE_URL = os.getenv("DATABASE_URL")
 
 
-engine = create_engine(DATABASE_URL)  # type: ignore
+def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    # sqlite ignores ON DELETE CASCADE unless foreign keys are switched on per connection
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+# "METHOD /route/{template}" of the request running a statement, set by InstrumentedRoute
+current_route: ContextVar[Optional[str]] = ContextVar("current_route", default=None)
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s|\$\d+|(?<![:\w]):\w+|\?")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_REPEATED_ROWS = re.compile(r"(\(\?(?:\.\.\.)?\))(?:\s*,\s*\1)+")
+_WHITESPACE = re.compile(r"\s+")
+
+# statements EXPLAIN accepts without side effects
+EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+
+
+def normalize_sql(statement: str) -> str:
+    """Literals and bind markers become ?, IN lists and multi-row VALUES collapse to one entry."""
+    sql = _STRING_LITERAL.sub("?", statement)
+    sql = _PLACEHOLDER.sub("?", sql)
+    sql = _NUMBER_LITERAL.sub("?", sql)
+    sql = _PLACEHOLDER_LIST.sub("(?...)", sql)
+    sql = _REPEATED_ROWS.sub(r"\1, ...", sql)
+    return _WHITESPACE.sub(" ", sql).strip()
+
+
+def bind_shapes(parameters: Any, executemany: bool) -> Any:
+    """Type names of the bound values, never the values themselves."""
+    if executemany:
+        rows = list(parameters or ())
+        return {"rows": len(rows), "row": bind_shapes(rows[0], False) if rows else None}
+    if isinstance(parameters, dict):
+        shapes = {key: type(value).__name__ for key, value in parameters.items()}
+    elif isinstance(parameters, (list, tuple)):
+        shapes = [type(value).__name__ for value in parameters]
+    else:
+        return None
+    if len(shapes) > 20:
+        values = shapes.values() if isinstance(shapes, dict) else shapes
+        counts: Dict[str, int] = {}
+        for name in values:
+            counts[name] = counts.get(name, 0) + 1
+        return {"count": len(shapes), "types": counts}
+    return shapes
+
+
+def _explain_prefix(dialect: str) -> Optional[str]:
+    if dialect == "postgresql":
+        return "EXPLAIN (ANALYZE off) "
+    if dialect == "sqlite":
+        return "EXPLAIN QUERY PLAN "
+    if dialect in ("mysql", "mariadb"):
+        return "EXPLAIN "
+    return None
+
+
+class SlowQueryLog:
+    """Ring buffer of statements slower than SLOW_QUERY_MS, newest last.
+
+    The EXPLAIN runs on a background thread over its own raw connection, so the
+    request that hit the slow statement is not held up and its transaction is
+    never touched. Plans are reused per normalized statement.
+    """
+
+    def __init__(self, threshold_ms: float, size: int, explain: bool):
+        self.threshold = threshold_ms / 1000
+        self.explain = explain
+        self._entries: "deque[Dict[str, Any]]" = deque(maxlen=size)
+        self._plans: Dict[str, List[str]] = {}
+        self._pending: "queue.Queue[tuple]" = queue.Queue(maxsize=100)
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("slow_query_start", []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("slow_query_start")
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        if elapsed >= self.threshold:
+            self.record(conn.engine, statement, parameters, executemany, elapsed)
+
+    def _handle_error(self, context):
+        if context.connection is not None:
+            starts = context.connection.info.get("slow_query_start")
+            if starts:
+                starts.pop()
+
+    def install(self, bound: Engine) -> None:
+        event.listen(bound, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(bound, "after_cursor_execute", self._after_cursor_execute)
+        event.listen(bound, "handle_error", self._handle_error)
+
+    def record(self, bound: Engine, statement: str, parameters: Any, executemany: bool, elapsed: float) -> None:
+        normalized = normalize_sql(statement)
+        entry = {
+            "at": time.time(),
+            "duration_ms": round(elapsed * 1000, 3),
+            "statement": normalized,
+            "bind_shapes": bind_shapes(parameters, executemany),
+            "route": current_route.get(),
+            "database": bound.url.render_as_string(hide_password=True),
+            "plan": None,
+        }
+        with self._lock:
+            entry["plan"] = self._plans.get(normalized)
+            self._entries.append(entry)
+        logger.warning("slow query %.1fms on %s: %s", elapsed * 1000, entry["route"], normalized)
+        if entry["plan"] is None and self.explain:
+            if executemany:
+                parameters = parameters[0] if parameters else None
+            self._queue_explain(bound, statement, parameters, normalized, entry)
+
+    def _queue_explain(self, bound, statement, parameters, normalized, entry) -> None:
+        if statement.lstrip().split(None, 1)[0].upper() not in EXPLAINABLE:
+            return
+        try:
+            self._pending.put_nowait((bound, statement, parameters, normalized, entry))
+        except queue.Full:
+            return
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="slow-query-explain", daemon=True)
+                self._worker.start()
+
+    def _run(self) -> None:
+        while True:
+            bound, statement, parameters, normalized, entry = self._pending.get()
+            with self._lock:
+                plan = self._plans.get(normalized)
+            if plan is None:
+                plan = self._explain(bound, statement, parameters)
+            with self._lock:
+                if len(self._plans) >= 1000:
+                    self._plans.clear()
+                self._plans[normalized] = plan
+                entry["plan"] = plan
+
+    def _explain(self, bound: Engine, statement: str, parameters: Any) -> List[str]:
+        prefix = _explain_prefix(bound.dialect.name)
+        if prefix is None:
+            return [f"EXPLAIN is not supported on {bound.dialect.name}"]
+        # a raw DBAPI connection, so neither this log nor the profiler sees the EXPLAIN itself
+        raw = bound.raw_connection()
+        try:
+            cursor = raw.cursor()
+            if parameters:
+                cursor.execute(prefix + statement, parameters)
+            else:
+                cursor.execute(prefix + statement)
+            rows = cursor.fetchall()
+            cursor.close()
+            raw.rollback()
+            return [" | ".join(str(col) for col in row) for row in rows]
+        except Exception as exc:
+            return [f"EXPLAIN failed: {type(exc).__name__}: {exc}"]
+        finally:
+            raw.close()
+
+    def entries(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [dict(entry) for entry in reversed(self._entries)]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._plans.clear()
+
+
+slow_query_log = SlowQueryLog(SLOW_QUERY_MS, SLOW_QUERY_LOG_SIZE, SLOW_QUERY_EXPLAIN)
+
+
+def _tune_sqlite(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    # readers never block the writer, and a commit is one WAL append without a full fsync
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-32000")  # KiB
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.close()
+
+
+def make_engine(url: str) -> Engine:
+    if url.startswith("sqlite"):
+        new_engine = create_engine(url)
+        event.listen(new_engine, "connect", _enable_sqlite_foreign_keys)
+        if SQLITE_WAL and ":memory:" not in url:
+            event.listen(new_engine, "connect", _tune_sqlite)
+    else:
+        new_engine = create_engine(url, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
+    if SLOW_QUERY_MS > 0:
+        slow_query_log.install(new_engine)
+    return new_engine
+
+
+engine = make_engine(DATABASE_URL)  # type: ignore
 
 SessionLocal = sessionmaker(bind=engine , autoflush=False , autocommit = False)
 
 
+class ReplicaRouter:
+    """Round-robin over replica engines, skipping any that failed in the last retry_after seconds."""
+
+    def __init__(self, engines: List[Engine], retry_after: float):
+        self.engines = engines
+        self.retry_after = retry_after
+        self._counter = itertools.count()
+        self._down_until: Dict[Engine, float] = {}
+        self._lock = threading.Lock()
+        for replica in engines:
+            event.listen(replica, "handle_error", self._on_error)
+
+    def _on_error(self, context) -> None:
+        if context.is_disconnect and context.engine is not None:
+            self.mark_down(context.engine)
+
+    def mark_down(self, replica: Engine) -> None:
+        with self._lock:
+            self._down_until[replica] = time.monotonic() + self.retry_after
+
+    def candidates(self) -> List[Engine]:
+        if not self.engines:
+            return []
+        start = next(self._counter) % len(self.engines)
+        ordered = self.engines[start:] + self.engines[:start]
+        now = time.monotonic()
+        with self._lock:
+            return [e for e in ordered if self._down_until.get(e, 0) <= now]
+
+
+replica_router = ReplicaRouter(
+    [make_engine(url) for url in REPLICA_DATABASE_URLS], REPLICA_RETRY_SECONDS
+)
+
+ReadSessionLocal = sessionmaker(autoflush=False, autocommit=False)
+
+
+@event.listens_for(ReadSessionLocal, "before_flush")
+def _reject_replica_writes(session, flush_context, instances):
+    raise RuntimeError("read-only session, use get_db for writes")
+
+
 Base = declarative_base()
 
 
@@ -23,4 +296,94 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+def _connect_read_replica():
+    for replica in replica_router.candidates():
+        try:
+            return replica.connect()
+        except DBAPIError:
+            replica_router.mark_down(replica)
+    return None
+
+
+# read-only routes, served by a healthy replica and by the primary when none is up.
+# anything that writes or must see its own writes keeps using get_db
+def get_read_db():
+    connection = _connect_read_replica()
+    if connection is None:
+        yield from get_db()
+        return
+    db = ReadSessionLocal(bind=connection)
+    try:
+        yield db
+    finally:
+        db.close()
+        connection.close()
+
+
+def insert_ignore(table: Table, bind):
+    """INSERT that skips rows hitting the primary key instead of failing the statement."""
+    dialect = bind.dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+        return pg_insert(table).on_conflict_do_nothing()
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+        return sqlite_insert(table).on_conflict_do_nothing()
+    return insert(table).prefix_with("IGNORE")
+
+
+def delete_where(db, model, *criteria) -> int:
+    """Delete matching rows in one statement, dependents go through ON DELETE CASCADE.
+
+    Models with a deleted_at column are stamped instead when SOFT_DELETE is on.
+    """
+    query = db.query(model).filter(*criteria)
+    if SOFT_DELETE and hasattr(model, "deleted_at"):
+        return query.filter(model.deleted_at.is_(None)).update(
+            {model.deleted_at: func.now()}, synchronize_session=False
+        )
+    return query.delete(synchronize_session=False)
+
+
+def init_schema():
+    if DB_AUTO_CREATE:
+        Base.metadata.create_all(bind=engine)
+        return
+    # one catalog query instead of create_all's per table round trips
+    missing = set(Base.metadata.tables) - set(inspect(engine).get_table_names())
+    if missing:
+        raise RuntimeError(f"database is missing tables: {', '.join(sorted(missing))}")
+
+
+def warm_pool(size: int = DB_POOL_SIZE):
+    # check out size connections at once so the pool is full before traffic arrives
+    connections = []
+    try:
+        for _ in range(size):
+            connection = engine.connect()
+            connection.execute(text("SELECT 1"))
+            connections.append(connection)
+    finally:
+        for connection in connections:
+            connection.close()
+
+    for replica in replica_router.engines:
+        try:
+            with replica.connect() as connection:
+                connection.execute(text("SELECT 1"))
+        except DBAPIError:
+            replica_router.mark_down(replica)
+
+
+def ping_db() -> bool:
+    try:
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+        return True
+    except Exception:
+        return False
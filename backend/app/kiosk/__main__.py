@@ -0,0 +1,51 @@
+"""Prepare and inspect a check-in kiosk, run from backend/ with the kiosk's .env:
+
+    python -m app.kiosk pull --event 12      # while online, before the event
+    python -m app.kiosk push                 # send recorded attendance now
+    python -m app.kiosk status
+"""
+import argparse
+import json
+import logging
+import sys
+
+from app.core.face_index import face_matcher
+from app.core.versions import build_lock
+from app.db import SessionLocal, engine, init_schema
+from app.kiosk.client import CentralRejected, CentralUnavailable
+from app.kiosk.sync import init_kiosk_schema, kiosk_sync, pull_snapshot
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    pull = commands.add_parser("pull", help="copy events, roster and face embeddings from the central API")
+    pull.add_argument("--event", type=int, action="append", required=True, help="repeat for several events")
+    commands.add_parser("push", help="upload attendance not yet synced")
+    commands.add_parser("status", help="pending and rejected rows, pulled snapshots")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    init_schema()
+    init_kiosk_schema(engine)
+    try:
+        if args.command == "pull":
+            for event_id in args.event:
+                counts = pull_snapshot(kiosk_sync.client, SessionLocal, event_id)
+                print(f"event {event_id}: {counts['users']} users, {counts['embeddings']} face embeddings")
+            # the kiosk matches against its own index, built from the embeddings just pulled
+            face_matcher.session_factory = SessionLocal
+            with build_lock(face_matcher.index_dir, wait=True):
+                face_matcher.rebuild()
+            print(f"face index rebuilt with {face_matcher.size} embeddings")
+        elif args.command == "push":
+            print(f"sent {kiosk_sync.push()} rows")
+        else:
+            print(json.dumps(kiosk_sync.status(), indent=2, default=str))
+    except (CentralUnavailable, CentralRejected) as e:
+        print(f"central API: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
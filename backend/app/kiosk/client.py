@@ -0,0 +1,109 @@
+import json
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from typing import Any, Optional
+
+from app.core.config import (
+    KIOSK_CENTRAL_URL,
+    KIOSK_HTTP_TIMEOUT_SECONDS,
+    KIOSK_PASSWORD,
+    KIOSK_USERNAME,
+)
+
+
+class CentralUnavailable(Exception):
+    """No answer from the central API, or one worth retrying later (5xx, 429)."""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CentralRejected(Exception):
+    """The central API refused the request for good, e.g. 403 or 404."""
+
+    def __init__(self, status_code: int, detail: Any):
+        super().__init__(f"{status_code}: {detail}")
+        self.status_code = status_code
+        self.detail = detail
+
+
+class CentralClient:
+    """JSON over urllib to the central API, signed in as the kiosk's club manager."""
+
+    def __init__(
+        self,
+        base_url: str = KIOSK_CENTRAL_URL,
+        username: str = KIOSK_USERNAME,
+        password: str = KIOSK_PASSWORD,
+        timeout: float = KIOSK_HTTP_TIMEOUT_SECONDS,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self._token: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def _open(self, request: urllib.request.Request) -> Any:
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                body = response.read()
+                return json.loads(body) if body else None
+        except urllib.error.HTTPError as e:
+            try:
+                detail = json.loads(e.read() or b"null")
+                detail = detail.get("detail", detail) if isinstance(detail, dict) else detail
+            except ValueError:
+                detail = e.reason
+            if e.code >= 500 or e.code == 429:
+                retry_after = e.headers.get("Retry-After")
+                raise CentralUnavailable(
+                    f"{e.code}: {detail}",
+                    float(retry_after) if retry_after and retry_after.isdigit() else None,
+                )
+            raise CentralRejected(e.code, detail)
+        except (urllib.error.URLError, OSError) as e:
+            raise CentralUnavailable(str(getattr(e, "reason", e)))
+
+    def login(self) -> str:
+        if not self.base_url:
+            raise CentralUnavailable("KIOSK_CENTRAL_URL is not set")
+        data = urllib.parse.urlencode({"username": self.username, "password": self.password}).encode()
+        request = urllib.request.Request(
+            f"{self.base_url}/auth/token",
+            data=data,
+            headers={"Content-Type": "application/x-www-form-urlencoded"},
+        )
+        token = self._open(request)["access_token"]
+        with self._lock:
+            self._token = token
+        return token
+
+    def request(self, method: str, path: str, body: Any = None) -> Any:
+        with self._lock:
+            token = self._token
+        for attempt in range(2):
+            if token is None:
+                token = self.login()
+            request = urllib.request.Request(
+                f"{self.base_url}{path}",
+                data=json.dumps(body, default=str).encode() if body is not None else None,
+                method=method,
+                headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
+            )
+            try:
+                return self._open(request)
+            except CentralRejected as e:
+                # expired token, sign in once more
+                if e.status_code != 401 or attempt:
+                    raise
+                token = None
+
+    def get(self, path: str) -> Any:
+        return self.request("GET", path)
+
+    def post(self, path: str, body: Any) -> Any:
+        return self.request("POST", path, body)
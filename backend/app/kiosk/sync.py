@@ -0,0 +1,326 @@
+import base64
+import logging
+import threading
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import Column, Integer, MetaData, String, Table, Text, TIMESTAMP, and_, delete, select
+from sqlalchemy.orm import Session
+
+from app.core.config import KIOSK_ID, KIOSK_SYNC_BATCH, KIOSK_SYNC_SECONDS
+from app.core.security import get_password_hash
+from app.db import SessionLocal, insert_ignore
+from app.kiosk.client import CentralClient, CentralRejected, CentralUnavailable
+from app.model.model import (
+    Club as ClubModel,
+    Event as EventModel,
+    FaceEmbedding,
+    User as UserModel,
+    club_memberships,
+    event_attendance,
+)
+from app.schema.enums import EventStatusType, UserRoleType
+
+logger = logging.getLogger(__name__)
+
+# kiosk only bookkeeping, kept out of Base.metadata so the central schema check never asks for it
+kiosk_metadata = MetaData()
+
+# attendance rows already handed to the central API, the rest of event_attendance is the outbox
+kiosk_synced = Table(
+    "kiosk_synced",
+    kiosk_metadata,
+    Column("event_id", Integer, primary_key=True),
+    Column("user_id", Integer, primary_key=True),
+    # synced, or rejected when the central API refused it for good
+    Column("status", String(16), nullable=False),
+    Column("detail", Text, nullable=True),
+    Column("synced_at", TIMESTAMP, nullable=False),
+)
+
+kiosk_snapshots = Table(
+    "kiosk_snapshots",
+    kiosk_metadata,
+    Column("event_id", Integer, primary_key=True),
+    Column("club_id", Integer, nullable=False),
+    Column("generated_at", String(32), nullable=False),
+    Column("users", Integer, nullable=False),
+    Column("embeddings", Integer, nullable=False),
+    Column("pulled_at", TIMESTAMP, nullable=False),
+)
+
+
+def init_kiosk_schema(bind) -> None:
+    kiosk_metadata.create_all(bind=bind)
+
+
+def _parse_time(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+
+def apply_snapshot(db: Session, snapshot: Dict[str, Any], operator: str, operator_password: str) -> Dict[str, int]:
+    """Mirror a central kiosk snapshot into the local database, ids stay the central ones.
+
+    Only the operator can sign in on the kiosk, with the password it pulled
+    the snapshot with. Everyone else gets a random password hash.
+    """
+    club = snapshot["club"]
+    event = snapshot["event"]
+    # one hash shared by every roster account, bcrypt per user would take minutes
+    locked_hash = get_password_hash(uuid.uuid4().hex)
+    operator_hash = get_password_hash(operator_password)
+
+    for user in snapshot["users"]:
+        existing = db.get(UserModel, user["id"])
+        row = existing or UserModel(id=user["id"])
+        row.student_id = user["student_id"]
+        row.name = user["name"]
+        row.email = user["email"]
+        row.role = UserRoleType(user["role"]) if user["role"] else None
+        row.wants_email_notif = user["wants_email_notif"]
+        # the operator signs in with an email or a student id, like on the central API
+        if operator in (user["email"], str(user["student_id"])):
+            row.hashed_password = operator_hash
+        elif existing is None:
+            row.hashed_password = locked_hash
+        db.add(row)
+    db.flush()
+
+    local_club = db.get(ClubModel, club["id"]) or ClubModel(id=club["id"])
+    for key in ("name", "description", "color_code", "is_active", "manager_id"):
+        setattr(local_club, key, club[key])
+    db.add(local_club)
+
+    local_event = db.get(EventModel, event["id"]) or EventModel(id=event["id"])
+    for key in ("name", "description", "location", "image_url", "club_id"):
+        setattr(local_event, key, event.get(key))
+    local_event.status = EventStatusType(event["status"]) if event.get("status") else None
+    local_event.start_time = _parse_time(event.get("start_time"))
+    local_event.end_time = _parse_time(event.get("end_time"))
+    db.add(local_event)
+    db.flush()
+
+    db.execute(delete(club_memberships).where(club_memberships.c.club_id == club["id"]))
+    if snapshot["members"]:
+        db.execute(
+            club_memberships.insert(),
+            [{"club_id": club["id"], "user_id": user_id} for user_id in snapshot["members"]],
+        )
+
+    now = datetime.utcnow()
+    for face in snapshot["embeddings"]:
+        row = db.get(FaceEmbedding, face["user_id"]) or FaceEmbedding(user_id=face["user_id"])
+        row.embedding = base64.b64decode(face["embedding"])
+        row.model_name = face["model_name"]
+        # newer than the local index watermark, so the next start picks it up
+        row.updated_at = now
+        db.add(row)
+
+    db.execute(delete(kiosk_snapshots).where(kiosk_snapshots.c.event_id == event["id"]))
+    db.execute(
+        kiosk_snapshots.insert().values(
+            event_id=event["id"],
+            club_id=club["id"],
+            generated_at=snapshot["generated_at"],
+            users=len(snapshot["users"]),
+            embeddings=len(snapshot["embeddings"]),
+            pulled_at=now,
+        )
+    )
+    db.commit()
+    return {"users": len(snapshot["users"]), "embeddings": len(snapshot["embeddings"])}
+
+
+def pull_snapshot(client: CentralClient, session_factory: Callable[[], Session], event_id: int) -> Dict[str, int]:
+    snapshot = client.get(f"/events/{event_id}/kiosk-snapshot")
+    db = session_factory()
+    try:
+        init_kiosk_schema(db.get_bind())
+        return apply_snapshot(db, snapshot, client.username, client.password)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def batch_id(event_id: int, user_ids: List[int]) -> str:
+    """Same records, same id, so a batch resent after a lost response is recognizable."""
+    key = f"{KIOSK_ID}:{event_id}:{','.join(map(str, sorted(user_ids)))}"
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, key))
+
+
+class KioskSync:
+    """Pushes locally recorded attendance to the central API from a background thread.
+
+    Every event_attendance row without a kiosk_synced row is still to be sent.
+    Rows go up per event in batches of batch_size. Once the central API
+    answers, they are marked synced, so a failed or unanswered upload is
+    simply sent again. The central endpoint ignores rows it already has.
+    While the central API is unreachable the interval backs off up to 16x,
+    honoring Retry-After.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        client: CentralClient,
+        interval: float = KIOSK_SYNC_SECONDS,
+        batch_size: int = KIOSK_SYNC_BATCH,
+    ):
+        self.session_factory = session_factory
+        self.client = client
+        self.interval = interval
+        self.batch_size = batch_size
+        self.last_error: Optional[str] = None
+        self.last_synced_at: Optional[datetime] = None
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        db = self.session_factory()
+        try:
+            init_kiosk_schema(db.get_bind())
+        finally:
+            db.close()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="kiosk-sync", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._wakeup.set()
+        self._thread.join()
+        self._thread = None
+
+    def poke(self) -> None:
+        self._wakeup.set()
+
+    def _run(self) -> None:
+        delay = self.interval
+        while not self._stop_event.is_set():
+            self._wakeup.wait(delay)
+            self._wakeup.clear()
+            try:
+                self.push()
+                delay = self.interval
+            except CentralUnavailable as e:
+                self.last_error = str(e)
+                delay = e.retry_after or min(delay * 2, self.interval * 16)
+                logger.info("central API unavailable, next sync in %.0fs: %s", delay, e)
+            except Exception as e:
+                self.last_error = repr(e)
+                delay = min(delay * 2, self.interval * 16)
+                logger.exception("kiosk sync failed")
+
+    def pending(self, db: Session, limit: Optional[int] = None):
+        query = (
+            select(event_attendance.c.event_id, event_attendance.c.user_id, event_attendance.c.recorded_at)
+            .select_from(
+                event_attendance.outerjoin(
+                    kiosk_synced,
+                    and_(
+                        kiosk_synced.c.event_id == event_attendance.c.event_id,
+                        kiosk_synced.c.user_id == event_attendance.c.user_id,
+                    ),
+                )
+            )
+            .where(kiosk_synced.c.event_id.is_(None))
+            .order_by(event_attendance.c.event_id, event_attendance.c.recorded_at)
+        )
+        if limit is not None:
+            query = query.limit(limit)
+        return db.execute(query).all()
+
+    def push(self) -> int:
+        """Send everything pending, returns the number of rows the central API took."""
+        sent = 0
+        while not self._stop_event.is_set():
+            db = self.session_factory()
+            try:
+                rows = self.pending(db, self.batch_size)
+                if not rows:
+                    self.last_error = None
+                    self.last_synced_at = datetime.utcnow()
+                    return sent
+                by_event: Dict[int, List] = defaultdict(list)
+                for row in rows:
+                    by_event[row.event_id].append(row)
+                for event_id, records in by_event.items():
+                    sent += self._push_event(db, event_id, records)
+            finally:
+                db.close()
+        return sent
+
+    def _push_event(self, db: Session, event_id: int, records: List) -> int:
+        user_ids = [r.user_id for r in records]
+        body = {
+            "batch_id": batch_id(event_id, user_ids),
+            "kiosk_id": KIOSK_ID,
+            "records": [{"user_id": r.user_id, "recorded_at": r.recorded_at} for r in records],
+        }
+        try:
+            result = self.client.post(f"/events/{event_id}/attendance/batch", body)
+            status, detail = "synced", None
+            unknown = set(result["unknown_users"])
+            if unknown:
+                logger.warning("central API does not know users %s of event %s", sorted(unknown), event_id)
+            accepted = result["inserted"] + result["duplicates"]
+        except CentralRejected as e:
+            # e.g. the event was deleted centrally, kept locally but no longer retried
+            logger.error("central API rejected %d rows of event %s: %s", len(records), event_id, e)
+            status, detail, unknown, accepted = "rejected", str(e.detail), set(), 0
+        now = datetime.utcnow()
+        db.execute(
+            insert_ignore(kiosk_synced, db.get_bind()).values(
+                [
+                    {
+                        "event_id": event_id,
+                        "user_id": user_id,
+                        "status": "rejected" if user_id in unknown else status,
+                        "detail": "unknown user" if user_id in unknown else detail,
+                        "synced_at": now,
+                    }
+                    for user_id in user_ids
+                ]
+            )
+        )
+        db.commit()
+        return accepted
+
+    def status(self) -> Dict[str, Any]:
+        db = self.session_factory()
+        try:
+            pending = len(self.pending(db))
+            rejected = db.execute(
+                select(kiosk_synced.c.event_id, kiosk_synced.c.user_id, kiosk_synced.c.detail).where(
+                    kiosk_synced.c.status == "rejected"
+                )
+            ).all()
+            snapshots = db.execute(select(kiosk_snapshots)).mappings().all()
+        finally:
+            db.close()
+        return {
+            "kiosk_id": KIOSK_ID,
+            "central_url": self.client.base_url,
+            "running": self.running,
+            "pending": pending,
+            "rejected": [dict(r._mapping) for r in rejected],
+            "last_synced_at": self.last_synced_at.isoformat() if self.last_synced_at else None,
+            "last_error": self.last_error,
+            "snapshots": [dict(s) for s in snapshots],
+        }
+
+
+kiosk_sync = KioskSync(SessionLocal, CentralClient())
@@ -1,18 +1,74 @@
-from fastapi import FastAPI, Request
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
 
-from .db import Base, engine
-from app.api.routers import auth, user, club, event 
+from .db import SessionLocal, engine, init_schema, warm_pool, ping_db, replica_router
+from app.api.deps import get_current_user
+from app.api.routers import auth, user, club, event, admin, media, kiosk
+from app.core import profiling, pubsub, tracing
+from app.core.attendance import attendance_buffer
+from app.core.attendance_archive import ensure_partitions
+from app.core.face_index import face_matcher
+from app.core.images import thumbnailer
+from app.core.notifications import notification_worker
+from app.core.recommendations import club_recommender
+from app.kiosk.sync import kiosk_sync
+from app.core.config import (
+    ATTENDANCE_WRITE_BEHIND,
+    KIOSK_MODE,
+    NOTIFY_ENABLED,
+    PROFILE_INTERVAL_MS,
+    RECOMMEND_ENABLED,
+)
+from app.model.enums import UserRoleType
+
+
+def warm_up():
+    init_schema()
+    ensure_partitions(engine)
+    warm_pool()
+    face_matcher.load(SessionLocal)
 
 
+# nothing touches the database at import time, workers only report ready once warm
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.ready = False
+    await run_in_threadpool(warm_up)
+    pubsub.start_listener(engine)
+    tracing.processor.start()
+    if ATTENDANCE_WRITE_BEHIND:
+        await run_in_threadpool(attendance_buffer.start)
+    if NOTIFY_ENABLED:
+        notification_worker.start()
+    if KIOSK_MODE:
+        await run_in_threadpool(kiosk_sync.start)
+    elif RECOMMEND_ENABLED:
+        # serves nothing until the first model is loaded or built
+        club_recommender.start(SessionLocal)
+    app.state.ready = True
+    yield
+    app.state.ready = False
+    # final flush, whatever still fails is spooled to disk for the next start
+    await run_in_threadpool(attendance_buffer.stop)
+    # a job cut short keeps its cursor and is resumed by the next worker
+    await run_in_threadpool(notification_worker.stop)
+    await run_in_threadpool(kiosk_sync.stop)
+    await run_in_threadpool(club_recommender.stop)
+    pubsub.stop_listener()
+    tracing.processor.stop()
+    await run_in_threadpool(thumbnailer.shutdown)
 
-Base.metadata.create_all(bind=engine)
 
 app = FastAPI(
     title="SAO club manager",  
-    description="app for managing clubs"
+    description="app for managing clubs",
+    lifespan=lifespan,
 )
 
 
@@ -23,13 +79,94 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+BINARY_CONTENT_TYPES = ("application/octet-stream", "multipart/form-data", "image/")
+
+
 @app.middleware("http")
 async def log_request_body(request: Request, call_next):
     body = await request.body()
-    print("Raw request body:", body.decode())
+    if request.headers.get("content-type", "").startswith(BINARY_CONTENT_TYPES):
+        print(f"Raw request body: <{len(body)} bytes>")
+    else:
+        print("Raw request body:", body.decode(errors="replace"))
     response = await call_next(request)
     return response
 
+for bound in [engine, *replica_router.engines]:
+    profiling.install(bound)
+    tracing.install(bound)
+
+
+def _is_sao_admin(authorization: str) -> bool:
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return False
+    db = SessionLocal()
+    try:
+        return get_current_user(db=db, token=token).role == UserRoleType.SAO_ADMIN
+    except HTTPException:
+        return False
+    finally:
+        db.close()
+
+
+# SAO admins add X-Profile: 1 or ?_profile=1 to any request to get a sampled profile,
+# download it from the X-Profile-Url header, everyone else is served as usual
+@app.middleware("http")
+async def profile_request(request: Request, call_next):
+    wants_profile = (
+        request.headers.get("x-profile") == "1"
+        or request.query_params.get("_profile") == "1"
+    )
+    if not wants_profile or not await run_in_threadpool(
+        _is_sao_admin, request.headers.get("authorization", "")
+    ):
+        return await call_next(request)
+
+    profile = profiling.Profile(request.method, request.url.path)
+    reset_token = profiling.current_profile.set(profile)
+    start = time.perf_counter()
+    try:
+        with profiling.Sampler(profile, PROFILE_INTERVAL_MS / 1000):
+            response = await call_next(request)
+    finally:
+        profiling.current_profile.reset(reset_token)
+    await run_in_threadpool(
+        profiling.save, profile, response.status_code, time.perf_counter() - start
+    )
+    response.headers["X-Profile-Id"] = profile.id
+    response.headers["X-Profile-Url"] = f"/api/v1/admin/profiles/{profile.id}"
+    return response
+
+
+# outermost, so the admin check of profile_request and the body logging are inside the trace.
+# InstrumentedRoute renames the span to the route template once it is matched
+@app.middleware("http")
+async def trace_request(request: Request, call_next):
+    request_span = tracing.start_request_span(
+        f"{request.method} {request.url.path}", request.headers.get("traceparent")
+    )
+    if request_span is None:
+        return await call_next(request)
+    request_span.attributes["http.method"] = request.method
+    request_span.attributes["url.path"] = request.url.path
+    token = tracing.current_span.set(request_span)
+    try:
+        response = await call_next(request)
+    except BaseException as exc:
+        request_span.set_error(exc)
+        request_span.end()
+        raise
+    finally:
+        tracing.current_span.reset(token)
+    request_span.attributes["http.status_code"] = response.status_code
+    if response.status_code >= 500:
+        request_span.status = tracing.STATUS_ERROR
+    request_span.end()
+    response.headers["X-Trace-Id"] = request_span.trace_id
+    return response
+
+
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
     print("Validation error:", exc.errors())
@@ -44,6 +181,27 @@ app.include_router(auth.router, prefix="/api/v1/auth", tags=["Authentication"])
 app.include_router(user.router, prefix="/api/v1/users", tags=["Users"])
 app.include_router(club.router, prefix="/api/v1/clubs", tags=["Clubs"])
 app.include_router(event.router, prefix="/api/v1/events", tags=["Events"])
+app.include_router(admin.router, prefix="/api/v1/admin", tags=["Admin"])
+app.include_router(media.router, prefix="/api/v1/media", tags=["Media"])
+if KIOSK_MODE:
+    app.include_router(kiosk.router, prefix="/api/v1/kiosk", tags=["Kiosk"])
+
+
+# liveness, the process is up and serving
+@app.get("/healthz", include_in_schema=False)
+def liveness():
+    return {"status": "ok"}
+
+
+# readiness, startup finished and the database answers
+@app.get("/readyz", include_in_schema=False)
+def readiness():
+    if not getattr(app.state, "ready", False) or not ping_db():
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"status": "starting"},
+        )
+    return {"status": "ready"}
 
 
 @app.get("/")
@@ -1,6 +1,17 @@
-from sqlalchemy import Column, Integer, String, Text, TIMESTAMP, func, ForeignKey, Table,Boolean, Enum
-from sqlalchemy.orm import relationship
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import Column, Integer, String, Text, TIMESTAMP, func, ForeignKey, Table,Boolean, Enum, Index, LargeBinary
+from sqlalchemy import DDL, UniqueConstraint, event, select
+from sqlalchemy.orm import Session, relationship, with_loader_criteria
 from app.db import Base
+from app.core.config import (
+    ATTENDANCE_PARTITIONED,
+    EVENT_DEFAULT_DURATION_MINUTES,
+    EVENT_ROOM_EXCLUSION,
+    SOFT_DELETE,
+)
+from app.core.terms import term_of
 
 from .enums import UserRoleType, EventStatusType
 
@@ -9,40 +20,93 @@ from .enums import UserRoleType, EventStatusType
 club_memberships = Table(
     "club_memberships",
     Base.metadata,
-    Column("club_id" ,Integer,ForeignKey("clubs.id"), primary_key= True)  ,
-    Column("user_id",Integer,ForeignKey("users.id"), primary_key= True) ,
+    Column("club_id" ,Integer,ForeignKey("clubs.id", ondelete="CASCADE"), primary_key= True)  ,
+    Column("user_id",Integer,ForeignKey("users.id", ondelete="CASCADE"), primary_key= True) ,
     
     Column("joined_at" , TIMESTAMP, server_default=func.now())
 
 )
 
 
+def attendance_term(start_time: Optional[datetime], created_at: Optional[datetime] = None) -> int:
+    """Term of every attendance row of an event: its start, or its creation when it has no start."""
+    moment = start_time if start_time is not None else created_at
+    return term_of(moment if moment is not None else datetime.now())
+
+
+def event_terms(connection, event_ids: Iterable[int]) -> Dict[int, int]:
+    """attendance_term of each existing event, soft deleted ones included."""
+    rows = connection.execute(
+        select(Event.id, Event.start_time, Event.created_at).where(Event.id.in_(list(event_ids)))
+    )
+    return {row.id: attendance_term(row.start_time, row.created_at) for row in rows}
+
+
+def _attendance_term(context) -> int:
+    # the event's term rather than recorded_at's, so (event_id, user_id) stays unique across partitions
+    event_id = context.get_current_parameters().get("event_id")
+    return event_terms(context.connection, [event_id]).get(event_id, term_of(datetime.now()))
+
+
 event_attendance = Table(
     "event_attendance",
     Base.metadata,
-    Column("event_id" ,Integer,ForeignKey("events.id"), primary_key= True)  ,
-    Column("user_id",Integer,ForeignKey("users.id"), primary_key= True) ,
-    Column("recorded_at" , TIMESTAMP, server_default=func.now())
+    Column("event_id" ,Integer,ForeignKey("events.id", ondelete="CASCADE"), primary_key= True)  ,
+    Column("user_id",Integer,ForeignKey("users.id", ondelete="CASCADE"), primary_key= True) ,
+    Column("recorded_at" , TIMESTAMP, server_default=func.now()),
+    # partition key on postgres, part of the key since a partitioned table's key must include it
+    Column("term", Integer, primary_key=True, default=_attendance_term),
+    **({"postgresql_partition_by": "LIST (term)"} if ATTENDANCE_PARTITIONED else {}),
 )
 
+# terms get their own partitions (app.core.attendance_archive), anything else lands here
+event.listen(
+    event_attendance,
+    "after_create",
+    DDL("CREATE TABLE event_attendance_default PARTITION OF event_attendance DEFAULT").execute_if(
+        dialect="postgresql", callable_=lambda *args, **kw: ATTENDANCE_PARTITIONED
+    ),
+)
+
+
 
+class SoftDeleteMixin:
+    """With SOFT_DELETE on, deleting stamps deleted_at and the row is hidden from every ORM select."""
 
-class Club(Base):
+    # only mapped when enabled so existing databases keep working without the column
+    if SOFT_DELETE:
+        deleted_at = Column(TIMESTAMP(timezone=True), nullable=True, index=True)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _hide_soft_deleted(state):
+    if SOFT_DELETE and state.is_select and not state.execution_options.get("include_deleted", False):
+        state.statement = state.statement.options(
+            with_loader_criteria(
+                SoftDeleteMixin, lambda cls: cls.deleted_at.is_(None), include_aliases=True
+            )
+        )
+
+
+class Club(SoftDeleteMixin, Base):
     __tablename__ = "clubs"
 
     id = Column(Integer , primary_key= True , index = True)
     name = Column(String(255), nullable= False, index = True)
     description = Column(Text , nullable=True)
     image_url = Column(String(512), nullable=True)
+    # sha256 of an uploaded image under MEDIA_DIR, None while image_url points elsewhere
+    image_key = Column(String(64), nullable=True)
     color_code = Column(String(7), nullable=True)
     is_active = Column(Boolean , default=True)
 
-    manager_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    manager_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
     manager = relationship("User", foreign_keys=[manager_id])
 
-    events = relationship("Event" , back_populates="club")
+    # child rows are removed by ON DELETE CASCADE, passive_deletes keeps the ORM from loading them
+    events = relationship("Event" , back_populates="club", passive_deletes=True)
 
-    members= relationship("User", secondary=club_memberships , back_populates="clubs" )
+    members= relationship("User", secondary=club_memberships , back_populates="clubs", passive_deletes=True)
 
     created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
     updated_at = Column(TIMESTAMP(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -59,16 +123,16 @@ class User(Base):
     role = Column(Enum(UserRoleType), default=UserRoleType.STUDENT)
     wants_email_notif =Column(Boolean , default= True)
 
-    clubs = relationship("Club" , secondary=club_memberships , back_populates="members")
+    clubs = relationship("Club" , secondary=club_memberships , back_populates="members", passive_deletes=True)
 
-    events = relationship("Event", secondary=event_attendance, back_populates="attendees")
+    events = relationship("Event", secondary=event_attendance, back_populates="attendees", passive_deletes=True)
 
 
     created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
     updated_at = Column(TIMESTAMP(timezone=True), server_default=func.now(), onupdate=func.now())
 
 
-class Event(Base):
+class Event(SoftDeleteMixin, Base):
     __tablename__ = "events"
 
     id = Column(Integer , primary_key= True , index = True)
@@ -77,17 +141,113 @@ class Event(Base):
     location = Column(Text , nullable=False)
     status = Column(Enum(EventStatusType))
     image_url = Column(String(512), nullable=True)
-    start_time = Column(TIMESTAMP(timezone=False), nullable=True)
+    image_key = Column(String(64), nullable=True)
+    start_time = Column(TIMESTAMP(timezone=False), nullable=True, index=True)
     end_time = Column(TIMESTAMP(timezone=False), nullable=True)
 
 
     club = relationship("Club", back_populates="events")
-    club_id =Column(Integer, ForeignKey("clubs.id"), nullable=False)
+    club_id =Column(Integer, ForeignKey("clubs.id", ondelete="CASCADE"), nullable=False)
+
+    attendees = relationship("User", secondary=event_attendance, back_populates="events", passive_deletes=True)
+
+    created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
+    updated_at = Column(TIMESTAMP(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    # club-scoped calendar/range queries walk this instead of filtering club_id rows
+    __table_args__ = (Index("ix_events_club_id_start_time", "club_id", "start_time"),)
+
+
+# app.core.conflicts looks up the bookings of one room that end after a given moment
+Index(
+    "ix_events_room_end_time",
+    func.lower(func.trim(Event.location)),
+    func.coalesce(Event.end_time, Event.start_time),
+)
+
+# same rule as app.core.conflicts, enforced by postgres so concurrent writes cannot both win
+ROOM_EXCLUSION_CONSTRAINT = "events_room_no_overlap"
+event.listen(
+    Event.__table__,
+    "after_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS btree_gist").execute_if(
+        dialect="postgresql", callable_=lambda *args, **kw: EVENT_ROOM_EXCLUSION
+    ),
+)
+event.listen(
+    Event.__table__,
+    "after_create",
+    DDL(
+        f"ALTER TABLE events ADD CONSTRAINT {ROOM_EXCLUSION_CONSTRAINT} EXCLUDE USING gist ("
+        " lower(trim(location)) WITH =,"
+        " tsrange(start_time, greatest(start_time, coalesce("
+        f"end_time, start_time + interval '{EVENT_DEFAULT_DURATION_MINUTES} minutes'))) WITH &&"
+        f") WHERE (start_time IS NOT NULL AND status <> 'IDEATION'{' AND deleted_at IS NULL' if SOFT_DELETE else ''})"
+    ).execute_if(dialect="postgresql", callable_=lambda *args, **kw: EVENT_ROOM_EXCLUSION),
+)
+
 
-    attendees = relationship("User", secondary=event_attendance, back_populates="events")
+
+class FaceEmbedding(Base):
+    __tablename__ = "face_embeddings"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    # float32 bytes, decoded with numpy.frombuffer by the face index
+    embedding = Column(LargeBinary, nullable=False)
+    model_name = Column(String(64), nullable=False)
+
+    created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
+    updated_at = Column(TIMESTAMP(timezone=True), server_default=func.now(), onupdate=func.now(), index=True)
+
+
+class NotificationJob(Base):
+    """One email fan-out, worked through by app.core.notifications in batches of recipients."""
+
+    __tablename__ = "notification_jobs"
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(32), nullable=False)
+    event_id = Column(Integer, ForeignKey("events.id", ondelete="CASCADE"), nullable=False)
+    # pending, running, done or failed
+    status = Column(String(16), nullable=False, default="pending")
+    # recipients are walked in user id order, this is the last id already handled
+    cursor = Column(Integer, nullable=False, default=0)
+    sent = Column(Integer, nullable=False, default=0)
+    refused = Column(Integer, nullable=False, default=0)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text, nullable=True)
+    # naive UTC, set by the worker
+    next_attempt_at = Column(TIMESTAMP, nullable=False)
+    locked_until = Column(TIMESTAMP, nullable=True)
 
     created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
     updated_at = Column(TIMESTAMP(timezone=True), server_default=func.now(), onupdate=func.now())
 
+    __table_args__ = (
+        Index("ix_notification_jobs_status_next_attempt_at", "status", "next_attempt_at"),
+        # one announcement per event, even when two approvals race
+        UniqueConstraint("kind", "event_id", name="uq_notification_jobs_kind_event_id"),
+    )
+
+
+class AttendanceArchive(Base):
+    """Attendance of a cold event, moved out of event_attendance into a columnar file."""
+
+    __tablename__ = "attendance_archives"
+
+    event_id = Column(Integer, ForeignKey("events.id", ondelete="CASCADE"), primary_key=True)
+    term = Column(Integer, nullable=False, index=True)
+    # relative to ATTENDANCE_ARCHIVE_DIR
+    path = Column(String(512), nullable=False)
+    attendee_count = Column(Integer, nullable=False)
+    archived_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
+
+
+class AttendanceArchiveUser(Base):
+    """An archive file holding attendance of a user, so their archived events read only those files."""
+
+    __tablename__ = "attendance_archive_users"
 
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    path = Column(String(512), primary_key=True)
 
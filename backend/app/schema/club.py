@@ -1,6 +1,9 @@
-from pydantic import BaseModel , Field
+from pydantic import BaseModel , ConfigDict, Field, computed_field, model_validator
+from pydantic_core import PydanticCustomError
 from datetime import datetime, date
-from typing import Optional , List
+from typing import Literal, Optional , List
+
+from app.core.images import list_thumbnail_url
 
 
 from .enums import EventStatusType,UserRoleType
@@ -28,8 +31,56 @@ class ClubUpdate(BaseModel):
 
 class ClubInDb(ClubBase):
     id:int
+    image_key: Optional[str] = None
     created_at: datetime 
     updated_at: datetime
 
+    @computed_field
+    @property
+    def thumbnail_url(self) -> Optional[str]:
+        return list_thumbnail_url(self.image_key)
+
     class Config:
-        orm_mode  = True
\ No newline at end of file
+        orm_mode  = True
+
+
+class MembershipBulkRequest(BaseModel):
+    # a misspelled key must not read as an empty list
+    model_config = ConfigDict(extra="forbid")
+
+    user_ids: List[int] = []
+    student_ids: List[int] = []
+
+
+class MembershipReplaceRequest(MembershipBulkRequest):
+    # emptying the club has to be asked for explicitly
+    allow_empty: bool = False
+
+    @model_validator(mode="after")
+    def check_not_empty(self) -> "MembershipReplaceRequest":
+        if not (self.user_ids or self.student_ids or self.allow_empty):
+            raise PydanticCustomError(
+                "empty_roster",
+                'user_ids or student_ids must not be empty, send "allow_empty": true to remove every member',
+            )
+        return self
+
+
+class MembershipOutcome(BaseModel):
+    user_id: Optional[int] = None
+    student_id: Optional[int] = None
+    status: Literal["added", "already_member", "removed", "not_member", "not_found"]
+
+
+class MembershipBulkResult(BaseModel):
+    added: int = 0
+    removed: int = 0
+    results: List[MembershipOutcome]
+
+
+class ClubRecommendation(BaseModel):
+    club_id: int
+    name: str
+    score: float
+    # similar: from the user's clubs and attendance, popular: filler for new students
+    reason: Literal["similar", "popular"]
@@ -1,7 +1,8 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, computed_field
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 
+from app.core.images import list_thumbnail_url
 from .enums import EventStatusType
 
 
@@ -33,8 +34,35 @@ class EventUpdate(BaseModel):
 
 class EventInDb(EventBase):
     id: int
+    # rows can predate the status column being filled in
+    status: Optional[EventStatusType] = None  # type: ignore[assignment]
+    image_key: Optional[str] = None
     created_at: datetime
     updated_at: datetime
 
+    @computed_field
+    @property
+    def thumbnail_url(self) -> Optional[str]:
+        return list_thumbnail_url(self.image_key)
+
     class Config:
-        orm_mode = True
\ No newline at end of file
+        orm_mode = True
+
+class EventFeedPage(BaseModel):
+    items: List[EventInDb]
+    next_cursor: Optional[str] = None
+
+
+class ConflictingEvent(BaseModel):
+    id: int
+    name: str
+    club_id: int
+    start_time: datetime
+    end_time: Optional[datetime] = None
+
+
+class RoomConflict(BaseModel):
+    location: str
+    events: List[ConflictingEvent]
+    overlap_start: datetime
+    overlap_end: datetime
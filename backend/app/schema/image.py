@@ -0,0 +1,10 @@
+from typing import Dict
+
+from pydantic import BaseModel
+
+
+class ImageUploadResult(BaseModel):
+    image_key: str
+    image_url: str
+    thumbnail_url: str
+    thumbnails: Dict[str, str]
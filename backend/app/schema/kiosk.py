@@ -0,0 +1,25 @@
+from datetime import datetime
+from typing import List
+
+from pydantic import BaseModel, Field
+
+from app.core.config import KIOSK_SYNC_BATCH
+
+
+class KioskAttendanceRecord(BaseModel):
+    user_id: int
+    recorded_at: datetime
+
+
+class KioskAttendanceBatch(BaseModel):
+    # same id when a batch is resent after a lost response
+    batch_id: str
+    kiosk_id: str
+    records: List[KioskAttendanceRecord] = Field(..., max_length=KIOSK_SYNC_BATCH)
+
+
+class KioskBatchResult(BaseModel):
+    batch_id: str
+    inserted: int
+    duplicates: int
+    unknown_users: List[int]
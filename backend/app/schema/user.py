@@ -1,6 +1,6 @@
 from pydantic import BaseModel, Field, EmailStr
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 
 from .enums import UserRoleType
 
@@ -37,3 +37,6 @@ class UserInDb(UserBase):
         orm_mode = True
 
 
+class FaceEnrollment(BaseModel):
+    embedding: List[float]  # 128-dimensional FaceNet embedding
+    modelName: str = Field(..., max_length=64)
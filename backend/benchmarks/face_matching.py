@@ -0,0 +1,231 @@
+"""Recall, latency and error rates of the face index behind /events/attendbyface.
+
+Synthetic identities mimic FaceNet style output: unit 128-d embeddings sitting
+in a cone around a shared direction (impostor similarity around 0.33), with
+noisy samples per identity (genuine similarity around 0.7). Each identity is
+enrolled as the mean of a few samples, probes are fresh samples of enrolled
+identities (genuine) and of identities that were never enrolled (impostors).
+
+Run from backend/, CPU only:
+
+    python -m benchmarks.face_matching
+    python -m benchmarks.face_matching --sizes 1000,10000 --index flat,ivfpq --nprobe 8,16,32
+    OMP_NUM_THREADS=1 python -m benchmarks.face_matching --json results.json
+
+For every size and index it reports build time, resident memory, p50/p99
+single query latency, batch throughput, top-1 recall against exact search,
+and at each threshold the false accept rate of impostors (FAR), the share
+of genuine probes rejected or matched to someone else (FRR) and the genuine
+probes matched to the wrong identity.
+"""
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from app.core.config import FACE_INDEX_PQ_M, FACE_INDEX_RERANK
+from app.core.face_index import FlatIndex, IVFPQIndex, normalize
+
+DIM = 128
+CHUNK = 50000
+
+
+class SyntheticFaces:
+    def __init__(self, dim: int, cone: float, noise: float, seed: int):
+        self.dim = dim
+        self.cone = cone
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+        self.mean_direction = normalize(self.rng.standard_normal(dim))
+
+    def identities(self, n: int) -> np.ndarray:
+        # a.mu + g with |g| ~ 1 puts the expected cosine between identities at a^2 / (1 + a^2)
+        g = self.rng.standard_normal((n, self.dim), dtype=np.float32) / np.sqrt(self.dim)
+        return normalize(self.cone * self.mean_direction + g)
+
+    def samples(self, centers: np.ndarray) -> np.ndarray:
+        g = self.rng.standard_normal(centers.shape, dtype=np.float32) / np.sqrt(self.dim)
+        return normalize(centers + self.noise * g)
+
+    def enrollments(self, centers: np.ndarray, per_identity: int) -> np.ndarray:
+        out = np.empty_like(centers)
+        for start in range(0, len(centers), CHUNK):
+            block = centers[start : start + CHUNK]
+            out[start : start + len(block)] = normalize(
+                sum(self.samples(block) for _ in range(per_identity))
+            )
+        return out
+
+
+def exact_top1(vectors: np.ndarray, queries: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    best = np.full(len(queries), -1, dtype=np.int64)
+    sims = np.full(len(queries), -np.inf, dtype=np.float32)
+    for start in range(0, len(vectors), CHUNK):
+        block = vectors[start : start + CHUNK] @ queries.T
+        i = block.argmax(0)
+        s = block[i, np.arange(len(queries))]
+        better = s > sims
+        best[better] = i[better] + start
+        sims[better] = s[better]
+    return best, sims
+
+
+def top1(index, queries: np.ndarray, **params) -> Tuple[np.ndarray, np.ndarray]:
+    ids = np.full(len(queries), -1, dtype=np.int64)
+    sims = np.full(len(queries), -np.inf, dtype=np.float32)
+    for i, (found, scores) in enumerate(index.search_batch(queries, k=1, **params)):
+        if len(found):
+            ids[i], sims[i] = found[0], scores[0]
+    return ids, sims
+
+
+def latencies_ms(index, queries: np.ndarray, **params) -> np.ndarray:
+    out = np.empty(len(queries))
+    for i, q in enumerate(queries):
+        start = time.perf_counter()
+        index.search(q, k=4, **params)
+        out[i] = (time.perf_counter() - start) * 1000
+    return out
+
+
+def error_rates(
+    genuine: Tuple[np.ndarray, np.ndarray],
+    genuine_truth: np.ndarray,
+    impostor_sims: np.ndarray,
+    thresholds: List[float],
+) -> List[Dict[str, float]]:
+    ids, sims = genuine
+    correct = ids == genuine_truth
+    rows = []
+    for t in thresholds:
+        accepted = sims >= t
+        rows.append(
+            {
+                "threshold": t,
+                "far": float((impostor_sims >= t).mean()),
+                "frr": float((~(accepted & correct)).mean()),
+                "wrong_identity": float((accepted & ~correct).mean()),
+            }
+        )
+    return rows
+
+
+def run_size(args, n: int) -> List[Dict]:
+    faces = SyntheticFaces(args.dim, args.cone, args.noise, args.seed + n)
+    centers = faces.identities(n)
+    enrolled = faces.enrollments(centers, args.enroll_samples)
+    ids = np.arange(n, dtype=np.int64)
+
+    q = min(args.queries, n)
+    probe_truth = faces.rng.choice(n, q, replace=False)
+    genuine = faces.samples(centers[probe_truth])
+    impostors = faces.samples(faces.identities(args.impostors))
+    exact_ids, _ = exact_top1(enrolled, genuine)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for kind in args.index:
+            start = time.perf_counter()
+            if kind == "flat":
+                index = FlatIndex.build(enrolled, ids)
+            else:
+                index = IVFPQIndex.build(enrolled, ids, m=args.m)
+            build_s = time.perf_counter() - start
+            disk = 0
+            if kind == "ivfpq":
+                # serve it the way the app does, float32 vectors behind mmap
+                path = os.path.join(tmp, f"{kind}-{n}")
+                os.makedirs(path)
+                index.save(path)
+                disk = sum(e.stat().st_size for e in os.scandir(path))
+                index = IVFPQIndex.load(path)
+            sweep = [{}] if kind == "flat" else [
+                {"nprobe": nprobe, "rerank": args.rerank} for nprobe in args.nprobe
+            ]
+            for params in sweep:
+                index.search(genuine[0], k=4, **params)  # page in before timing
+                lat = latencies_ms(index, genuine[: args.latency_queries], **params)
+                start = time.perf_counter()
+                found = top1(index, genuine, **params)
+                batch_s = time.perf_counter() - start
+                _, impostor_sims = top1(index, impostors, **params)
+                results.append(
+                    {
+                        "identities": n,
+                        "index": kind,
+                        "params": params,
+                        "build_s": round(build_s, 3),
+                        "memory_mb": round(index.memory_bytes() / 2**20, 2),
+                        "disk_mb": round(disk / 2**20, 2),
+                        "p50_ms": round(float(np.percentile(lat, 50)), 4),
+                        "p99_ms": round(float(np.percentile(lat, 99)), 4),
+                        "batch_qps": round(len(genuine) / batch_s, 1),
+                        "recall_at_1": float((found[0] == ids[exact_ids]).mean()),
+                        "errors": error_rates(found, ids[probe_truth], impostor_sims, args.thresholds),
+                    }
+                )
+                print_result(results[-1])
+    return results
+
+
+def print_result(r: Dict) -> None:
+    params = " ".join(f"{k}={v}" for k, v in r["params"].items()) or "exact"
+    print(
+        f"\n{r['identities']:>8} identities  {r['index']:<6} {params:<20}"
+        f" build {r['build_s']:.2f}s  memory {r['memory_mb']:.1f}MB"
+        + (f" (+{r['disk_mb']:.1f}MB mmap)" if r["disk_mb"] else "")
+    )
+    print(
+        f"         p50 {r['p50_ms']:.3f}ms  p99 {r['p99_ms']:.3f}ms"
+        f"  batch {r['batch_qps']:.0f} q/s  recall@1 {r['recall_at_1']:.4f}"
+    )
+    print("         threshold      FAR      FRR  wrong-id")
+    for e in r["errors"]:
+        print(f"         {e['threshold']:>9.2f} {e['far']:>8.4f} {e['frr']:>8.4f} {e['wrong_identity']:>9.4f}")
+
+
+def csv(cast):
+    return lambda value: [cast(v) for v in value.split(",") if v]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=csv(int), default=[1000, 10000, 100000, 500000])
+    parser.add_argument("--index", type=csv(str), default=["flat", "ivfpq"])
+    parser.add_argument("--nprobe", type=csv(int), default=[8, 16, 32])
+    parser.add_argument("--rerank", type=int, default=FACE_INDEX_RERANK)
+    parser.add_argument("--m", type=int, default=FACE_INDEX_PQ_M, help="PQ sub-quantizers")
+    parser.add_argument("--thresholds", type=csv(float), default=[0.5, 0.55, 0.6, 0.65, 0.7, 0.75, 0.8, 0.85])
+    parser.add_argument("--queries", type=int, default=5000, help="genuine probes")
+    parser.add_argument("--impostors", type=int, default=5000, help="probes of identities never enrolled")
+    parser.add_argument("--latency-queries", type=int, default=2000)
+    parser.add_argument("--enroll-samples", type=int, default=3)
+    parser.add_argument("--dim", type=int, default=DIM)
+    parser.add_argument("--cone", type=float, default=0.7, help="pull towards a shared direction")
+    parser.add_argument("--noise", type=float, default=0.8, help="per sample noise")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the results here")
+    args = parser.parse_args()
+    unknown = set(args.index) - {"flat", "ivfpq"}
+    if unknown:
+        parser.error(f"unknown index {', '.join(sorted(unknown))}")
+
+    print(
+        f"numpy {np.__version__}, python {platform.python_version()}, {os.cpu_count()} cpus,"
+        f" OMP_NUM_THREADS={os.getenv('OMP_NUM_THREADS', 'unset')}"
+    )
+    results = []
+    for n in args.sizes:
+        results.extend(run_size(args, n))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
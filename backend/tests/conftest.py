@@ -0,0 +1,57 @@
+import os
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import pytest  # noqa: E402
+from fastapi import Depends, HTTPException, status  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy.orm import Session, sessionmaker  # noqa: E402
+
+from app.api.deps import get_current_user  # noqa: E402
+from app.core.cache import cache  # noqa: E402
+from app.db import Base, get_db, get_read_db, make_engine  # noqa: E402
+from app.main import app  # noqa: E402
+from app.model.model import User as UserModel  # noqa: E402
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = make_engine(f"sqlite:///{tmp_path / 'app.db'}")
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+class ApiClient(TestClient):
+    """Requests go to the test database, authenticated as user_id without a token."""
+
+    user_id = None
+
+    def as_user(self, user_id: int) -> "ApiClient":
+        self.user_id = user_id
+        return self
+
+
+@pytest.fixture
+def api(session_factory):
+    client = ApiClient(app)
+
+    def get_test_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def get_test_user(db: Session = Depends(get_db)) -> UserModel:
+        user = db.get(UserModel, client.user_id)
+        if user is None:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not logged in")
+        return user
+
+    app.dependency_overrides[get_db] = get_test_db
+    app.dependency_overrides[get_read_db] = get_test_db
+    app.dependency_overrides[get_current_user] = get_test_user
+    yield client
+    app.dependency_overrides.clear()
+    cache.backend.clear()
@@ -0,0 +1,92 @@
+import asyncio
+
+from app.api import deps
+from app.core import admission
+from app.core.admission import ConcurrencyLimiter, Policy, RateLimiter
+
+
+def test_slot_handed_over_as_the_wait_times_out_is_kept(monkeypatch):
+    limiter = ConcurrencyLimiter(limit=1, max_queue=1, timeout=1)
+
+    async def handed_over_then_timed_out(awaitable, timeout):
+        limiter.release()  # the holder finishes and passes its slot on
+        raise asyncio.TimeoutError
+
+    async def run():
+        assert await limiter.acquire()
+        monkeypatch.setattr(admission.asyncio, "wait_for", handed_over_then_timed_out)
+        kept = await limiter.acquire()
+        monkeypatch.undo()
+        return kept
+
+    assert asyncio.run(run())
+    assert limiter.active == 1
+    limiter.release()
+    assert limiter.active == 0
+
+
+def test_cancelled_waiter_passes_its_slot_on(monkeypatch):
+    limiter = ConcurrencyLimiter(limit=1, max_queue=2, timeout=5)
+    wait_for = asyncio.wait_for
+
+    async def run():
+        queued = asyncio.Event()
+
+        async def handed_over_then_cancelled(awaitable, timeout):
+            monkeypatch.setattr(admission.asyncio, "wait_for", wait_for)
+            await queued.wait()
+            limiter.release()  # the slot goes to this waiter, whose client hangs up before it runs
+            raise asyncio.CancelledError
+
+        assert await limiter.acquire()
+        monkeypatch.setattr(admission.asyncio, "wait_for", handed_over_then_cancelled)
+        first = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        second = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        queued.set()
+        assert await second
+        return first.cancelled()
+
+    assert asyncio.run(run())
+    assert limiter.active == 1
+    limiter.release()
+    assert limiter.active == 0
+
+
+def test_waiters_beyond_the_queue_are_turned_away():
+    limiter = ConcurrencyLimiter(limit=1, max_queue=0, timeout=5)
+
+    async def run():
+        return await limiter.acquire(), await limiter.acquire()
+
+    assert asyncio.run(run()) == (True, False)
+
+
+def test_retry_after_is_the_wait_for_the_next_token():
+    policy = Policy("test", concurrency=0, queue=0, per_ip=(2, 20), per_user=(10, 10))
+
+    assert policy.check_rates("1.1.1.1", None) is None
+    assert policy.check_rates("1.1.1.1", None) is None
+    # 2 per 20 seconds, one token back every 10
+    assert policy.check_rates("1.1.1.1", None) == 10
+    assert policy.check_rates("2.2.2.2", None) is None
+
+
+def test_login_bucket_is_keyed_on_username_and_ip(api, monkeypatch):
+    policy = admission.policies["login"]
+    monkeypatch.setattr(policy, "per_ip", None)
+    monkeypatch.setattr(policy, "per_user", RateLimiter(2, 60))
+    monkeypatch.setattr(deps, "ADMISSION_TRUSTED_PROXIES", 1)
+
+    def login(username, ip):
+        return api.post(
+            "/api/v1/auth/token",
+            data={"username": username, "password": "wrong"},
+            headers={"X-Forwarded-For": ip},
+        )
+
+    assert [login("victim@example.com", "1.1.1.1").status_code for _ in range(3)] == [401, 401, 429]
+    assert login("VICTIM@example.com ", "1.1.1.1").headers["Retry-After"] == "30"
+    # the owner signing in from elsewhere is not locked out
+    assert login("victim@example.com", "2.2.2.2").status_code == 401
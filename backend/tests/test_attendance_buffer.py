@@ -0,0 +1,83 @@
+import os
+from datetime import datetime
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from sqlalchemy import select  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from app.core.attendance import AttendanceBuffer  # noqa: E402
+from app.core.terms import term_of  # noqa: E402
+from app.db import Base, make_engine  # noqa: E402
+from app.model.model import (  # noqa: E402
+    Club as ClubModel,
+    Event as EventModel,
+    User as UserModel,
+    event_attendance,
+)
+
+
+def make_buffer(tmp_path):
+    engine = make_engine(f"sqlite:///{tmp_path / 'app.db'}")
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(bind=engine)
+    with session_factory() as db:
+        db.add(UserModel(id=1, student_id=1, name="stu", email="stu@example.com", hashed_password="x"))
+        db.add(ClubModel(id=1, name="club"))
+        db.add(EventModel(id=1, name="event", location="Room A", club_id=1))
+        db.commit()
+    buffer = AttendanceBuffer(session_factory, 200, 500, str(tmp_path / "spool.jsonl"))
+    return buffer, session_factory
+
+
+def attendance_rows(session_factory):
+    with session_factory() as db:
+        return db.execute(select(event_attendance.c.event_id, event_attendance.c.user_id)).all()
+
+
+def test_flush_drops_rows_of_missing_events_and_keeps_the_rest(tmp_path):
+    buffer, session_factory = make_buffer(tmp_path)
+    buffer.add(1, 1)
+    buffer.add(99999, 1)
+
+    assert buffer.flush()
+
+    assert attendance_rows(session_factory) == [(1, 1)]
+    assert not buffer.is_pending(1, 1)
+    assert not buffer.is_pending(99999, 1)
+
+
+def test_discarded_event_is_not_written(tmp_path):
+    buffer, session_factory = make_buffer(tmp_path)
+    buffer.add(1, 1)
+    buffer.discard_event(1)
+
+    assert buffer.flush()
+    assert attendance_rows(session_factory) == []
+
+
+def test_spool_is_per_process_and_replayed(tmp_path):
+    buffer, session_factory = make_buffer(tmp_path)
+    buffer.add(1, 1)
+    buffer._write_spool()
+    assert os.path.exists(buffer.own_spool_path)
+
+    replaying = AttendanceBuffer(session_factory, 200, 500, buffer.spool_path)
+    replaying._replay_spool()
+
+    assert attendance_rows(session_factory) == [(1, 1)]
+    assert [name for name in os.listdir(tmp_path) if name.startswith("spool")] == []
+
+
+def test_term_follows_the_event_not_recorded_at(tmp_path):
+    buffer, session_factory = make_buffer(tmp_path)
+    with session_factory() as db:
+        db.get(EventModel, 1).start_time = datetime(2026, 10, 19, 12)
+        db.commit()
+    buffer.add(1, 1)
+    buffer._pending[(1, 1)] = datetime(2027, 2, 1)
+
+    assert buffer.flush()
+
+    with session_factory() as db:
+        assert db.execute(select(event_attendance.c.term)).scalar() == term_of(datetime(2026, 10, 19))
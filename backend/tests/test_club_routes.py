@@ -0,0 +1,113 @@
+import pytest
+from sqlalchemy import select
+
+from app.model.enums import UserRoleType
+from app.model.model import Club as ClubModel, User as UserModel, club_memberships
+
+ADMIN = 1
+STUDENTS = [10, 11, 12, 13]
+
+
+@pytest.fixture
+def club(session_factory):
+    with session_factory() as db:
+        db.add(
+            UserModel(
+                id=ADMIN, student_id=ADMIN, name="admin", email="admin@example.com",
+                hashed_password="x", role=UserRoleType.SAO_ADMIN,
+            )
+        )
+        for user_id in STUDENTS:
+            db.add(
+                UserModel(
+                    id=user_id, student_id=1000 + user_id, name=f"student {user_id}",
+                    email=f"student{user_id}@example.com", hashed_password="x",
+                )
+            )
+        db.add(ClubModel(id=1, name="club"))
+        db.commit()
+        db.execute(club_memberships.insert(), [{"club_id": 1, "user_id": u} for u in STUDENTS[:2]])
+        db.commit()
+    return 1
+
+
+def roster(session_factory, club_id):
+    with session_factory() as db:
+        return set(
+            db.execute(select(club_memberships.c.user_id).where(club_memberships.c.club_id == club_id)).scalars()
+        )
+
+
+@pytest.mark.parametrize("body", [{}, {"user_ids": []}, {"userids": [10]}, {"user_ids": [10], "studentids": [1011]}])
+def test_replace_rejects_empty_or_misspelled_body(api, session_factory, club, body):
+    response = api.as_user(ADMIN).put(f"/api/v1/clubs/{club}/members", json=body)
+
+    assert response.status_code == 422
+    assert roster(session_factory, club) == {10, 11}
+
+
+@pytest.mark.parametrize("path", ["members/bulk", "members/bulk-remove"])
+def test_bulk_rejects_misspelled_body(api, session_factory, club, path):
+    response = api.as_user(ADMIN).post(f"/api/v1/clubs/{club}/{path}", json={"userids": [12]})
+
+    assert response.status_code == 422
+    assert roster(session_factory, club) == {10, 11}
+
+
+def test_replace_with_allow_empty_clears_the_roster(api, session_factory, club):
+    response = api.as_user(ADMIN).put(f"/api/v1/clubs/{club}/members", json={"allow_empty": True})
+
+    assert response.status_code == 200
+    assert response.json()["removed"] == 2
+    assert roster(session_factory, club) == set()
+
+
+def test_replace_with_only_unknown_ids_leaves_the_roster(api, session_factory, club):
+    response = api.as_user(ADMIN).put(
+        f"/api/v1/clubs/{club}/members", json={"user_ids": [9999], "student_ids": [8888]}
+    )
+
+    assert response.status_code == 400
+    assert roster(session_factory, club) == {10, 11}
+
+
+def test_replace_adds_and_removes_by_user_and_student_id(api, session_factory, club):
+    response = api.as_user(ADMIN).put(
+        f"/api/v1/clubs/{club}/members", json={"user_ids": [11, 9999], "student_ids": [1012]}
+    )
+
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["added"], body["removed"]) == (1, 1)
+    statuses = {(r["user_id"], r["student_id"]): r["status"] for r in body["results"]}
+    assert statuses == {
+        (11, 1011): "already_member",
+        (12, 1012): "added",
+        (9999, None): "not_found",
+        (10, None): "removed",
+    }
+    assert roster(session_factory, club) == {11, 12}
+
+
+def test_bulk_add_is_idempotent(api, session_factory, club):
+    api.as_user(ADMIN)
+    first = api.post(f"/api/v1/clubs/{club}/members/bulk", json={"user_ids": [11, 12], "student_ids": [1013]})
+    again = api.post(f"/api/v1/clubs/{club}/members/bulk", json={"user_ids": [11, 12], "student_ids": [1013]})
+
+    assert first.json()["added"] == 2
+    assert again.status_code == 200
+    assert again.json()["added"] == 0
+    assert {r["status"] for r in again.json()["results"]} == {"already_member"}
+    assert roster(session_factory, club) == {10, 11, 12, 13}
+
+
+def test_bulk_remove_reports_non_members(api, session_factory, club):
+    response = api.as_user(ADMIN).post(
+        f"/api/v1/clubs/{club}/members/bulk-remove", json={"user_ids": [10, 12, 9999]}
+    )
+
+    assert response.json()["removed"] == 1
+    assert {r["user_id"]: r["status"] for r in response.json()["results"]} == {
+        10: "removed", 12: "not_member", 9999: "not_found"
+    }
+    assert roster(session_factory, club) == {11}
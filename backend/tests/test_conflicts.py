@@ -0,0 +1,85 @@
+import os
+from datetime import datetime, timedelta
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import numpy as np  # noqa: E402
+
+from app.core.conflicts import DEFAULT_DURATION, RoomSchedule, conflict_report, room_key  # noqa: E402
+from app.model.enums import EventStatusType  # noqa: E402
+from app.model.model import Club as ClubModel, Event as EventModel  # noqa: E402
+
+
+def brute_force(events, since, until):
+    pairs = set()
+    held = [
+        e
+        for e in events
+        if e.status != EventStatusType.IDEATION and e.start_time is not None and e.start_time < until
+    ]
+    for a in held:
+        for b in held:
+            if a.id >= b.id or room_key(a.location) != room_key(b.location):
+                continue
+            a_end = a.end_time or a.start_time + DEFAULT_DURATION
+            b_end = b.end_time or b.start_time + DEFAULT_DURATION
+            if a_end <= a.start_time or b_end <= b.start_time:
+                continue
+            # the two overlap, and not only before since
+            if max(a.start_time, b.start_time) < min(a_end, b_end) and min(a_end, b_end) > since:
+                pairs.add((a.id, b.id))
+    return pairs
+
+
+def test_pairs_match_a_pairwise_check():
+    rng = np.random.default_rng(7)
+    starts = rng.integers(0, 1000, 300)
+    ends = starts + rng.integers(-5, 60, 300)
+    schedule = RoomSchedule(np.arange(300), starts, ends)
+
+    first, second = schedule.pairs()
+
+    found = {tuple(sorted((int(schedule.ids[i]), int(schedule.ids[j])))) for i, j in zip(first, second)}
+    expected = {
+        (a, b)
+        for a in range(300)
+        for b in range(a + 1, 300)
+        if ends[a] > starts[a] and ends[b] > starts[b] and starts[a] < ends[b] and starts[b] < ends[a]
+    }
+    assert found == expected
+
+
+def test_conflict_report_matches_a_pairwise_check(session_factory):
+    rng = np.random.default_rng(3)
+    rooms = ["Room A", "room a ", "Room B", "Hall"]
+    statuses = [EventStatusType.POSTED, EventStatusType.PENDING, EventStatusType.IDEATION]
+    base = datetime(2030, 1, 1, 8)
+    with session_factory() as db:
+        db.add(ClubModel(id=1, name="club"))
+        for event_id in range(1, 201):
+            start = base + timedelta(minutes=int(rng.integers(0, 60 * 24 * 3)))
+            length = int(rng.integers(-10, 240))
+            db.add(
+                EventModel(
+                    id=event_id,
+                    name=f"event {event_id}",
+                    location=rooms[int(rng.integers(len(rooms)))],
+                    club_id=1,
+                    status=statuses[int(rng.integers(len(statuses)))],
+                    start_time=start,
+                    # a third keep the default duration
+                    end_time=start + timedelta(minutes=length) if rng.random() > 0.33 else None,
+                )
+            )
+        db.commit()
+        events = db.query(EventModel).all()
+        since, until = base + timedelta(days=1), base + timedelta(days=2)
+
+        report = conflict_report(db, since, until)
+
+    found = {tuple(sorted(e.id for e in c["events"])) for c in report}
+    assert len(found) == len(report)
+    assert found == brute_force(events, since, until)
+    for c in report:
+        a, b = c["events"]
+        assert max(a.start_time, b.start_time) == c["overlap_start"] < c["overlap_end"]
@@ -0,0 +1,295 @@
+import base64
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pytest
+
+from app.api.routers import event as event_router
+from app.core.config import CALENDAR_MAX_DAYS
+from app.core.images import list_thumbnail_url
+
+from app.model.enums import EventStatusType, UserRoleType
+from app.model.model import Club as ClubModel, Event as EventModel, User as UserModel
+
+ADMIN, OWNER, OTHER_MANAGER, STUDENT = 1, 2, 3, 4
+STATUSES = [None, *EventStatusType]
+
+
+def add_users(db):
+    for user_id, role in [
+        (ADMIN, UserRoleType.SAO_ADMIN),
+        (OWNER, UserRoleType.CLUB_MANAGER),
+        (OTHER_MANAGER, UserRoleType.CLUB_MANAGER),
+        (STUDENT, UserRoleType.STUDENT),
+    ]:
+        db.add(
+            UserModel(
+                id=user_id,
+                student_id=user_id,
+                name=f"user {user_id}",
+                email=f"user{user_id}@example.com",
+                hashed_password="x",
+                role=role,
+            )
+        )
+    db.add(ClubModel(id=1, name="club", manager_id=OWNER))
+    db.commit()
+
+
+@pytest.fixture
+def events(session_factory):
+    with session_factory() as db:
+        add_users(db)
+        for event_id, event_status in enumerate(STATUSES, start=1):
+            db.add(
+                EventModel(
+                    id=event_id,
+                    name=f"event {event_id}",
+                    location="Room A",
+                    club_id=1,
+                    status=event_status,
+                    start_time=datetime(2030, 1, event_id, 10),
+                )
+            )
+        db.commit()
+    return list(range(1, len(STATUSES) + 1))
+
+
+@pytest.mark.parametrize("user_id", [ADMIN, OWNER, OTHER_MANAGER, STUDENT])
+def test_batch_shows_what_get_by_id_shows(api, events, user_id):
+    api.as_user(user_id)
+    visible = {event_id for event_id in events if api.get(f"/api/v1/events/{event_id}").status_code == 200}
+
+    response = api.get("/api/v1/events/batch", params={"ids": ",".join(map(str, events))})
+
+    assert response.status_code == 200
+    assert {int(event_id) for event_id in response.json()} == visible
+    # the status-less event is public
+    assert 1 in visible
+
+
+@pytest.fixture
+def club(session_factory):
+    with session_factory() as db:
+        add_users(db)
+    return 1
+
+
+def create_event(api, location, start, end=None, **fields):
+    body = {
+        "name": "event",
+        "location": location,
+        "status": "POSTED",
+        "club_id": 1,
+        "start_time": start.isoformat(),
+        "end_time": end.isoformat() if end is not None else None,
+        **fields,
+    }
+    return api.as_user(OWNER).post("/api/v1/events/", json=body)
+
+
+def test_back_to_back_bookings_do_not_conflict(api, club):
+    assert create_event(api, "Room A", datetime(2030, 1, 1, 10), datetime(2030, 1, 1, 11)).status_code == 201
+
+    response = create_event(api, "Room A", datetime(2030, 1, 1, 11), datetime(2030, 1, 1, 12))
+
+    assert response.status_code == 201
+
+
+def test_overlap_conflicts_across_case_and_spaces(api, club):
+    first = create_event(api, "Room A", datetime(2030, 1, 1, 10), datetime(2030, 1, 1, 11)).json()
+
+    response = create_event(api, "  room a ", datetime(2030, 1, 1, 10, 30), datetime(2030, 1, 1, 12))
+
+    assert response.status_code == 409
+    assert str(first["id"]) in response.json()["detail"]
+    assert create_event(api, "Room B", datetime(2030, 1, 1, 10, 30)).status_code == 201
+
+
+def test_missing_end_time_holds_the_default_duration(api, club):
+    # EVENT_DEFAULT_DURATION_MINUTES is 60
+    assert create_event(api, "Room A", datetime(2030, 1, 1, 10)).status_code == 201
+
+    assert create_event(api, "Room A", datetime(2030, 1, 1, 10, 59)).status_code == 409
+    assert create_event(api, "Room A", datetime(2030, 1, 1, 11)).status_code == 201
+
+
+def test_ideation_events_hold_no_room(api, club):
+    assert create_event(api, "Room A", datetime(2030, 1, 1, 10), status="IDEATION").status_code == 201
+
+    assert create_event(api, "Room A", datetime(2030, 1, 1, 10)).status_code == 201
+
+
+def test_update_does_not_conflict_with_itself(api, club):
+    event = create_event(api, "Room A", datetime(2030, 1, 1, 10), datetime(2030, 1, 1, 11)).json()
+    other = create_event(api, "Room A", datetime(2030, 1, 1, 12), datetime(2030, 1, 1, 13)).json()
+
+    moved = api.put(
+        f"/api/v1/events/{event['id']}",
+        json={"start_time": "2030-01-01T10:30:00", "end_time": "2030-01-01T11:30:00"},
+    )
+    clash = api.put(f"/api/v1/events/{event['id']}", json={"end_time": "2030-01-01T12:30:00"})
+
+    assert moved.status_code == 200
+    assert clash.status_code == 409
+    assert str(other["id"]) in clash.json()["detail"]
+
+
+def test_start_range_matches_a_filter_over_all_events(api, events):
+    everything = api.as_user(ADMIN).get("/api/v1/events/").json()
+
+    response = api.get(
+        "/api/v1/events/",
+        params={"starts_after": "2030-01-03T00:00:00", "starts_before": "2030-01-05T10:00:00"},
+    )
+
+    expected = sorted(
+        (e for e in everything if "2030-01-03T00:00:00" <= e["start_time"] < "2030-01-05T10:00:00"),
+        key=lambda e: (e["start_time"], e["id"]),
+    )
+    assert response.status_code == 200
+    assert [e["id"] for e in response.json()] == [e["id"] for e in expected]
+    assert expected
+
+
+def test_calendar_buckets_a_week_by_default(api, events):
+    everything = api.as_user(ADMIN).get("/api/v1/events/").json()
+
+    response = api.get("/api/v1/events/calendar", params={"start": "2030-01-02"})
+
+    days = response.json()
+    assert response.status_code == 200
+    assert list(days) == [f"2030-01-{day:02d}" for day in range(2, 9)]
+    for day, bucket in days.items():
+        assert [e["id"] for e in bucket] == [e["id"] for e in everything if e["start_time"].startswith(day)]
+
+
+FIRST_DAY = date(2030, 1, 1)
+
+
+@pytest.mark.parametrize(
+    "end, status_code",
+    [
+        (FIRST_DAY, 400),
+        (FIRST_DAY - timedelta(days=1), 400),
+        (FIRST_DAY + timedelta(days=CALENDAR_MAX_DAYS + 1), 400),
+        (FIRST_DAY + timedelta(days=CALENDAR_MAX_DAYS), 200),
+    ],
+)
+def test_calendar_range_limits(api, events, end, status_code):
+    response = api.as_user(STUDENT).get(
+        "/api/v1/events/calendar", params={"start": FIRST_DAY.isoformat(), "end": end.isoformat()}
+    )
+
+    assert response.status_code == status_code
+
+
+def test_fields_narrow_each_row_and_keep_the_id(api, events):
+    response = api.as_user(ADMIN).get("/api/v1/events/", params={"fields": "name, status,name"})
+
+    assert response.status_code == 200
+    assert response.json()
+    assert all(list(row) == ["id", "name", "status"] for row in response.json())
+
+
+def test_fields_can_ask_for_computed_fields(api, events, session_factory):
+    with session_factory() as db:
+        db.get(EventModel, 5).image_key = "abc"  # POSTED
+        db.commit()
+
+    response = api.as_user(ADMIN).get("/api/v1/events/", params={"fields": "thumbnail_url"})
+
+    rows = {row["id"]: row for row in response.json()}
+    assert response.status_code == 200
+    assert rows[5] == {"id": 5, "thumbnail_url": list_thumbnail_url("abc")}
+    assert rows[6] == {"id": 6, "thumbnail_url": None}
+
+
+@pytest.mark.parametrize("fields", ["name,hashed_password", "club"])
+def test_unknown_fields_are_rejected(api, events, fields):
+    response = api.as_user(ADMIN).get("/api/v1/events/", params={"fields": fields})
+
+    assert response.status_code == 400
+    assert response.json()["detail"].startswith("Unknown fields")
+
+
+@pytest.fixture
+def probe(api, events, monkeypatch):
+    """Posts probes as the club owner and returns the embeddings the matcher was asked about."""
+    seen = []
+
+    def match(embedding):
+        seen.append(embedding)
+        return None
+
+    monkeypatch.setattr(event_router.face_matcher, "match", match)
+    monkeypatch.setattr(event_router.recent_matches, "find", lambda event_id, embedding: None)
+    api.as_user(OWNER)
+    return seen
+
+
+def embedding(dtype="<f4"):
+    return np.linspace(-1, 1, 128).astype(dtype)
+
+
+def test_probe_as_octet_stream(api, probe):
+    response = api.post(
+        "/api/v1/events/attendbyface",
+        params={"event_id": 2, "face_id": "f", "modelName": "FaceNet", "dtype": "float16"},
+        content=embedding("<f2").tobytes(),
+        headers={"content-type": "application/octet-stream"},
+    )
+
+    assert response.status_code == 404
+    assert probe[0].dtype == np.float32
+    np.testing.assert_array_equal(probe[0], embedding("<f2").astype(np.float32))
+
+
+def test_probe_as_base64(api, probe):
+    body = {
+        "embedding_b64": base64.b64encode(embedding().tobytes()).decode(),
+        "modelName": "FaceNet",
+        "event_id": 2,
+        "face_id": "f",
+    }
+
+    response = api.post("/api/v1/events/attendbyface", json=body)
+
+    assert response.status_code == 404
+    np.testing.assert_array_equal(probe[0], embedding())
+
+
+@pytest.mark.parametrize(
+    "request_kwargs, status_code",
+    [
+        # query parameters missing
+        ({"content": embedding().tobytes(), "headers": {"content-type": "application/octet-stream"}}, 400),
+        # one float short
+        (
+            {
+                "params": {"event_id": 2, "face_id": "f", "modelName": "FaceNet"},
+                "content": embedding()[:-1].tobytes(),
+                "headers": {"content-type": "application/octet-stream"},
+            },
+            400,
+        ),
+        ({"json": {"embedding_b64": "not base64!", "modelName": "FaceNet", "event_id": 2, "face_id": "f"}}, 400),
+        (
+            {
+                "json": {
+                    "embedding_b64": base64.b64encode(np.full(128, np.nan, "<f4").tobytes()).decode(),
+                    "modelName": "FaceNet",
+                    "event_id": 2,
+                    "face_id": "f",
+                }
+            },
+            422,
+        ),
+        ({"json": {"modelName": "FaceNet", "event_id": 2, "face_id": "f"}}, 400),
+    ],
+)
+def test_bad_probes_are_rejected(api, probe, request_kwargs, status_code):
+    response = api.post("/api/v1/events/attendbyface", **request_kwargs)
+
+    assert response.status_code == status_code
+    assert probe == []
@@ -0,0 +1,36 @@
+import pytest
+
+from app.model.enums import UserRoleType
+from app.model.model import User as UserModel
+
+ADMIN, STUDENT = 1, 2
+
+
+@pytest.fixture
+def users(session_factory):
+    with session_factory() as db:
+        for user_id, role in [(ADMIN, UserRoleType.SAO_ADMIN), (STUDENT, UserRoleType.STUDENT)]:
+            db.add(
+                UserModel(
+                    id=user_id, student_id=user_id, name=f"user {user_id}",
+                    email=f"user{user_id}@example.com", hashed_password="x", role=role,
+                )
+            )
+        db.commit()
+
+
+def test_fields_narrow_the_user_list(api, users):
+    response = api.as_user(ADMIN).get("/api/v1/users/", params={"fields": "email"})
+
+    assert response.status_code == 200
+    assert response.json() == [
+        {"id": ADMIN, "email": "user1@example.com"},
+        {"id": STUDENT, "email": "user2@example.com"},
+    ]
+
+
+def test_fields_cannot_reach_columns_outside_the_schema(api, users):
+    response = api.as_user(ADMIN).get("/api/v1/users/", params={"fields": "id,hashed_password"})
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Unknown fields: hashed_password"
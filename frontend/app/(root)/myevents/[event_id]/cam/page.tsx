@@ -5,7 +5,11 @@ import Webcam from "react-webcam";
 import * as tf from "@tensorflow/tfjs";
 import * as blazeface from "@tensorflow-models/blazeface";
 import { detectFacesInVideo } from "@/lib/faceDetection";
-import { faceEmbeddingService, EmbeddingResult } from "@/lib/faceEmbedding";
+import {
+  faceEmbeddingService,
+  EmbeddingResult,
+  encodeEmbedding,
+} from "@/lib/faceEmbedding";
 import { Button } from "@/components/ui/button";
 import { Card, CardContent, CardHeader, CardTitle } from "@/components/ui/card";
 import { Alert, AlertDescription } from "@/components/ui/alert";
@@ -211,7 +215,8 @@ export default function AlternativeAttendancePage({
 
         // Send embedding to backend
         const backendPayload = {
-          embedding: embeddingResult.embedding,
+          embedding_b64: encodeEmbedding(embeddingResult.embedding),
+          dtype: "float32" as const,
           modelName: embeddingResult.modelName,
           event_id: eventId,
           face_id: faceId,
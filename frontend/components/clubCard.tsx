@@ -9,11 +9,13 @@ import {
   CardHeader,
   CardTitle,
 } from "@/components/ui/card";
+import { mediaUrl } from "@/lib/utils";
 
 interface ClubCardData {
   name: string;
   description?: string;
   image_url?: string;
+  thumbnail_url?: string | null;
   color_code?: string;
 }
 
@@ -23,7 +25,10 @@ export default function ClubCard(data: ClubCardData) {
     <Card className={`p-3 m-5 border-[${data.color_code}]`}>
       <CardHeader>
         <CardTitle>{data.name}</CardTitle>
-        <img src={data.image_url} />
+        <img
+          src={data.thumbnail_url ? mediaUrl(data.thumbnail_url) : data.image_url}
+          loading="lazy"
+        />
         <CardDescription>{data.description}</CardDescription>
       </CardHeader>
       <CardContent>
@@ -13,6 +13,7 @@ import {
   DropdownMenuTrigger,
 } from "@/components/ui/dropdown-menu";
 import { Button } from "@/components/ui/button";
+import { mediaUrl } from "@/lib/utils";
 
 interface EventsDisplayProps {
   data: Event[];
@@ -198,7 +199,18 @@ const EventsDisplay: React.FunctionComponent<EventsDisplayProps> = ({
             className="overflow-hidden hover:shadow-lg transition-shadow duration-300"
           >
             <div className="relative">
-              {event.image_url ? (
+              {event.thumbnail_url ? (
+                <div className="relative h-48 w-full">
+                  {/* already resized by the backend */}
+                  <Image
+                    src={mediaUrl(event.thumbnail_url)}
+                    alt={event.name}
+                    fill
+                    unoptimized
+                    className="object-cover"
+                  />
+                </div>
+              ) : event.image_url ? (
                 <div className="relative h-48 w-full">
                   <Image
                     src={event.image_url}
@@ -591,8 +591,53 @@ export async function getClubs(
   return response.json();
 }
 
+// Fetch many events, clubs or users in one request, keyed by id
+// Ids that do not exist or are not visible to the caller are missing from the result
+async function getBatch<T>(
+  resource: "events" | "clubs" | "users",
+  ids: number[]
+): Promise<Record<number, T>> {
+  if (ids.length === 0) {
+    return {};
+  }
+  const token = await getBearerToken();
+  const response = await fetch(
+    `${process.env.NEXT_PUBLIC_API_BASE_URL}/${resource}/batch?ids=${ids.join(",")}`,
+    token ? { headers: { Authorization: `Bearer ${token}` } } : undefined
+  );
+  if (!response.ok) {
+    const errorData = await response
+      .json()
+      .catch(() => ({ detail: `Failed to fetch ${resource}` }));
+    throw {
+      status: response.status,
+      message: errorData.detail || `HTTP error ${response.status}`,
+    };
+  }
+  return response.json();
+}
+
+export async function getEventsByIds(
+  ids: number[]
+): Promise<Record<number, Event>> {
+  return getBatch<Event>("events", ids);
+}
+
+export async function getClubsByIds(
+  ids: number[]
+): Promise<Record<number, Club>> {
+  return getBatch<Club>("clubs", ids);
+}
+
+export async function getUsersByIds(
+  ids: number[]
+): Promise<Record<number, User>> {
+  return getBatch<User>("users", ids);
+}
+
 export async function registerattendance(reqpayload: {
-  embedding: number[];
+  embedding_b64: string;
+  dtype: "float32";
   modelName: string;
   event_id: string;
   face_id: string;
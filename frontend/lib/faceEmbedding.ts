@@ -333,5 +333,21 @@ export class FaceEmbeddingService {
   }
 }
 
+/**
+ * Encode an embedding as base64 little-endian float32 for the backend's
+ * `embedding_b64` field (684 characters instead of ~2.7KB of JSON floats)
+ */
+export function encodeEmbedding(embedding: number[]): string {
+  const view = new DataView(new ArrayBuffer(embedding.length * 4));
+  embedding.forEach((value, i) => view.setFloat32(i * 4, value, true));
+
+  let binary = "";
+  const bytes = new Uint8Array(view.buffer);
+  for (let i = 0; i < bytes.length; i++) {
+    binary += String.fromCharCode(bytes[i]);
+  }
+  return btoa(binary);
+}
+
 // Export a singleton instance
 export const faceEmbeddingService = new FaceEmbeddingService();
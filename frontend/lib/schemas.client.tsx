@@ -45,6 +45,7 @@ export type Event = {
   status: "IDEATION" | "PLANNING" | "POSTED" | "PENDING" | "CURRENT" | "PAST";
   description: string | undefined;
   image_url: string | undefined;
+  thumbnail_url?: string | null;
   location: string | undefined;
   start_time: string | undefined;
   end_time: string | undefined;
@@ -69,6 +70,7 @@ export type Club = {
   name: string;
   description?: string;
   image_url?: string;
+  thumbnail_url?: string | null;
   color_code?: string;
   is_active?: boolean;
   manager_id?: number;
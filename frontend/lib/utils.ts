@@ -4,3 +4,8 @@ import { twMerge } from "tailwind-merge"
 export function cn(...inputs: ClassValue[]) {
   return twMerge(clsx(inputs))
 }
+
+// media paths from the API (/api/v1/media/...) live on the backend's origin
+export function mediaUrl(path: string) {
+  return new URL(path, process.env.NEXT_PUBLIC_API_BASE_URL).toString()
+}